@@ -0,0 +1,78 @@
+"""
+Measure the trade-off between compression ratio and throughput for the codecs
+used to send BlueskyRun partitions from the intake server to the client.
+
+With intake-bluesky installed (for example with ``pip install -e .``), run:
+
+    python benchmarks/compression.py
+
+For each codec and level it reports the compression ratio and the compress
+(server) and decompress (client) throughput for one partition of a run with
+scalar data and one partition of a run with images.
+"""
+import event_model
+import numpy
+import time
+
+from intake.container import serializer
+from intake_bluesky import core
+
+LEVELS = {'zlib': [1, 6, 9], 'lz4': [0, 3, 9], 'zstd': [1, 3, 9]}
+REPEAT = 5
+
+
+def partition(shape):
+    "Return one filled partition (a list of (name, doc) pairs) of a run."
+    run_bundle = event_model.compose_run()
+    desc_bundle = run_bundle.compose_descriptor(
+        data_keys={'x': {'source': '...', 'shape': list(shape),
+                         'dtype': 'array' if shape else 'number'}},
+        name='primary')
+    docs = [('start', run_bundle.start_doc),
+            ('descriptor', desc_bundle.descriptor_doc)]
+    for i in range(core.BlueskyRun.PARTITION_SIZE):
+        data = numpy.random.poisson(100, shape) if shape else 1.5 * i
+        docs.append(('event', desc_bundle.compose_event(
+            data={'x': data}, timestamps={'x': time.time()}, seq_num=i + 1)))
+    docs.append(('stop', run_bundle.compose_stop()))
+
+    def gen():
+        yield from docs
+
+    run = core.BlueskyRunFromGenerator(gen, (), {})
+    return run.read_partition((0, False))
+
+
+def timed(func, data):
+    best = float('inf')
+    for _ in range(REPEAT):
+        t0 = time.perf_counter()
+        result = func(data)
+        best = min(best, time.perf_counter() - t0)
+    return result, best
+
+
+def main():
+    encoder = serializer.format_registry['pickle2']
+    print(f"{'data':<8}{'codec':<8}{'level':>6}{'ratio':>8}"
+          f"{'compress MB/s':>16}{'decompress MB/s':>18}")
+    for label, shape in [('scalar', ()), ('image', (256, 256))]:
+        raw = encoder.encode(partition(shape), 'bluesky-run')
+        megabytes = len(raw) / 1e6
+        for compressor_class in core.COMPRESSORS:
+            name = compressor_class.name
+            if name not in serializer.compression_registry:
+                print(f"{label:<8}{name:<8}  (not installed)")
+                continue
+            for level in LEVELS[name]:
+                compressor = compressor_class(level=level)
+                compressed, t_compress = timed(compressor.compress, raw)
+                _, t_decompress = timed(compressor.decompress, compressed)
+                print(f"{label:<8}{name:<8}{level:>6}"
+                      f"{len(raw) / len(compressed):>8.2f}"
+                      f"{megabytes / t_compress:>16.1f}"
+                      f"{megabytes / t_decompress:>18.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,24 +1,28 @@
+import bisect
 import collections
+import concurrent.futures
 import copy
 import event_model
 from datetime import datetime
-import dask
-import dask.bag
-from dask import array
 import functools
+import hashlib
 import heapq
 import importlib
+import importlib.util
 import itertools
 import intake.catalog.base
 import intake.container.base
 import intake_xarray.base
-from intake.compat import unpack_kwargs
-import msgpack
-import requests
-from requests.compat import urljoin
 import numpy
+import os
+import tempfile
+import threading
 import warnings
-import xarray
+
+# The heavier dependencies (dask.array, dask.bag, xarray, requests, msgpack)
+# are imported inside the functions that use them. Every Catalog in this
+# package imports this module, and merely listing or searching a Catalog
+# should not pay for them.
 
 
 def to_event_pages(get_event_cursor, page_size):
@@ -121,6 +125,29 @@ def interlace_event_pages(*gens):
         safe_next(indx)
 
 
+def _interlace_order(times):
+    """
+    Given the times of the Events of each descriptor, return the index of the
+    descriptor of each Event in the order that interlace_event_pages yields
+    them, as an array.
+    """
+    arrays = [numpy.asarray(descriptor_times, dtype=float)
+              for descriptor_times in times]
+    indexes = numpy.concatenate(
+        [numpy.full(len(array), i, dtype=numpy.intp)
+         for i, array in enumerate(arrays)])
+    if all(numpy.all(array[1:] >= array[:-1]) for array in arrays):
+        # Each descriptor's Events are in time order, so interlacing them is
+        # a stable sort by time, then by descriptor.
+        order = numpy.lexsort((indexes, numpy.concatenate(arrays)))
+        return indexes[order]
+    # Replay the merge itself.
+    merged = heapq.merge(*(zip(descriptor_times, itertools.repeat(i))
+                           for i, descriptor_times in enumerate(times)))
+    return numpy.fromiter((i for _, i in merged), dtype=numpy.intp,
+                          count=len(indexes))
+
+
 def interlace_event_page_chunks(*gens, chunk_size):
     """
     Take event_page generators and interlace their results by timestamp.
@@ -192,6 +219,8 @@ def documents_to_xarray(*, start_doc, stop_doc, descriptor_docs,
     -------
     dataset : xarray.Dataset
     """
+    import xarray
+
     if include is None:
         include = []
     if exclude is None:
@@ -328,6 +357,538 @@ def documents_to_xarray(*, start_doc, stop_doc, descriptor_docs,
     return xarray.merge(datasets)
 
 
+# Maps a server's root URL to the requests.Session shared by every
+# RemoteBlueskyRun that talks to that server.
+_http_sessions = {}
+_http_sessions_lock = threading.Lock()
+
+
+def get_http_session(url, pool_maxsize=10):
+    """
+    Get the requests.Session shared by all RemoteBlueskyRuns on one server.
+
+    Reusing one Session keeps the TCP (and TLS) connections to the server
+    alive between requests instead of opening a new one for each request.
+
+    Parameters
+    ----------
+    url : str
+        Address of the server. Only the scheme, host, and port matter.
+    pool_maxsize : int, optional
+        Maximum number of connections to keep open to the server. This is
+        only used when the Session for this server is first created.
+
+    Returns
+    -------
+    session : requests.Session
+    """
+    import requests
+    import requests.adapters
+    from requests.compat import urljoin
+
+    root = urljoin(url, '/')
+    with _http_sessions_lock:
+        try:
+            return _http_sessions[root]
+        except KeyError:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                    pool_maxsize=pool_maxsize)
+            session.mount(root, adapter)
+            _http_sessions[root] = session
+            return session
+
+
+class _Compressor:
+    """
+    A codec for intake's compression registry.
+
+    Parameters
+    ----------
+    level : int, optional
+        Compression level used when the server encodes a partition. Raise it
+        to trade CPU time for bandwidth. By default, ``DEFAULT_LEVEL``.
+    """
+    name = None
+    module_name = None
+    DEFAULT_LEVEL = None
+
+    def __init__(self, level=None):
+        self.level = self.DEFAULT_LEVEL if level is None else level
+
+
+class ZstdCompressor(_Compressor):
+    name = 'zstd'
+    module_name = 'zstandard'
+    DEFAULT_LEVEL = 3
+
+    def compress(self, data):
+        import zstandard
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def decompress(self, data):
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+
+
+class LZ4Compressor(_Compressor):
+    name = 'lz4'
+    module_name = 'lz4'
+    DEFAULT_LEVEL = 0
+
+    def compress(self, data):
+        import lz4.frame
+        return lz4.frame.compress(data, compression_level=self.level)
+
+    def decompress(self, data):
+        import lz4.frame
+        return lz4.frame.decompress(data)
+
+
+class ZlibCompressor(_Compressor):
+    name = 'zlib'
+    module_name = 'zlib'
+    DEFAULT_LEVEL = 1
+
+    def compress(self, data):
+        import zlib
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        import zlib
+        return zlib.decompress(data)
+
+
+# In ascending order of preference, which is the order in which the client
+# must list them: the intake server uses the last codec it also supports.
+COMPRESSORS = [ZlibCompressor, LZ4Compressor, ZstdCompressor]
+
+
+def _register_compressors(levels=None):
+    """
+    Add the codecs that can be imported here to intake's compression registry.
+
+    Both the server (which imports this module to serve a BlueskyRun) and the
+    client consult that registry, so a codec is used only if both have it.
+
+    Parameters
+    ----------
+    levels : dict, optional
+        Maps codec names to the compression levels to use, replacing the
+        codecs already registered. Codecs not named use their default level.
+    """
+    from intake.container import serializer
+
+    levels = levels or {}
+    unknown = set(levels) - {cls.name for cls in COMPRESSORS}
+    if unknown:
+        raise ValueError(f"Unknown compression codecs: {sorted(unknown)}")
+    for compressor_class in COMPRESSORS:
+        name = compressor_class.name
+        if importlib.util.find_spec(compressor_class.module_name) is None:
+            continue
+        if name in levels or name not in serializer.compression_registry:
+            serializer.compression_registry[name] = compressor_class(
+                level=levels.get(name))
+
+
+_register_compressors()
+
+
+def get_partition(url, http_args, source_id, container, partition,
+                  formats=None):
+    """
+    Fetch one partition of a remote data source.
+
+    This does the same thing as ``intake.container.base.get_partition``, but
+    it uses the pooled connections from :func:`get_http_session` and asks
+    for the best compression codec available (see ``COMPRESSORS``). Like
+    that function, it takes only serializable arguments, so it can be wrapped
+    in ``dask.delayed``.
+
+    Parameters
+    ----------
+    url : str
+        Address of the server
+    http_args : dict
+        Passed through to ``requests.Session.post``, e.g. ``{'headers': {}}``
+    source_id : str
+        ID of the source in the server's cache
+    container : str
+        Type of data, such as 'bluesky-run'
+    partition : serializable
+        The partition to fetch
+    formats : list, optional
+        Serialization formats to accept. By default, any that intake knows.
+
+    Returns
+    -------
+    chunk
+    """
+    from intake.compat import pack_kwargs, unpack_kwargs
+    from intake.container import serializer
+    import msgpack
+    from requests.compat import urljoin
+
+    if formats is None:
+        formats = list(serializer.format_registry)
+    accepted_compression = ['none'] + [
+        compressor.name for compressor in COMPRESSORS
+        if compressor.name in serializer.compression_registry]
+    payload = dict(action='read',
+                   source_id=source_id,
+                   accepted_formats=formats,
+                   accepted_compression=accepted_compression,
+                   partition=partition)
+    session = get_http_session(url)
+    with session.post(urljoin(url, '/v1/source'),
+                      data=msgpack.packb(payload, **pack_kwargs),
+                      **http_args) as resp:
+        resp.raise_for_status()
+        msg = msgpack.unpackb(resp.content, **unpack_kwargs)
+    compressor = serializer.compression_registry[msg['compression']]
+    encoder = serializer.format_registry[msg['format']]
+    return encoder.decode(compressor.decompress(msg['data']), container)
+
+
+def open_remote_source(url, http_args, name, parameters):
+    """
+    Ask the server to open a source and return its response.
+
+    Parameters
+    ----------
+    url : str
+        Address of the server
+    http_args : dict
+        Passed through to ``requests.Session.post``, e.g. ``{'headers': {}}``
+    name : str
+        Name of the entry to open
+    parameters : dict
+        Passed to the server when it instantiates the source
+
+    Returns
+    -------
+    response : dict
+        Includes 'source_id', 'npartitions', and 'metadata'
+    """
+    from intake.compat import pack_kwargs, unpack_kwargs
+    import msgpack
+    from requests.compat import urljoin
+
+    payload = dict(action='open', name=name, parameters=parameters)
+    session = get_http_session(url)
+    with session.post(urljoin(url, '/v1/source'),
+                      data=msgpack.packb(payload, **pack_kwargs),
+                      **http_args) as resp:
+        resp.raise_for_status()
+        return msgpack.unpackb(resp.content, **unpack_kwargs)
+
+
+# msgpack extension types used by PartitionCache for numpy data
+_EXT_NDARRAY = 1
+_EXT_NUMPY_SCALAR = 2
+
+
+def _pack_numpy(obj):
+    "Pack numpy data for msgpack as encode_array does: raw bytes, dtype, shape"
+    import msgpack
+
+    if isinstance(obj, numpy.ndarray):
+        code = _EXT_NDARRAY
+    elif isinstance(obj, numpy.generic):
+        code = _EXT_NUMPY_SCALAR
+        obj = numpy.asarray(obj)
+    else:
+        raise TypeError(f"Cannot serialize {type(obj)!r}")
+    return msgpack.ExtType(code, _pack_partition(encode_array(obj)))
+
+
+def _unpack_numpy(code, data):
+    array = decode_array(_unpack_partition(data))
+    if code == _EXT_NUMPY_SCALAR:
+        return array[()]
+    return array
+
+
+def _pack_partition(partition):
+    import msgpack
+
+    return msgpack.packb(partition, default=_pack_numpy, use_bin_type=True)
+
+
+def _unpack_partition(blob):
+    import msgpack
+
+    return msgpack.unpackb(blob, ext_hook=_unpack_numpy, raw=False,
+                           strict_map_key=False,
+                           max_bin_len=len(blob), max_str_len=len(blob))
+
+
+class PartitionCache:
+    """
+    A least-recently-used cache of remote partitions, in memory and on disk.
+
+    Partitions are stored as msgpack, with each array as its dtype, shape,
+    and raw bytes (as by :func:`encode_array`). Unlike a pickle, a file in
+    the cache cannot make reading it run code. Sequences come back as lists.
+    A hit in memory is served from there; a hit on disk is also promoted into
+    memory. Each tier evicts its least recently used partitions once it holds
+    more than its limit.
+
+    Parameters
+    ----------
+    directory : str, optional
+        Where to keep partitions on disk. If None, only memory is used.
+        Several processes may share one directory.
+    memory_limit : int, optional
+        Maximum total size, in bytes, of the partitions held in memory.
+        Default is 256 MB.
+    disk_limit : int, optional
+        Maximum total size, in bytes, of the partitions held on disk.
+        Default is 10 GB.
+
+    Examples
+    --------
+    Replay completed remote runs from local storage.
+
+    >>> RemoteBlueskyRun.PARTITION_CACHE = PartitionCache('~/.cache/bluesky')
+    """
+    SUFFIX = '.msgpack'
+
+    def __init__(self, directory=None, memory_limit=256 * 2**20,
+                 disk_limit=10 * 2**30):
+        if directory is not None:
+            directory = os.path.expanduser(directory)
+            os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self._memory = collections.OrderedDict()
+        self._memory_size = 0
+        self._disk_size = None  # Measured when first needed
+        self._lock = threading.RLock()
+
+    def _path(self, key):
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()
+        return os.path.join(self.directory, digest + self.SUFFIX)
+
+    def get(self, key):
+        """
+        Return the cached partition, or None if there is none.
+        """
+        with self._lock:
+            blob = self._memory.get(key)
+            if blob is not None:
+                self._memory.move_to_end(key)
+        if blob is None and self.directory is not None:
+            path = self._path(key)
+            try:
+                with open(path, 'rb') as file:
+                    blob = file.read()
+                os.utime(path)  # Mark it as recently used.
+            except FileNotFoundError:
+                return None
+            self._remember(key, blob)
+        if blob is None:
+            return None
+        # Decode every time, so that callers cannot alter the cached copy.
+        try:
+            partition = _unpack_partition(blob)
+            if not isinstance(partition, list):
+                raise TypeError("A partition is a list.")
+            return partition
+        except (ValueError, TypeError, KeyError):
+            # Truncated (by a crash while it was being written) or written in
+            # another format: drop it, so that it is fetched again. (msgpack's
+            # errors are all ValueErrors.)
+            self._forget(key)
+            return None
+
+    def put(self, key, partition):
+        """
+        Add a partition to the cache.
+        """
+        blob = _pack_partition(partition)
+        self._remember(key, blob)
+        if self.directory is not None:
+            # Write then rename, so readers never see a partial file.
+            fd, temp_path = tempfile.mkstemp(dir=self.directory,
+                                             suffix='.tmp')
+            with os.fdopen(fd, 'wb') as file:
+                file.write(blob)
+            os.replace(temp_path, self._path(key))
+            with self._lock:
+                if self._disk_size is not None:
+                    self._disk_size += len(blob)
+                self._evict_from_disk()
+
+    def clear(self):
+        """
+        Remove every partition, from memory and from disk.
+        """
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+            if self.directory is not None:
+                for entry in os.scandir(self.directory):
+                    if entry.name.endswith(self.SUFFIX):
+                        os.remove(entry.path)
+                self._disk_size = 0
+
+    def _forget(self, key):
+        with self._lock:
+            blob = self._memory.pop(key, None)
+            if blob is not None:
+                self._memory_size -= len(blob)
+            if self.directory is not None:
+                path = self._path(key)
+                try:
+                    size = os.stat(path).st_size
+                    os.remove(path)
+                except FileNotFoundError:
+                    return
+                if self._disk_size is not None:
+                    self._disk_size -= size
+
+    def _remember(self, key, blob):
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_size -= len(old)
+            if len(blob) > self.memory_limit:
+                return
+            self._memory[key] = blob
+            self._memory_size += len(blob)
+            while self._memory_size > self.memory_limit:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted)
+
+    def _evict_from_disk(self):
+        # The running total is only an estimate (other processes may share
+        # the directory), so measure the directory before evicting anything.
+        if self._disk_size is not None and self._disk_size <= self.disk_limit:
+            return
+        entries = [entry for entry in os.scandir(self.directory)
+                   if entry.name.endswith(self.SUFFIX)]
+        stats = [(entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                 for entry in entries]
+        self._disk_size = sum(size for _, size, _ in stats)
+        for _, size, path in sorted(stats):
+            if self._disk_size <= self.disk_limit:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._disk_size -= size
+
+
+# Served by intake_bluesky.server.BlueskyIntakeServer, not by the standard
+# intake server
+STREAMING_ENDPOINT = '/v1/bluesky/canonical'
+
+# Root URLs of the servers that turned out not to serve STREAMING_ENDPOINT
+_servers_without_streaming = set()
+
+
+def open_document_stream(url, http_args, source_id, raw):
+    """
+    Ask the server to stream all the documents of an open BlueskyRun.
+
+    Parameters
+    ----------
+    url : str
+        Address of the server
+    http_args : dict
+        Passed through to ``requests.Session.post``, e.g. ``{'headers': {}}``
+    source_id : str
+        The source_id that the server gave the BlueskyRun when it opened it
+    raw : bool
+        If True, the documents are not filled.
+
+    Returns
+    -------
+    documents : generator or None
+        Yields ``(name, doc)`` pairs as they arrive. None if the server does
+        not support streaming.
+    """
+    from intake.compat import pack_kwargs
+    import msgpack
+    from requests.compat import urljoin
+
+    payload = dict(source_id=source_id, raw=raw)
+    session = get_http_session(url)
+    resp = session.post(urljoin(url, STREAMING_ENDPOINT),
+                        data=msgpack.packb(payload, **pack_kwargs),
+                        stream=True, **http_args)
+    if resp.status_code == 404:
+        resp.close()
+        return None
+    resp.raise_for_status()
+    return _unpack_document_stream(resp)
+
+
+def _unpack_document_stream(resp):
+    import msgpack
+    import msgpack_numpy
+
+    unpacker = msgpack.Unpacker(object_hook=msgpack_numpy.decode, raw=False,
+                                max_buffer_size=1_000_000_000)
+    with resp:
+        for chunk in resp.iter_content(chunk_size=2**16):
+            unpacker.feed(chunk)
+            for name, doc in unpacker:
+                yield name, doc
+
+
+def encode_array(array):
+    """
+    Pack an array as its dtype, shape, and one contiguous buffer of bytes.
+
+    Arrays of Python objects, which have no such buffer, are packed as nested
+    lists instead.
+
+    Parameters
+    ----------
+    array : numpy.ndarray
+
+    Returns
+    -------
+    encoded : dict
+        Safe to serialize with msgpack
+    """
+    # Not ascontiguousarray, which would make 0-d arrays 1-d. tobytes() copies
+    # in C order anyway.
+    array = numpy.asarray(array)
+    if array.dtype.hasobject:
+        return {'dtype': 'object', 'shape': list(array.shape),
+                'data': array.tolist()}
+    return {'dtype': array.dtype.str, 'shape': list(array.shape),
+            'data': array.tobytes()}
+
+
+def decode_array(encoded):
+    """
+    Inverse of :func:`encode_array`.
+
+    The result is a read-only view on the received bytes, not a copy.
+
+    Parameters
+    ----------
+    encoded : dict
+
+    Returns
+    -------
+    array : numpy.ndarray
+    """
+    if encoded['dtype'] == 'object':
+        array = numpy.empty(encoded['shape'], dtype=object)
+        array[...] = encoded['data']
+        return array
+    return (numpy.frombuffer(encoded['data'], dtype=encoded['dtype'])
+            .reshape(encoded['shape']))
+
+
 class RemoteBlueskyRun(intake.catalog.base.RemoteCatalog):
     """
     Catalog representing one Run.
@@ -347,35 +908,66 @@ class RemoteBlueskyRun(intake.catalog.base.RemoteCatalog):
     metadata: dict
         Additional info
     kwargs: ignored
+
+    All runs from the same server share one pool of keep-alive connections
+    (see :func:`get_http_session`). Its size may be changed by setting
+    ``RemoteBlueskyRun.HTTP_POOL_MAXSIZE`` before the first run is opened.
+
+    When replaying the run, up to ``PARTITION_CONCURRENCY`` partitions are
+    requested at once. Documents are still yielded in order.
+
+    If ``RemoteBlueskyRun.PARTITION_CACHE`` is set to a
+    :class:`PartitionCache`, the partitions of completed runs (those with a
+    RunStop document) are kept there and are not downloaded again.
+
+    Otherwise, if the server is an
+    :class:`intake_bluesky.server.BlueskyIntakeServer`, the run is replayed
+    from one streamed response instead of one request per partition. Set
+    ``STREAMING = False`` to turn that off.
     """
     name = 'bluesky-run'
+    HTTP_POOL_MAXSIZE = 10
+    PARTITION_CONCURRENCY = 4
+    PARTITION_CACHE = None
+    STREAMING = True
 
     def __init__(self, url, http_args, name, parameters, metadata=None, **kwargs):
+        # The list of streams is fetched when it is first needed (see reload),
+        # not while the run is being opened.
+        self._streams_loaded = False
+        self._stream_names = None
         super().__init__(url=url, http_args=http_args, name=name,
                          metadata=metadata)
         self.url = url
         self.name = name
         self.parameters = parameters
         self.http_args = http_args
+        # Create the connection pool for this server, if it does not exist.
+        get_http_session(url, self.HTTP_POOL_MAXSIZE)
         self._source_id = None
         self.metadata = metadata or {}
+        # When opened through a RemoteCatalog, the server's response to
+        # 'open' is passed in here, so there is no need to open it again.
+        self._open_response = (dict(kwargs, metadata=self.metadata)
+                               if 'source_id' in kwargs else None)
         self._get_source_id()
         self.bag = None
 
     def _get_source_id(self):
         if self._source_id is None:
-            payload = dict(action='open', name=self.name,
-                           parameters=self.parameters)
-            req = requests.post(urljoin(self.url, '/v1/source'),
-                                data=msgpack.packb(payload, use_bin_type=True),
-                                **self.http_args)
-            req.raise_for_status()
-            response = msgpack.unpackb(req.content, **unpack_kwargs)
+            response = self._open_response
+            if response is None:
+                response = open_remote_source(self.url, self.http_args,
+                                              self.name, self.parameters)
             self._parse_open_response(response)
 
     def _parse_open_response(self, response):
         self.npartitions = response['npartitions']
         self.metadata = response['metadata']
+        # Servers running older versions of this package do not send these.
+        self._stream_names = response.get('stream_names')
+        self._partition_size = response.get('partition_size')
+        self._source_version = response.get('source_version')
         self._schema = intake.source.base.Schema(
             datashape=None, dtype=None,
             shape=self.shape,
@@ -383,15 +975,25 @@ class RemoteBlueskyRun(intake.catalog.base.RemoteCatalog):
             metadata=self.metadata)
         self._source_id = response['source_id']
 
+    def _load(self):
+        if self._source_id is not None:
+            super()._load()
+            self._streams_loaded = True
+
+    def reload(self):
+        if not self._streams_loaded:
+            self.force_reload()
+        else:
+            super().reload()
+
     def _load_metadata(self):
         if self.bag is None:
-            self.raw_parts = [dask.delayed(intake.container.base.get_partition)(
-                self.url, self.http_args, self._source_id, self.container, (i, True)
-            )
-                          for i in range(self.npartitions)]
-            self.parts = [dask.delayed(intake.container.base.get_partition)(
-                self.url, self.http_args, self._source_id, self.container, (i, False)
-            )
+            import dask
+            import dask.bag
+
+            self.raw_parts = [dask.delayed(self._fetch_partition)((i, True))
+                              for i in range(self.npartitions)]
+            self.parts = [dask.delayed(self._fetch_partition)((i, False))
                           for i in range(self.npartitions)]
             self.bag = dask.bag.from_delayed(self.parts)
         return self._schema
@@ -405,6 +1007,25 @@ class RemoteBlueskyRun(intake.catalog.base.RemoteCatalog):
             parts = self.parts
         return parts[i].compute()
 
+    def _fetch_partition(self, index):
+        """
+        Fetch one partition, from the PARTITION_CACHE if possible.
+        """
+        cache = self.PARTITION_CACHE
+        # A run without a RunStop may still be growing.
+        if cache is None or not self.metadata.get('stop'):
+            return get_partition(self.url, self.http_args, self._source_id,
+                                 self.container, index)
+        i, raw = index
+        key = (self.url, self.metadata['start']['uid'], self._partition_size,
+               self._source_version, raw, i)
+        partition = cache.get(key)
+        if partition is None:
+            partition = get_partition(self.url, self.http_args,
+                                      self._source_id, self.container, index)
+            cache.put(key, partition)
+        return partition
+
     def read(self):
         raise NotImplementedError(
             "Reading the BlueskyRun itself is not supported. Instead read one "
@@ -418,11 +1039,54 @@ class RemoteBlueskyRun(intake.catalog.base.RemoteCatalog):
     def _close(self):
         self.bag = None
 
-    def canonical(self):
-        for i in range(self.npartitions):
-            for name, doc in self._get_partition((i, False)):
+    def _partitions(self, raw):
+        """
+        Yield the payload of each partition, in order.
+
+        Up to PARTITION_CONCURRENCY requests are kept in flight, so replaying
+        a long run is limited by bandwidth rather than by round-trip latency.
+        """
+        fetch = self._fetch_partition
+        indexes = iter(range(self.npartitions))
+        pending = collections.deque()
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.PARTITION_CONCURRENCY) as executor:
+            for i in itertools.islice(indexes, self.PARTITION_CONCURRENCY):
+                pending.append(executor.submit(fetch, (i, raw)))
+            while pending:
+                payload = pending.popleft().result()
+                # Refill the window before handing this payload over.
+                for i in itertools.islice(indexes, 1):
+                    pending.append(executor.submit(fetch, (i, raw)))
+                yield payload
+
+    def _documents(self, raw):
+        """
+        Yield all the documents in the run, in order.
+
+        If the server can stream the whole run in one response, use that.
+        Otherwise (or to use the PARTITION_CACHE) fetch it by partition.
+        """
+        from requests.compat import urljoin
+
+        root = urljoin(self.url, '/')
+        cached = (self.PARTITION_CACHE is not None
+                  and self.metadata.get('stop'))
+        if (self.STREAMING and not cached
+                and root not in _servers_without_streaming):
+            documents = open_document_stream(self.url, self.http_args,
+                                             self._source_id, raw)
+            if documents is not None:
+                yield from documents
+                return
+            _servers_without_streaming.add(root)
+        for payload in self._partitions(raw=raw):
+            for name, doc in payload:
                 yield name, doc
 
+    def canonical(self):
+        yield from self._documents(raw=False)
+
     def read_canonical(self):
         warnings.warn(
             "The method read_canonical has been renamed canonical. This alias "
@@ -430,21 +1094,23 @@ class RemoteBlueskyRun(intake.catalog.base.RemoteCatalog):
         yield from self.canonical()
 
     def canonical_unfilled(self):
-        for i in range(self.npartitions):
-            for name, doc in self._get_partition((i, True)):
-                yield name, doc
+        yield from self._documents(raw=True)
 
     def __repr__(self):
-        self._load()
+        # Use what the server sent when the run was opened, if it can, so
+        # that displaying a run does not make any requests.
         try:
             start = self.metadata['start']
-            stop = self.metadata['stop']
+            stop = self.metadata['stop'] or {}
+            stream_names = self._stream_names
+            if stream_names is None:
+                stream_names = list(self)
             out = (f"Run Catalog\n"
                    f"  uid={start['uid']!r}\n"
                    f"  exit_status={stop.get('exit_status')!r}\n"
                    f"  {_ft(start['time'])} -- {_ft(stop.get('time', '?'))}\n"
                    f"  Streams:\n")
-            for stream_name in self:
+            for stream_name in stream_names:
                 out += f"    * {stream_name}\n"
         except Exception as exc:
             out = f"<Intake catalog: Run *REPR_RENDERING_FAILURE* {exc!r}>"
@@ -454,6 +1120,22 @@ class RemoteBlueskyRun(intake.catalog.base.RemoteCatalog):
         raise NotImplementedError("Cannot search within one run.")
 
 
+class _EventStreamEntry(intake.catalog.local.LocalCatalogEntry):
+    """
+    The entry for a BlueskyEventStream in a BlueskyRun.
+
+    BlueskyEventStream has the 'xarray' container, which intake knows how to
+    persist and export. When the run is served, clients are told the
+    'bluesky-event-stream' container instead, so that they read the stream
+    with RemoteBlueskyEventStream.
+    """
+    def describe(self):
+        description = super().describe()
+        if getattr(self._catalog, 'on_server', False):
+            description['container'] = 'bluesky-event-stream'
+        return description
+
+
 class BlueskyRun(intake.catalog.Catalog):
     """
     Catalog representing one Run.
@@ -479,6 +1161,12 @@ class BlueskyRun(intake.catalog.Catalog):
         Expected signature ``get_datum_pages(resource_uid) -> generator``
         where ``generator`` yields Datum documents
     filler : event_model.Filler
+    exact_skip_limit : boolean, optional
+        If True, ``get_event_pages(descriptor_uid, skip, limit)`` yields
+        exactly Events ``skip:skip + limit`` of the descriptor, so a partition
+        is read by asking each descriptor for only the Events it needs.
+        Otherwise (the default) a partition is read by going through all the
+        Events before it.
     **kwargs :
         Additional keyword arguments are passed through to the base class,
         Catalog.
@@ -498,10 +1186,16 @@ class BlueskyRun(intake.catalog.Catalog):
                  lookup_resource_for_datum,
                  get_datum_pages,
                  filler,
+                 exact_skip_limit=False,
                  **kwargs):
         # All **kwargs are passed up to base class. TODO: spell them out
         # explicitly.
         self.urlpath = ''  # TODO Not sure why I had to add this.
+        self._exact_skip_limit = exact_skip_limit
+        # The descriptor of each Event, in interlaced order, and the
+        # descriptors and Event counts it was computed for
+        self._interlace_order = None
+        self._interlace_key = None
 
         self._get_run_start = get_run_start
         self._get_run_stop = get_run_stop
@@ -563,6 +1257,12 @@ class BlueskyRun(intake.catalog.Catalog):
         descriptors_by_name = collections.defaultdict(list)
         for doc in self._descriptors:
             descriptors_by_name[doc.get('name', 'primary')].append(doc)
+        # Sent to remote clients with the response to 'open', for their repr.
+        self._schema['stream_names'] = list(descriptors_by_name)
+        # Also sent to them for the keys of their PartitionCache: partitions
+        # of another size, or from another version, are not the same.
+        self._schema['partition_size'] = self.PARTITION_SIZE
+        self._schema['source_version'] = self.version
         for stream_name, descriptors in descriptors_by_name.items():
             args = dict(
                 get_run_start=self._get_run_start,
@@ -576,7 +1276,7 @@ class BlueskyRun(intake.catalog.Catalog):
                 get_datum_pages=self._get_datum_pages,
                 filler=self.filler,
                 metadata={'descriptors': descriptors})
-            self._entries[stream_name] = intake.catalog.local.LocalCatalogEntry(
+            self._entries[stream_name] = _EventStreamEntry(
                 name=stream_name,
                 description={},  # TODO
                 driver='intake_bluesky.core.BlueskyEventStream',
@@ -605,6 +1305,47 @@ class BlueskyRun(intake.catalog.Catalog):
             for name, doc in self.read_partition((i, True)):
                 yield name, doc
 
+    def _interlaced_events(self, skip, limit):
+        """
+        Return Events skip:skip + limit of all the descriptors, interlaced
+        by time.
+        """
+        descriptor_uids = [doc['uid'] for doc in self._descriptors]
+        if not self._exact_skip_limit:
+            return itertools.islice(interlace_event_pages(
+                *(self._get_event_pages(descriptor_uid=descriptor_uid)
+                  for descriptor_uid in descriptor_uids)), skip, skip + limit)
+        # Start each descriptor where the interlaced Events before skip
+        # leave off. At most limit Events of each are needed.
+        return itertools.islice(interlace_event_pages(
+            *(self._get_event_pages(descriptor_uid=descriptor_uid,
+                                    skip=descriptor_skip, limit=limit)
+              for descriptor_uid, descriptor_skip
+              in zip(descriptor_uids, self._descriptor_skips(skip)))), limit)
+
+    def _descriptor_skips(self, skip):
+        """
+        Return how many Events of each descriptor are among the first skip
+        Events of all of them, interlaced by time.
+        """
+        descriptor_uids = [doc['uid'] for doc in self._descriptors]
+        if skip == 0:
+            return [0] * len(descriptor_uids)
+        if len(descriptor_uids) == 1:
+            return [skip]
+        key = (descriptor_uids,
+               [self._get_event_count(descriptor_uid)
+                for descriptor_uid in descriptor_uids])
+        if key != self._interlace_key:
+            times = [[time for page
+                      in self._get_event_pages(descriptor_uid=descriptor_uid)
+                      for time in page['time']]
+                     for descriptor_uid in descriptor_uids]
+            self._interlace_order = _interlace_order(times)
+            self._interlace_key = key
+        return numpy.bincount(self._interlace_order[:skip],
+                              minlength=len(descriptor_uids)).tolist()
+
     def read_partition_unfilled(self, i):
         """Fetch one chunk of documents.
         """
@@ -620,16 +1361,13 @@ class BlueskyRun(intake.catalog.Catalog):
                         (('descriptor', doc) for doc in self._descriptors)),
                     start,
                     stop))
-        descriptor_uids = [doc['uid'] for doc in self._descriptors]
-        skip = max(0, start - len(payload))
+        # Events that earlier partitions have already delivered
+        skip = max(0, start - self._offset)
         limit = stop - start - len(payload)
         # print('start, stop, skip, limit', start, stop, skip, limit)
         datum_ids = set()
         if limit > 0:
-
-            events = itertools.islice(interlace_event_pages(
-                    *(self._get_event_pages(descriptor_uid=descriptor_uid)
-                      for descriptor_uid in descriptor_uids)), skip, limit)
+            events = self._interlaced_events(skip, limit)
 
             for event in events:
                 for key, is_filled in event['filled'].items():
@@ -671,14 +1409,11 @@ class BlueskyRun(intake.catalog.Catalog):
                         (('descriptor', doc) for doc in self._descriptors)),
                     start,
                     stop))
-        descriptor_uids = [doc['uid'] for doc in self._descriptors]
-        skip = max(0, start - len(payload))
+        # Events that earlier partitions have already delivered
+        skip = max(0, start - self._offset)
         limit = stop - start - len(payload)
         if limit > 0:
-
-            events = itertools.islice(interlace_event_pages(
-                    *(self._get_event_pages(descriptor_uid=descriptor_uid)
-                      for descriptor_uid in descriptor_uids)), skip, limit)
+            events = self._interlaced_events(skip, limit)
 
             for descriptor in self._descriptors:
                 self.filler('descriptor', descriptor)
@@ -769,6 +1504,10 @@ class BlueskyEventStream(intake_xarray.base.DataSourceMixin):
         parameter is mutually exclusive with ``include``.
     **kwargs :
         Additional keyword arguments are passed through to the base class.
+
+    Locally this behaves like any intake-xarray source. Served remotely, it is
+    read by :class:`RemoteBlueskyEventStream`, which receives each variable as
+    one typed buffer: see :meth:`read_partition`.
     """
     container = 'xarray'
     name = 'bluesky-event-stream'
@@ -835,17 +1574,453 @@ class BlueskyEventStream(intake_xarray.base.DataSourceMixin):
             include=self.include,
             exclude=self.exclude)
 
+    def _get_schema(self):
+        if self._ds is None:
+            self._open_dataset()
+            metadata = {
+                'dims': dict(self._ds.sizes),
+                'data_vars': {k: list(self._ds[k].coords)
+                              for k in self._ds.data_vars.keys()},
+                'coords': tuple(self._ds.coords.keys()),
+            }
+            if getattr(self, 'on_server', False):
+                # Enough for the client to rebuild the Dataset around the
+                # buffers that read_partition sends.
+                metadata['variables'] = {
+                    key: {'dims': list(variable.dims),
+                          'dtype': ('object' if variable.dtype.hasobject
+                                    else variable.dtype.str),
+                          'shape': list(variable.shape),
+                          'attrs': dict(variable.attrs)}
+                    for key, variable in self._ds.variables.items()}
+            metadata.update(self._ds.attrs)
+            self._schema = intake.source.base.Schema(
+                datashape=None,
+                dtype=None,
+                shape=None,
+                npartitions=len(self._ds.variables),
+                extra_metadata=metadata)
+        return self._schema
+
+    def read_partition(self, i):
+        """
+        Fetch one partition.
+
+        Parameters
+        ----------
+        i : str or tuple
+            The name of a variable (data or coordinate), as requested by
+            :class:`RemoteBlueskyEventStream`, returns that whole variable
+            packed by :func:`encode_array`. A tuple is handled as in
+            intake-xarray: ``(variable_name, chunk_index, ...)``.
+        """
+        if isinstance(i, str):
+            self._load_metadata()
+            return encode_array(self._ds[i].values)
+        return super().read_partition(i)
+
+
+class RemoteBlueskyEventStream(intake.container.base.RemoteSource):
+    """
+    Client-side proxy to a BlueskyEventStream stored on a remote server.
+
+    Each variable is transferred as one contiguous typed buffer, and the
+    Dataset is built on read-only views of those buffers, with no
+    re-parsing of documents on the client.
+
+    Parameters
+    ----------
+    url: str
+        Address of the server
+    headers: dict
+        HTTP headers to use in calls
+    name: str
+        handle to reference this data
+    parameters: dict
+        To pass to the server when it instantiates the data source
+    metadata: dict
+        Additional info
+    kwargs: ignored
+    """
+    name = 'remote-bluesky-event-stream'
+    container = 'bluesky-event-stream'
+    partition_access = True
+    PARTITION_CONCURRENCY = 4
+
+    def __init__(self, url, headers, name, parameters, metadata=None,
+                 **kwargs):
+        self._ds = None
+        # As in RemoteBlueskyRun, reuse the response to 'open', if given.
+        self._open_response = (dict(kwargs, metadata=metadata)
+                               if 'source_id' in kwargs else None)
+        super().__init__(url=url, headers=headers, name=name,
+                         parameters=parameters, metadata=metadata)
+
+    def _get_source_id(self):
+        if self._source_id is None:
+            response = self._open_response
+            if response is None:
+                response = open_remote_source(self.url, self.headers,
+                                              self.name, self.parameters)
+            self._parse_open_response(response)
+
+    def _get_schema(self):
+        return self._schema
+
+    def _get_partition(self, i):
+        # Ask for msgpack: it carries the buffers as bytes, as they are.
+        return decode_array(get_partition(
+            self.url, self.headers, self._source_id, self.container, i,
+            formats=['msgpack']))
+
+    def _assemble(self, arrays):
+        import xarray
+
+        variables = self.metadata['variables']
+        coords = {key: (variables[key]['dims'], arrays[key],
+                        variables[key]['attrs'])
+                  for key in self.metadata['coords']}
+        data_vars = {key: (variables[key]['dims'], arrays[key],
+                           variables[key]['attrs'])
+                     for key in variables if key not in coords}
+        return xarray.Dataset(data_vars=data_vars, coords=coords)
+
+    def read(self):
+        """Return an xarray.Dataset with all the data in memory"""
+        keys = list(self.metadata['variables'])
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.PARTITION_CONCURRENCY) as executor:
+            arrays = dict(zip(keys, executor.map(self._get_partition, keys)))
+        self._ds = self._assemble(arrays)
+        return self._ds
+
+    def to_dask(self):
+        """Return an xarray.Dataset whose data variables are dask arrays"""
+        import dask
+        import dask.array
+
+        arrays = {}
+        for key, variable in self.metadata['variables'].items():
+            if key in self.metadata['coords']:
+                # Coordinates are small and are needed to index the Dataset.
+                arrays[key] = self._get_partition(key)
+            else:
+                arrays[key] = dask.array.from_delayed(
+                    dask.delayed(self._get_partition)(key),
+                    shape=variable['shape'],
+                    dtype=variable['dtype'])
+        self._ds = self._assemble(arrays)
+        return self._ds
+
+    def read_chunked(self):
+        return self.to_dask()
+
+    def close(self):
+        self._ds = None
+
+
+def _numeric_array(values):
+    """
+    Return values (a list or an array) as a numeric array, or None if they
+    are not all numbers (or nested lists of numbers, of a regular shape).
+    """
+    try:
+        array = numpy.asarray(values)
+    except ValueError:
+        # ragged
+        return None
+    if array.ndim == 0 or array.dtype.kind not in 'iuf':
+        return None
+    return array
+
+
+class _ColumnBuffer:
+    """
+    The values of one field of the Events in an _EventPageBuffer.
+
+    Numeric values are copied into a NumPy array that grows by doubling;
+    anything else is kept in a list.
+    """
+    def __init__(self, values, numeric):
+        array = _numeric_array(values) if numeric else None
+        if array is None:
+            self._array = None
+            self._list = list(values)
+        else:
+            self._array = numpy.empty((max(len(array), 16),) + array.shape[1:],
+                                      dtype=array.dtype)
+            self._array[:len(array)] = array
+            self._list = None
+        self._length = len(values)
+
+    def prepare(self, values):
+        """
+        Return values in the form that extend takes, or None if they cannot
+        be added to this column (because they are not numbers, or not of the
+        same shape, or would lose precision).
+        """
+        if self._array is None:
+            return values
+        array = _numeric_array(values)
+        if (array is None or array.shape[1:] != self._array.shape[1:]
+                or not numpy.can_cast(array.dtype, self._array.dtype)):
+            return None
+        return array
+
+    def extend(self, prepared):
+        if self._array is None:
+            self._list.extend(prepared)
+            self._length += len(prepared)
+            return
+        length = self._length + len(prepared)
+        if length > len(self._array):
+            array = numpy.empty(
+                (max(2 * len(self._array), length),) + self._array.shape[1:],
+                dtype=self._array.dtype)
+            array[:self._length] = self._array[:self._length]
+            self._array = array
+        self._array[self._length:length] = prepared
+        self._length = length
+
+    def values(self):
+        "Return the values so far: a view of the array, or a list."
+        if self._array is None:
+            return self._list[:self._length]
+        return self._array[:self._length]
+
+
+class _EventPageBuffer:
+    """
+    Consecutive EventPages of one descriptor, consolidated column by column.
+
+    Pages are added as long as they have the same fields and their values
+    fit in the same columns. page() returns all of them as one EventPage.
+    """
+    # Top-level fields, which are kept as lists.
+    LIST_FIELDS = ('seq_num', 'time', 'uid')
+    # Fields that hold a dict of columns, which are numeric arrays if they
+    # can be.
+    NUMERIC_FIELDS = ('data', 'timestamps')
+
+    def __init__(self, doc):
+        self.descriptor = doc['descriptor']
+        self._keys = self._keys_of(doc)
+        self._columns = {
+            path: _ColumnBuffer(values, numeric=path[0] in self.NUMERIC_FIELDS)
+            for path, values in self._columns_of(doc)}
+        self._page = None
+
+    @classmethod
+    def can_hold(cls, doc):
+        "Whether an EventPage has only the fields that this handles."
+        return (set(doc) - {'descriptor', 'filled'}
+                == set(cls.LIST_FIELDS + cls.NUMERIC_FIELDS))
+
+    @staticmethod
+    def _keys_of(doc):
+        return tuple((field, tuple(doc[field]))
+                     for field in ('data', 'timestamps', 'filled')
+                     if field in doc)
+
+    @classmethod
+    def _columns_of(cls, doc):
+        for field in cls.LIST_FIELDS:
+            yield (field, None), doc[field]
+        for field in cls.NUMERIC_FIELDS + ('filled',):
+            for key, values in doc.get(field, {}).items():
+                yield (field, key), values
+
+    def extend(self, doc):
+        """
+        Add an EventPage, and return True, or return False if it does not
+        fit.
+        """
+        if self._keys_of(doc) != self._keys:
+            return False
+        prepared = {}
+        for path, values in self._columns_of(doc):
+            prepared[path] = self._columns[path].prepare(values)
+            if prepared[path] is None:
+                return False
+        for path, values in prepared.items():
+            self._columns[path].extend(values)
+        self._page = None
+        return True
+
+    def page(self):
+        "Return the Events so far as one EventPage."
+        if self._page is None:
+            page = {'descriptor': self.descriptor}
+            for field, _ in self._keys:
+                page[field] = {}
+            for (field, key), column in self._columns.items():
+                if key is None:
+                    page[field] = column.values()
+                else:
+                    page[field][key] = column.values()
+            self._page = page
+        return self._page
+
+
+def _slice_event_page(event_page, start, stop):
+    "Return the Events start:stop of an EventPage, as an EventPage."
+    sliced = {}
+    for key, value in event_page.items():
+        if key in ('data', 'timestamps', 'filled'):
+            sliced[key] = {field: values[start:stop]
+                           for field, values in value.items()}
+        elif isinstance(value, list):
+            sliced[key] = value[start:stop]
+        else:
+            sliced[key] = value
+    return sliced
+
+
+def _slice_datum_page(datum_page, start, stop):
+    "Return the Datums start:stop of a DatumPage, as a DatumPage."
+    sliced = {}
+    for key, value in datum_page.items():
+        if key == 'datum_kwargs':
+            sliced[key] = {field: values[start:stop]
+                           for field, values in value.items()}
+        elif isinstance(value, list):
+            sliced[key] = value[start:stop]
+        else:
+            sliced[key] = value
+    return sliced
+
+
+def _page_slices(offsets, count, skip=0, limit=None):
+    """
+    Find the pages that hold items skip:skip + limit of a sequence of pages.
+
+    Parameters
+    ----------
+    offsets : list
+        The number of items before each page
+    count : int
+        The number of items in all the pages
+    skip : int, optional
+    limit : int, optional
+
+    Yields
+    ------
+    i, part : int, tuple or None
+        The index of a page and, if only part of it is wanted, the
+        ``(start, stop)`` of that part
+    """
+    stop = count if limit is None else min(skip + limit, count)
+    if skip == 0 and stop == count:
+        # every page, even empty ones
+        for i in range(len(offsets)):
+            yield i, None
+        return
+    if skip >= stop:
+        return
+    for i in range(bisect.bisect_right(offsets, skip) - 1, len(offsets)):
+        offset = offsets[i]
+        if offset >= stop:
+            break
+        length = (offsets[i + 1] if i + 1 < len(offsets) else count) - offset
+        start_in_page = max(skip - offset, 0)
+        stop_in_page = min(stop - offset, length)
+        if start_in_page > 0 or stop_in_page < length:
+            yield i, (start_in_page, stop_in_page)
+        else:
+            yield i, None
+
+
+def _as_event_page(page):
+    "Return an item of DocumentCache.event_pages as an EventPage."
+    if isinstance(page, _EventPageBuffer):
+        return page.page()
+    return page
+
 
 class DocumentCache(event_model.DocumentRouter):
-    def __init__(self):
+    """
+    Keep the documents of one run in memory.
+
+    Parameters
+    ----------
+    consolidate : boolean, optional
+        If True, copy the Events of each descriptor into a few large
+        EventPages, with numeric data and timestamps in growable NumPy arrays,
+        instead of keeping each EventPage (or Event) as it came. This takes
+        much less memory for runs of many small pages, and makes fewer pages
+        for readers to go through. Values in those columns are then read as
+        NumPy arrays. False by default.
+    """
+    def __init__(self, consolidate=False):
+        self.consolidate = consolidate
         self.descriptors = {}
         self.resources = {}
+        # If consolidating, _EventPageBuffers (or EventPages that could not
+        # be consolidated); otherwise, EventPages
         self.event_pages = collections.defaultdict(list)
+        # The number of Events of each descriptor, and, for each item in
+        # event_pages, the number of Events before it, to find Events by
+        # position with a binary search
+        self.event_counts = collections.Counter()
+        self._event_offsets = collections.defaultdict(list)
         self.datum_pages_by_resource = collections.defaultdict(list)
+        # Likewise for the Datums of each Resource
+        self.datum_counts = collections.Counter()
+        self._datum_offsets = collections.defaultdict(list)
         self.resource_uid_by_datum_id = {}
         self.start_doc = None
         self.stop_doc = None
 
+    def get_event_pages(self, descriptor_uid, skip=0, limit=None):
+        """
+        Return the EventPages of a descriptor, as a list.
+
+        Parameters
+        ----------
+        descriptor_uid : str
+        skip : int, optional
+            Number of Events to leave out from the beginning
+        limit : int, optional
+            Maximum number of Events to return. By default, all the rest.
+        """
+        event_pages = self.event_pages.get(descriptor_uid, [])
+        pages = []
+        for i, part in _page_slices(
+                self._event_offsets.get(descriptor_uid, []),
+                self.event_counts[descriptor_uid], skip, limit):
+            page = _as_event_page(event_pages[i])
+            if part is not None:
+                page = _slice_event_page(page, *part)
+            pages.append(page)
+        return pages
+
+    def get_event_count(self, descriptor_uid):
+        "Return the number of Events of a descriptor."
+        return self.event_counts[descriptor_uid]
+
+    def get_datum_pages(self, resource_uid, skip=0, limit=None):
+        """
+        Return the DatumPages of a Resource, as a list.
+
+        Parameters
+        ----------
+        resource_uid : str
+        skip : int, optional
+            Number of Datums to leave out from the beginning
+        limit : int, optional
+            Maximum number of Datums to return. By default, all the rest.
+        """
+        datum_pages = self.datum_pages_by_resource.get(resource_uid, [])
+        pages = []
+        for i, part in _page_slices(
+                self._datum_offsets.get(resource_uid, []),
+                self.datum_counts[resource_uid], skip, limit):
+            page = datum_pages[i]
+            if part is not None:
+                page = _slice_datum_page(page, *part)
+            pages.append(page)
+        return pages
+
     def start(self, doc):
         self.start_doc = doc
 
@@ -853,10 +2028,28 @@ class DocumentCache(event_model.DocumentRouter):
         self.stop_doc = doc
 
     def event_page(self, doc):
-        self.event_pages[doc['descriptor']].append(doc)
+        descriptor_uid = doc['descriptor']
+        event_pages = self.event_pages[descriptor_uid]
+        if not (self.consolidate and _EventPageBuffer.can_hold(doc)):
+            page = doc
+        elif (event_pages
+              and isinstance(event_pages[-1], _EventPageBuffer)
+              and event_pages[-1].extend(doc)):
+            page = None  # added to the last one
+        else:
+            page = _EventPageBuffer(doc)
+        if page is not None:
+            event_pages.append(page)
+            self._event_offsets[descriptor_uid].append(
+                self.event_counts[descriptor_uid])
+        self.event_counts[descriptor_uid] += len(doc['seq_num'])
 
     def datum_page(self, doc):
-        self.datum_pages_by_resource[doc['resource']].append(doc)
+        resource_uid = doc['resource']
+        self.datum_pages_by_resource[resource_uid].append(doc)
+        self._datum_offsets[resource_uid].append(
+            self.datum_counts[resource_uid])
+        self.datum_counts[resource_uid] += len(doc['datum_id'])
         for datum_id in doc['datum_id']:
             self.resource_uid_by_datum_id[datum_id] = doc['resource']
 
@@ -867,19 +2060,147 @@ class DocumentCache(event_model.DocumentRouter):
         self.resources[doc['uid']] = doc
 
 
+class _EventCounter(DocumentCache):
+    "A DocumentCache that counts Events instead of keeping them."
+    def event_page(self, doc):
+        self.event_counts[doc['descriptor']] += len(doc['seq_num'])
+
+
+def _check_run_start(document_cache, gen_func, gen_args, gen_kwargs):
+    "Raise if a generator of a run's documents did not yield a RunStart."
+    if document_cache.start_doc is None:
+        arguments = ', '.join(
+            [repr(arg) for arg in gen_args]
+            + [f'{key}={value!r}' for key, value in gen_kwargs.items()])
+        name = getattr(gen_func, '__qualname__', repr(gen_func))
+        raise ValueError(
+            f"No RunStart document among the documents from "
+            f"{name}({arguments}).")
+
+
+class _LazyGeneratorReader:
+    """
+    Read a run from a generator without keeping all its Events in memory.
+
+    The first use runs the generator through once, keeping everything but
+    the Events, which are only counted. The Events of a descriptor are
+    collected by running the generator again when they are first asked for,
+    and kept from then on, so that memory grows only with the streams that
+    are read.
+    """
+    def __init__(self, gen_func, gen_args, gen_kwargs, consolidate=False):
+        self._gen_func = gen_func
+        self._gen_args = gen_args
+        self._gen_kwargs = gen_kwargs
+        self._lock = threading.Lock()
+        self._document_cache = None
+        # The Events of the descriptors that have been read
+        self._event_cache = DocumentCache(consolidate=consolidate)
+        self._read_descriptor_uids = set()
+
+    def _documents(self):
+        return self._gen_func(*self._gen_args, **self._gen_kwargs)
+
+    def _scanned_cache(self):
+        with self._lock:
+            if self._document_cache is None:
+                document_cache = _EventCounter()
+                for item in self._documents():
+                    document_cache(*item)
+                _check_run_start(document_cache, self._gen_func,
+                                 self._gen_args, self._gen_kwargs)
+                self._document_cache = document_cache
+        return self._document_cache
+
+    def get_run_start(self):
+        return self._scanned_cache().start_doc
+
+    def get_run_stop(self):
+        return self._scanned_cache().stop_doc
+
+    def get_event_descriptors(self):
+        return self._scanned_cache().descriptors.values()
+
+    def get_event_pages(self, descriptor_uid, skip=0, limit=None):
+        self._scanned_cache()
+        with self._lock:
+            if descriptor_uid not in self._read_descriptor_uids:
+                for name, doc in self._documents():
+                    if (name in ('event', 'event_page')
+                            and doc['descriptor'] == descriptor_uid):
+                        self._event_cache(name, doc)
+                self._read_descriptor_uids.add(descriptor_uid)
+        return self._event_cache.get_event_pages(descriptor_uid, skip, limit)
+
+    def get_event_count(self, descriptor_uid):
+        return self._scanned_cache().event_counts[descriptor_uid]
+
+    def get_resource(self, uid):
+        return self._scanned_cache().resources[uid]
+
+    def lookup_resource_for_datum(self, datum_id):
+        return self._scanned_cache().resource_uid_by_datum_id[datum_id]
+
+    def get_datum_pages(self, resource_uid, skip=0, limit=None):
+        return self._scanned_cache().get_datum_pages(resource_uid, skip, limit)
+
+
 class BlueskyRunFromGenerator(BlueskyRun):
+    """
+    Catalog representing one Run, whose documents a generator yields.
 
-    def __init__(self, gen_func, gen_args, gen_kwargs, filler=None, **kwargs):
+    Parameters
+    ----------
+    gen_func : callable
+        Expected signature ``gen_func(*gen_args, **gen_kwargs) -> generator``
+        where ``generator`` yields ``(name, doc)`` pairs, starting with the
+        RunStart document
+    gen_args : tuple
+    gen_kwargs : dict
+    filler : event_model.Filler, optional
+    lazy : boolean, optional
+        If False (the default), run the generator once and keep all of the
+        documents in memory. If True, keep all but the Events, and run the
+        generator again to collect the Events of a stream when that stream is
+        first read. This takes much less memory to open a large run, but
+        takes a pass through the generator for each stream that is read, so
+        gen_func must give the same documents every time it is called.
+    consolidate : boolean, optional
+        If True, keep the Events in a few large EventPages, column by column
+        (see :class:`DocumentCache`). False by default.
+    **kwargs :
+        Additional keyword arguments are passed through to the base class,
+        Catalog.
+    """
+    def __init__(self, gen_func, gen_args, gen_kwargs, filler=None,
+                 lazy=False, consolidate=False, **kwargs):
 
         if filler is None:
             filler = event_model.Filler({}, inplace=True)
 
-        document_cache = DocumentCache()
+        if lazy:
+            reader = _LazyGeneratorReader(gen_func, gen_args, gen_kwargs,
+                                          consolidate=consolidate)
+            super().__init__(
+                get_run_start=reader.get_run_start,
+                get_run_stop=reader.get_run_stop,
+                get_event_descriptors=reader.get_event_descriptors,
+                get_event_pages=reader.get_event_pages,
+                get_event_count=reader.get_event_count,
+                get_resource=reader.get_resource,
+                lookup_resource_for_datum=reader.lookup_resource_for_datum,
+                get_datum_pages=reader.get_datum_pages,
+                filler=filler,
+                exact_skip_limit=True,
+                **kwargs)
+            return
+
+        document_cache = DocumentCache(consolidate=consolidate)
 
         for item in gen_func(*gen_args, **gen_kwargs):
             document_cache(*item)
 
-        assert document_cache.start_doc is not None
+        _check_run_start(document_cache, gen_func, gen_args, gen_kwargs)
 
         def get_run_start():
             return document_cache.start_doc
@@ -891,13 +2212,10 @@ class BlueskyRunFromGenerator(BlueskyRun):
             return document_cache.descriptors.values()
 
         def get_event_pages(descriptor_uid, skip=0, limit=None):
-            if skip != 0 and limit is not None:
-                raise NotImplementedError
-            return document_cache.event_pages[descriptor_uid]
+            return document_cache.get_event_pages(descriptor_uid, skip, limit)
 
         def get_event_count(descriptor_uid):
-            return sum(len(page['seq_num'])
-                       for page in (document_cache.event_pages[descriptor_uid]))
+            return document_cache.get_event_count(descriptor_uid)
 
         def get_resource(uid):
             return document_cache.resources[uid]
@@ -906,9 +2224,7 @@ class BlueskyRunFromGenerator(BlueskyRun):
             return document_cache.resource_uid_by_datum_id[datum_id]
 
         def get_datum_pages(resource_uid, skip=0, limit=None):
-            if skip != 0 and limit is not None:
-                raise NotImplementedError
-            return document_cache.datum_pages_by_resource[resource_uid]
+            return document_cache.get_datum_pages(resource_uid, skip, limit)
 
         super().__init__(
             get_run_start=get_run_start,
@@ -920,9 +2236,101 @@ class BlueskyRunFromGenerator(BlueskyRun):
             lookup_resource_for_datum=lookup_resource_for_datum,
             get_datum_pages=get_datum_pages,
             filler=filler,
+            exact_skip_limit=True,
             **kwargs)
 
 
+class FileTail:
+    """
+    Follow a file that a run is being written to, decoding only what is new.
+
+    The file is decoded from where the last call left off, and the documents
+    are added to a DocumentCache. A file that has shrunk or been replaced
+    (i.e., has a new inode) is decoded again from the top.
+
+    The methods of this object have the signatures of the callables that
+    :class:`BlueskyRun` expects, and each first decodes whatever has been
+    appended to the file since. An open BlueskyRun therefore picks up new
+    Events, descriptors, and the RunStop document when it is reloaded, and a
+    stream reads them when it is read again after ``close()``.
+
+    Parameters
+    ----------
+    filename : str
+    read_documents : callable
+        Expected signature ``read_documents(file) -> generator``, where
+        ``file`` is a binary file positioned at the first byte not decoded
+        yet, and ``generator`` yields ``(name, doc, position)`` for each
+        complete document, ``position`` being where that document ends. It
+        should stop, not fail, at a document that is only partly written.
+    consolidate : boolean, optional
+        If True, keep the Events in a few large EventPages, column by column
+        (see :class:`DocumentCache`). False by default.
+    """
+    def __init__(self, filename, read_documents, consolidate=False):
+        self.filename = filename
+        self._read_documents = read_documents
+        self.consolidate = consolidate
+        self._document_cache = DocumentCache(consolidate=consolidate)
+        self._position = 0
+        self._inode = None
+        self._size = None  # of the file when last decoded
+        self._lock = threading.Lock()
+
+    def update(self):
+        """
+        Decode the documents appended to the file since the last call.
+        """
+        with self._lock:
+            stat = os.stat(self.filename)
+            if stat.st_ino != self._inode or stat.st_size < self._position:
+                self._document_cache = DocumentCache(
+                    consolidate=self.consolidate)
+                self._position = 0
+                self._inode = stat.st_ino
+                self._size = None
+            if stat.st_size == self._size:
+                # Nothing has been appended, or only part of a document that
+                # we have already tried.
+                return
+            self._size = stat.st_size
+            with open(self.filename, 'rb') as file:
+                file.seek(self._position)
+                for name, doc, position in self._read_documents(file):
+                    self._document_cache(name, doc)
+                    self._position = position
+
+    def _updated_cache(self):
+        self.update()
+        return self._document_cache
+
+    def get_run_start(self):
+        return self._updated_cache().start_doc
+
+    def get_run_stop(self):
+        return self._updated_cache().stop_doc
+
+    def get_event_descriptors(self):
+        return list(self._updated_cache().descriptors.values())
+
+    def get_event_pages(self, descriptor_uid, skip=0, limit=None):
+        return self._updated_cache().get_event_pages(descriptor_uid, skip,
+                                                     limit)
+
+    def get_event_count(self, descriptor_uid):
+        return self._updated_cache().get_event_count(descriptor_uid)
+
+    def get_resource(self, uid):
+        return self._updated_cache().resources[uid]
+
+    def lookup_resource_for_datum(self, datum_id):
+        return self._updated_cache().resource_uid_by_datum_id[datum_id]
+
+    def get_datum_pages(self, resource_uid, skip=0, limit=None):
+        return self._updated_cache().get_datum_pages(resource_uid, skip,
+                                                     limit)
+
+
 def _transpose(in_data, keys, field):
     """Turn a list of dicts into dict of lists
 
@@ -1017,6 +2425,9 @@ def parse_handler_registry(handler_registry):
 
 intake.registry['remote-bluesky-run'] = RemoteBlueskyRun
 intake.container.container_map['bluesky-run'] = RemoteBlueskyRun
+intake.registry['remote-bluesky-event-stream'] = RemoteBlueskyEventStream
+intake.container.container_map['bluesky-event-stream'] = (
+    RemoteBlueskyEventStream)
 
 
 def concat_dataarray_pages(dataarray_pages):
@@ -1034,6 +2445,8 @@ def concat_dataarray_pages(dataarray_pages):
         A single event_pages with xarray.dataArrays in the data,
         timestamp, and filled fields.
     """
+    import xarray
+
     pages = list(dataarray_pages)
     if len(pages) == 1:
         return pages[0]
@@ -1070,6 +2483,8 @@ def event_page_to_dataarray_page(event_page, dims=None, coords=None):
         An event_pages with xarray.dataArrays in the data,
         timestamp, and filled fields.
     """
+    import xarray
+
     if coords is None:
         coords = {'time': event_page['time']}
     if dims is None:
@@ -1103,6 +2518,8 @@ def dataarray_page_to_dataset_page(dataarray_page):
     ------
     dataset_page : dict
     """
+    import xarray
+
     array_keys = ['seq_num', 'time', 'uid']
 
     return {'descriptor': dataarray_page['descriptor'],
@@ -1124,6 +2541,8 @@ class DaskFiller(event_model.Filler):
         super().__init__(*args, inplace=True, **kwargs)
 
     def event_page(self, doc):
+        import dask
+        import dask.array
 
         @dask.delayed
         def delayed_fill(event_page, key):
@@ -1138,11 +2557,13 @@ class DaskFiller(event_model.Filler):
         for key in needs_filling:
             shape = extract_shape(descriptor, key)
             dtype = extract_dtype(descriptor, key)
-            filled_doc['data'][key] = array.from_delayed(
+            filled_doc['data'][key] = dask.array.from_delayed(
                 delayed_fill(filled_doc, key), shape=shape, dtype=dtype)
         return filled_doc
 
     def event(self, doc):
+        import dask
+        import dask.array
 
         @dask.delayed
         def delayed_fill(event, key):
@@ -1157,7 +2578,7 @@ class DaskFiller(event_model.Filler):
         for key in needs_filling:
             shape = extract_shape(descriptor, key)
             dtype = extract_dtype(descriptor, key)
-            filled_doc['data'][key] = array.from_delayed(
+            filled_doc['data'][key] = dask.array.from_delayed(
                 delayed_fill(filled_doc, key), shape=shape, dtype=dtype)
         return filled_doc
 
@@ -0,0 +1,401 @@
+"""
+A Catalog backed by files that each hold one run, as (name, doc) pairs.
+
+The JSONL and msgpack Catalogs differ only in how they decode a file. Each
+subclasses :class:`BlueskyFileCatalog` and supplies ``_read_run_start``,
+``_read_run_stop``, ``_read_documents`` and ``_gen_documents``; the rest ---
+listing and watching the files, reading their RunStart documents, the SQLite
+index, search, and the entries that read the runs --- is shared.
+"""
+import collections
+import concurrent.futures
+import glob
+import os
+import pathlib
+import threading
+
+import numpy
+
+from . import file_index
+from .core import FileTail
+from .file_watcher import FileWatcher
+from .in_memory import BlueskyInMemoryCatalog
+from .sqlite_index import SQLiteIndex
+
+
+class _FileTails:
+    """
+    The FileTails of the files most recently read, shared by the entries.
+
+    Only the ``maxsize`` most recently used are kept, so that the documents
+    decoded from a file that is no longer being read can be freed. A file
+    read again after its FileTail was dropped is decoded again.
+    """
+    def __init__(self, read_documents, maxsize, consolidate=False):
+        self._read_documents = read_documents
+        self.maxsize = maxsize
+        self.consolidate = consolidate
+        self._tails = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, filename):
+        with self._lock:
+            tail = self._tails.pop(filename, None)
+            if tail is None:
+                tail = FileTail(filename, self._read_documents,
+                                consolidate=self.consolidate)
+            self._tails[filename] = tail
+            while len(self._tails) > self.maxsize:
+                self._tails.popitem(last=False)
+            return tail
+
+    def __len__(self):
+        return len(self._tails)
+
+
+class _TailReader:
+    """
+    Read one file through the FileTail that a _FileTails has for it.
+
+    The methods of this object have the signatures of the callables that
+    :class:`intake_bluesky.core.BlueskyRun` expects. It holds no documents,
+    so the entries that hold it do not keep the file's documents in memory.
+    """
+    def __init__(self, tails, filename):
+        self._tails = tails
+        self.filename = filename
+
+    def __deepcopy__(self, memo):
+        # Catalog entries deep-copy their arguments when described. Copies
+        # must share the FileTails.
+        return self
+
+    def _tail(self):
+        return self._tails.get(self.filename)
+
+    def get_run_start(self):
+        return self._tail().get_run_start()
+
+    def get_run_stop(self):
+        return self._tail().get_run_stop()
+
+    def get_event_descriptors(self):
+        return self._tail().get_event_descriptors()
+
+    def get_event_pages(self, descriptor_uid, skip=0, limit=None):
+        return self._tail().get_event_pages(descriptor_uid, skip, limit)
+
+    def get_event_count(self, descriptor_uid):
+        return self._tail().get_event_count(descriptor_uid)
+
+    def get_resource(self, uid):
+        return self._tail().get_resource(uid)
+
+    def lookup_resource_for_datum(self, datum_id):
+        return self._tail().lookup_resource_for_datum(datum_id)
+
+    def get_datum_pages(self, resource_uid, skip=0, limit=None):
+        return self._tail().get_datum_pages(resource_uid, skip, limit)
+
+
+class BlueskyFileCatalog(BlueskyInMemoryCatalog):
+    name = 'bluesky-file-catalog'  # noqa
+    # Number of files whose RunStart documents are read at once when loading
+    LOAD_CONCURRENCY = 16
+    # Number of files whose decoded documents are kept, for the entries that
+    # read them again (see FileTail), when not using the sidecar indexes
+    TAIL_CACHE_SIZE = 8
+    # Names of the format-specific arguments of __init__, which search results
+    # inherit from the Catalog that was searched
+    FORMAT_OPTIONS = ()
+
+    def __init__(self, paths, *,
+                 handler_registry=None, query=None, use_index=False,
+                 watch=False, sqlite_index=None, consolidate=False,
+                 **kwargs):
+        """
+        This Catalog is backed by files that each hold one run.
+
+        Each file is expected to hold a sequence of (name, doc) pairs, the
+        document name (type) and the document itself, in chronological order.
+
+        Parameters
+        ----------
+        paths : list
+            list of filepaths
+        handler_registry : dict, optional
+            Maps each asset spec to a handler class or a string specifying the
+            module name and class name, as in (for example)
+            ``{'SOME_SPEC': 'module.submodule.class_name'}``.
+        query : dict, optional
+            Mongo query that filters entries' RunStart documents
+        use_index : boolean, optional
+            If True, read runs through a sidecar index of the byte offsets
+            of their documents (see :mod:`intake_bluesky.file_index`), so that
+            reading part of a run does not decode the whole file. An index
+            that is missing or out of date is built when the run is first
+            read. False by default.
+        watch : {False, True, 'polling'}, optional
+            If True, watch the directories of ``paths`` for new and modified
+            files (see :mod:`intake_bluesky.file_watcher`), so that a reload
+            checks only those instead of listing every file. If 'polling',
+            watch by polling, which also sees changes made by other machines
+            to a network file system. The watcher runs until the Catalog is
+            closed (with ``close()`` or by using it as a context manager) or
+            garbage-collected. False by default.
+        sqlite_index : str, optional
+            Path of a SQLite database (see :mod:`intake_bluesky.sqlite_index`)
+            in which to keep the RunStart documents of the files, with their
+            sizes and mtimes. It is created if it does not exist. On later
+            loads, even in other processes, only the files that are new or
+            have changed are read, and searches on a few summary fields
+            (uid, time, scan_id, plan_name) are answered by SQL. The RunStop
+            documents, where they can be found cheaply, are kept too, and
+            put in the entries' metadata. The database is closed with the
+            Catalog. None (no database) by default.
+        consolidate : boolean, optional
+            If True, keep the Events of the runs that are read in a few large
+            EventPages, column by column (see
+            :class:`intake_bluesky.core.DocumentCache`), which takes less
+            memory and is quicker to read for runs recorded one Event at a
+            time. It has no effect with ``use_index=True``, which keeps no
+            Events. False by default.
+        **kwargs :
+            Additional keyword arguments are passed through to the base class,
+            Catalog, except ``lazy``, which is not supported: pass
+            ``use_index=True`` instead to read only the parts of runs that are
+            used.
+        """
+        if kwargs.pop('lazy', False):
+            raise ValueError(
+                "Catalogs backed by files do not support lazy=True. Pass "
+                "use_index=True to read only the parts of runs that are used.")
+        # Tolerate a single path (as opposed to a list).
+        if isinstance(paths, (str, pathlib.Path)):
+            paths = [paths]
+        self.paths = paths
+        self.use_index = use_index
+        self.watch = watch
+        self._watcher = None  # created on first load
+        self._filename_to_mtime = {}
+        # RunStop documents found with the RunStart documents (when using the
+        # SQLite index), for the entries' metadata
+        self._filename_to_run_stop_doc = {}
+        self._tails = _FileTails(self._read_documents, self.TAIL_CACHE_SIZE,
+                                 consolidate=consolidate)
+        self.sqlite_index = sqlite_index
+        self._sqlite_index = None
+        if sqlite_index is not None:
+            self._sqlite_index = SQLiteIndex(sqlite_index)
+            # Forget files that have been removed since the last process.
+            self._sqlite_index.remove(
+                [path for path in self._sqlite_index.paths()
+                 if not os.path.exists(path)])
+        super().__init__(handler_registry=handler_registry,
+                         query=query,
+                         consolidate=consolidate,
+                         **kwargs)
+
+    @staticmethod
+    def _read_run_start(filename):
+        """
+        Return the first (name, doc) pair in a file, or None if it is empty.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def _read_run_stop(filename):
+        """
+        Return the RunStop document in a file, or None if it has none or it
+        cannot be found without decoding the whole file.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def _read_documents(file):
+        """
+        Yield (name, doc, position) for each complete document, from file's
+        position, as for :class:`intake_bluesky.core.FileTail`.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def _gen_documents(filename):
+        """
+        Yield the (name, doc) pairs in one file.
+        """
+        raise NotImplementedError
+
+    def _index_reader(self, filename):
+        """
+        Return a reader of one file through its sidecar index.
+        """
+        return file_index.IndexedRunReader(filename, self._read_documents)
+
+    def _list_files(self):
+        """
+        Return the files to check for changes: all of them, or, if watching,
+        those that the watcher has seen change.
+        """
+        if not self.watch:
+            return [filename for path in self.paths
+                    for filename in sorted(glob.glob(path))]
+        if self._watcher is None:
+            self._watcher = FileWatcher(self.paths,
+                                        polling=(self.watch == 'polling'))
+        return self._watcher.changed()
+
+    def _close(self):
+        """
+        Stop watching the files, and close the SQLite index. A later reload
+        starts again.
+        """
+        # This may be called on a Catalog that failed to initialize.
+        watcher = getattr(self, '_watcher', None)
+        if watcher is not None:
+            self._watcher = None
+            watcher.stop()
+        # Search results share the index of the Catalog that was searched.
+        index = getattr(self, '_sqlite_index', None)
+        if index is not None and getattr(self, '_parent', None) is None:
+            index.close()
+
+    def __enter__(self):
+        # Catalogs have no schema to load, unlike other data sources.
+        return self
+
+    def __del__(self):
+        self._close()
+
+    def _load(self):
+        if self._parent is not None:
+            # Search results reload from the Catalog that was searched.
+            return super()._load()
+        filenames = self._list_files()
+        known_mtimes = self._filename_to_mtime.copy()
+        index = self._sqlite_index
+
+        def read_run_start(filename):
+            try:
+                stat = os.stat(filename)
+                if stat.st_mtime == known_mtimes.get(filename):
+                    # This file has not changed since last time we loaded it.
+                    return None
+                if index is not None and index.is_current(
+                        filename, stat.st_mtime, stat.st_size):
+                    # Nor since its RunStart document was put in the index.
+                    return stat, True, None, None
+                item = self._read_run_start(filename)
+                run_stop_doc = None
+                if index is not None and item is not None:
+                    run_stop_doc = self._read_run_stop(filename)
+                return stat, False, item, run_stop_doc
+            except FileNotFoundError:
+                # Removed since it was listed
+                return None
+
+        # Reading the files is latency-bound (especially on network file
+        # systems), so read many at once. Add them in the order listed.
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.LOAD_CONCURRENCY) as executor:
+            results = [
+                (filename, *result) for filename, result in zip(
+                    filenames, executor.map(read_run_start, filenames))
+                if result is not None]
+        if index is not None:
+            indexed = index.get(filename for filename, _, is_indexed, _, _
+                                in results if is_indexed)
+            index.put([(filename, stat.st_mtime, stat.st_size, item[1],
+                        run_stop_doc)
+                       for filename, stat, _, item, run_stop_doc in results
+                       if item is not None and item[0] == 'start'])
+        for filename, stat, is_indexed, item, run_stop_doc in results:
+            if is_indexed:
+                try:
+                    run_start_doc, run_stop_doc = indexed[filename]
+                    item = ('start', run_start_doc)
+                except KeyError:
+                    # Removed from the index (by another process) meanwhile
+                    item = self._read_run_start(filename)
+            self._filename_to_mtime[filename] = stat.st_mtime
+            self._filename_to_run_stop_doc[filename] = run_stop_doc
+            if item is None:
+                # Empty file, maybe being written to currently
+                continue
+            name, run_start_doc = item
+            if name != 'start':
+                raise ValueError(
+                    f"Expected the first document in {filename!r} to be "
+                    f"a RunStart document, not {name!r}.")
+            self._add_run(run_start_doc, self._gen_documents, (filename,), {})
+
+    def _search_mask(self, compiled_query):
+        if self._sqlite_index is not None:
+            uids = self._sqlite_index.search(compiled_query.query)
+            if uids is not None:
+                # Runs added by upsert, rather than read from files, are not
+                # in the index.
+                return numpy.fromiter(
+                    ((uid in uids) if self._is_file_run(uid)
+                     else compiled_query.match(run_start_doc)
+                     for uid, run_start_doc
+                     in self._uid_to_run_start_doc.items()),
+                    dtype=bool, count=len(self._uid_to_run_start_doc))
+        return super()._search_mask(compiled_query)
+
+    def _is_file_run(self, uid):
+        "Whether a run was read from one of the files, rather than upserted."
+        return self._uid_to_gen[uid][0] is self._gen_documents
+
+    def _make_entry(self, run_start_doc, gen_func, gen_args, gen_kwargs):
+        if gen_func is not self._gen_documents:
+            return super()._make_entry(run_start_doc, gen_func, gen_args,
+                                       gen_kwargs)
+        filename, = gen_args
+        if self.use_index:
+            reader = self._index_reader(filename)
+        else:
+            # Share one FileTail among all the entries for this file, so
+            # that a run being written is decoded only once, incrementally.
+            reader = _TailReader(self._tails, filename)
+        return self._make_reader_entry(
+            run_start_doc, reader,
+            run_stop_doc=self._filename_to_run_stop_doc.get(filename))
+
+    def search(self, query):
+        """
+        Return a new Catalog with a subset of the entries in this Catalog.
+
+        Parameters
+        ----------
+        query : dict
+        """
+        if self._query:
+            query = {'$and': [self._query, query]}
+        # Start with no paths, so that nothing is read from disk, and fill it
+        # from the RunStart documents that this Catalog has already read.
+        cat = type(self)(
+            paths=[],
+            query=query,
+            handler_registry=self.filler.handler_registry,
+            use_index=self.use_index,
+            consolidate=self.consolidate,
+            name='search results',
+            getenv=self.getenv,
+            getshell=self.getshell,
+            auth=self.auth,
+            metadata=(self.metadata or {}).copy(),
+            storage_options=self.storage_options,
+            **{option: getattr(self, option)
+               for option in self.FORMAT_OPTIONS})
+        # Share the files' state. Only this Catalog reads (or watches) the
+        # files; cat gets any new runs from it when cat reloads.
+        cat.paths = self.paths
+        cat._filename_to_mtime = self._filename_to_mtime
+        cat._filename_to_run_stop_doc = self._filename_to_run_stop_doc
+        cat._tails = self._tails
+        cat.sqlite_index = self.sqlite_index
+        cat._sqlite_index = self._sqlite_index
+        cat._parent = self
+        self._add_runs_to(cat)
+        return cat
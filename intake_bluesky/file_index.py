@@ -0,0 +1,258 @@
+"""
+Sidecar indexes of where each document starts in a file of (name, doc) pairs.
+
+The JSONL and msgpack Catalogs use these to read part of a run, such as one
+stream or one partition, by seeking straight to the documents it needs
+instead of decoding the file from the top. Each format supplies a
+``read_documents(file)`` generator, as for :class:`intake_bluesky.core.FileTail`,
+and the rest is shared.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+
+import event_model
+
+from .core import _slice_datum_page, _slice_event_page
+
+# Bump this when the layout of the sidecar index changes.
+INDEX_VERSION = 1
+
+
+def index_path(filename):
+    """
+    Return the path of the sidecar index for a file.
+
+    The index is a hidden file next to the file, so that globs like
+    ``*.jsonl`` do not match it.
+    """
+    directory, basename = os.path.split(filename)
+    return os.path.join(directory, '.{}.index.json'.format(basename))
+
+
+def build_index(filename, read_documents):
+    """
+    Read a file once, and record where each document in it starts.
+
+    The index is written to :func:`index_path` (if that location is writable)
+    and returned. It is a dict with the byte offsets of the RunStart document
+    ('start'), the RunStop document ('stop', or None), the EventDescriptors
+    ('descriptors'), the Resources ('resources', keyed by uid), the Event and
+    EventPage documents of each EventDescriptor ('events', a list of
+    ``[offset, number of events]`` pairs keyed by descriptor uid), and the
+    Datum and DatumPage documents of each Resource ('datums', keyed by
+    resource uid), as well as the resource uid of each datum_id
+    ('resource_uid_by_datum_id').
+
+    Parameters
+    ----------
+    filename : str
+    read_documents : callable
+        Expected signature ``read_documents(file) -> generator``, where
+        ``generator`` yields ``(name, doc, position)`` for each complete
+        document from the file's position on, ``position`` being where that
+        document ends
+
+    Returns
+    -------
+    index : dict
+    """
+    stat = os.stat(filename)
+    index = {'version': INDEX_VERSION,
+             'size': stat.st_size,
+             'mtime_ns': stat.st_mtime_ns,
+             'start': None,
+             'stop': None,
+             'descriptors': [],
+             'resources': {},
+             'events': {},
+             'datums': {},
+             'resource_uid_by_datum_id': {}}
+    offset = 0
+    with open(filename, 'rb') as file:
+        for name, doc, end in read_documents(file):
+            if end > stat.st_size:
+                # This was written after we started; leave it for later.
+                break
+            if name == 'start':
+                index['start'] = offset
+            elif name == 'stop':
+                index['stop'] = offset
+            elif name == 'descriptor':
+                index['descriptors'].append(offset)
+                index['events'].setdefault(doc['uid'], [])
+            elif name == 'event':
+                index['events'].setdefault(doc['descriptor'], []).append(
+                    [offset, 1])
+            elif name == 'event_page':
+                index['events'].setdefault(doc['descriptor'], []).append(
+                    [offset, len(doc['seq_num'])])
+            elif name == 'resource':
+                index['resources'][doc['uid']] = offset
+            elif name == 'datum':
+                index['datums'].setdefault(doc['resource'], []).append(offset)
+                index['resource_uid_by_datum_id'][doc['datum_id']] = (
+                    doc['resource'])
+            elif name == 'datum_page':
+                index['datums'].setdefault(doc['resource'], []).append(offset)
+                for datum_id in doc['datum_id']:
+                    index['resource_uid_by_datum_id'][datum_id] = (
+                        doc['resource'])
+            offset = end
+    try:
+        with open(index_path(filename), 'w') as file:
+            json.dump(index, file, separators=(',', ':'))
+    except OSError:
+        # The directory is read-only. Use the index without saving it.
+        pass
+    return index
+
+
+def load_index(filename):
+    """
+    Read the sidecar index for a file, if it is there and up to date.
+
+    Parameters
+    ----------
+    filename : str
+
+    Returns
+    -------
+    index : dict or None
+        None if there is no index, or if the file has changed since the index
+        was built.
+    """
+    try:
+        with open(index_path(filename), 'r') as file:
+            index = json.load(file)
+    except (OSError, ValueError):
+        return None
+    stat = os.stat(filename)
+    if (index.get('version') != INDEX_VERSION
+            or index['size'] != stat.st_size
+            or index['mtime_ns'] != stat.st_mtime_ns):
+        return None
+    return index
+
+
+class IndexedRunReader:
+    """
+    Read the documents in one file by seeking to them.
+
+    The methods of this object have the signatures of the callables that
+    :class:`intake_bluesky.core.BlueskyRun` expects. The index is loaded, or
+    built if it is missing or out of date, on first use.
+
+    Parameters
+    ----------
+    filename : str
+    read_documents : callable
+        As for :func:`build_index`
+    """
+    def __init__(self, filename, read_documents):
+        self.filename = filename
+        self._read_documents = read_documents
+        self._index = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = load_index(self.filename) or build_index(
+                self.filename, self._read_documents)
+        return self._index
+
+    def _read(self, offsets):
+        "Yield the (name, doc) at each offset."
+        with open(self.filename, 'rb') as file:
+            for offset in offsets:
+                file.seek(offset)
+                for name, doc, _ in self._read_documents(file):
+                    yield name, doc
+                    break
+
+    def _read_one(self, offset):
+        for _, doc in self._read([offset]):
+            return doc
+
+    def get_run_start(self):
+        return self._read_one(self.index['start'])
+
+    def get_run_stop(self):
+        offset = self.index['stop']
+        if offset is None:
+            return None
+        return self._read_one(offset)
+
+    def get_event_descriptors(self):
+        return [doc for _, doc in self._read(self.index['descriptors'])]
+
+    def get_event_pages(self, descriptor_uid, skip=0, limit=None):
+        stop = None if limit is None else skip + limit
+        lines = self.index['events'].get(descriptor_uid, [])
+        # Find the documents that hold Events skip:stop, without reading the
+        # rest.
+        offsets = []
+        position = 0
+        for offset, count in lines:
+            if stop is not None and position >= stop:
+                break
+            if position + count > skip:
+                offsets.append((offset, position))
+            position += count
+        documents = self._read(offset for offset, _ in offsets)
+        for (name, doc), (_, position) in zip(documents, offsets):
+            if name == 'event':
+                doc = event_model.pack_event_page(doc)
+            first = max(skip - position, 0)
+            last = None if stop is None else stop - position
+            if first > 0 or (last is not None and last < len(doc['seq_num'])):
+                doc = _slice_event_page(doc, first, last)
+            yield doc
+
+    def get_event_count(self, descriptor_uid):
+        return sum(count for _, count
+                   in self.index['events'].get(descriptor_uid, []))
+
+    def get_resource(self, uid):
+        return self._read_one(self.index['resources'][uid])
+
+    def lookup_resource_for_datum(self, datum_id):
+        return self.index['resource_uid_by_datum_id'][datum_id]
+
+    def get_datum_pages(self, resource_uid, skip=0, limit=None):
+        stop = None if limit is None else skip + limit
+        offsets = self.index['datums'].get(resource_uid, [])
+        # The index does not record how many Datums each document holds, so
+        # read the documents in order, up to the last one needed.
+        position = 0
+        for name, doc in self._read(offsets):
+            if stop is not None and position >= stop:
+                break
+            if name == 'datum':
+                doc = event_model.pack_datum_page(doc)
+            count = len(doc['datum_id'])
+            if position + count > skip or (skip == 0 and stop is None):
+                first = max(skip - position, 0)
+                last = None if stop is None else stop - position
+                if first > 0 or (last is not None and last < count):
+                    doc = _slice_datum_page(doc, first, last)
+                yield doc
+            position += count
+
+
+def main(read_documents, file_type, argv=None):
+    """
+    Build (or rebuild) the sidecar index of each file named on the command
+    line.
+    """
+    parser = argparse.ArgumentParser(
+        description=f'Index the documents in Bluesky {file_type} files')
+    parser.add_argument('filenames', metavar='FILE', type=str, nargs='+',
+                        help=f'{file_type} file (or glob pattern)')
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    for pattern in args.filenames:
+        for filename in glob.glob(pattern):
+            build_index(filename, read_documents)
+            print(index_path(filename))
@@ -0,0 +1,142 @@
+"""
+Watch for files that match glob patterns, so that a Catalog backed by a
+directory of files can reload only the ones that are new or modified.
+
+This uses watchdog, if it is installed: inotify (or the equivalent on other
+platforms) or, where that does not see changes, such as network file systems
+written to by other machines, watchdog's polling observer. Without watchdog,
+every file is listed on every reload, as if there were no watcher.
+"""
+import fnmatch
+import glob
+import os
+import threading
+import warnings
+
+try:
+    import watchdog.events
+    import watchdog.observers
+    import watchdog.observers.polling
+except ImportError:
+    watchdog = None
+
+
+def _split_pattern(pattern):
+    """
+    Split a glob pattern into the directory to watch and whether that must be
+    watched recursively (because the pattern has wildcards in directories).
+    """
+    parts = pattern.split(os.sep)
+    directory_parts = []
+    for part in parts[:-1]:
+        if glob.has_magic(part):
+            return os.sep.join(directory_parts) or os.curdir, True
+        directory_parts.append(part)
+    return os.sep.join(directory_parts) or os.curdir, False
+
+
+def _matches(path, pattern):
+    "Whether path matches pattern, with the semantics of glob.glob."
+    path_parts = path.split(os.sep)
+    pattern_parts = pattern.split(os.sep)
+    if len(path_parts) != len(pattern_parts):
+        return False
+    for path_part, pattern_part in zip(path_parts, pattern_parts):
+        # Like glob, wildcards do not match names that start with a dot.
+        if path_part.startswith('.') and not pattern_part.startswith('.'):
+            return False
+        if not fnmatch.fnmatch(path_part, pattern_part):
+            return False
+    return True
+
+
+class FileWatcher:
+    """
+    Keep the set of files, matching some glob patterns, that have changed.
+
+    Parameters
+    ----------
+    patterns : list
+        Glob patterns, as passed to ``glob.glob``
+    polling : boolean, optional
+        If True, use watchdog's polling observer, which also works on network
+        file systems, instead of inotify (or its equivalent). False by
+        default.
+    """
+    def __init__(self, patterns, polling=False):
+        self.patterns = [os.path.normpath(pattern) for pattern in patterns]
+        self._lock = threading.Lock()
+        self._observer = None
+        self._changed = set()
+        if watchdog is None:
+            warnings.warn(
+                "Watching for changed files requires watchdog, which is not "
+                "installed. Every file will be listed on every reload.")
+        else:
+            if polling:
+                self._observer = watchdog.observers.polling.PollingObserver()
+            else:
+                self._observer = watchdog.observers.Observer()
+            handler = _Handler(self)
+            watched = set()
+            for pattern in self.patterns:
+                directory, recursive = _split_pattern(pattern)
+                if (directory, recursive) in watched:
+                    continue
+                if not os.path.isdir(directory):
+                    warnings.warn(
+                        f"Cannot watch {directory!r}, which is not a "
+                        f"directory. Files matching {pattern!r} will not "
+                        f"be noticed.")
+                    continue
+                self._observer.schedule(handler, directory,
+                                        recursive=recursive)
+                watched.add((directory, recursive))
+            self._observer.daemon = True
+            self._observer.start()
+            # Start with every file that exists. Listed after the observer
+            # has started, so that no change is missed in between.
+            self._changed = set(self._list_files())
+
+    def _list_files(self):
+        for pattern in self.patterns:
+            for filename in glob.glob(pattern):
+                yield os.path.normpath(filename)
+
+    def _add(self, path):
+        path = os.path.normpath(path)
+        if any(_matches(path, pattern) for pattern in self.patterns):
+            with self._lock:
+                self._changed.add(path)
+
+    def changed(self):
+        """
+        Return the files that have been created or modified since last time.
+
+        The first call returns all the files that match. Without watchdog,
+        every call does.
+        """
+        if self._observer is None:
+            return sorted(set(self._list_files()))
+        with self._lock:
+            changed, self._changed = self._changed, set()
+        return sorted(changed)
+
+    def stop(self):
+        "Stop watching."
+        if self._observer is not None:
+            self._observer.stop()
+
+
+if watchdog is not None:
+    class _Handler(watchdog.events.FileSystemEventHandler):
+        def __init__(self, watcher):
+            self.watcher = watcher
+
+        def on_any_event(self, event):
+            if event.is_directory:
+                return
+            if event.event_type in ('created', 'modified', 'closed'):
+                self.watcher._add(event.src_path)
+            elif event.event_type == 'moved':
+                self.watcher._add(event.dest_path)
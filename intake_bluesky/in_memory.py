@@ -1,12 +1,35 @@
+import bisect
+import collections
+import collections.abc
 import copy
 import event_model
 import intake
 import intake.catalog
 import intake.catalog.local
 import intake.source.base
-from mongoquery import Query
+import itertools
+import numpy
 
 from .core import parse_handler_registry
+from .query_engine import CompiledQuery, StartDocTable
+
+# Partial uids matching more than this many runs are reported as ambiguous
+# without listing every match.
+MAX_LISTED_MATCHES = 20
+
+
+def _index_keys(run_start_doc):
+    """
+    Return the keys of a run in the indexes: (time, uid), and its scan_id, or
+    None if it has none that can be looked up.
+    """
+    scan_id = run_start_doc.get('scan_id')
+    try:
+        hash(scan_id)
+    except TypeError:
+        # Such as a list, which is never equal to the integer of a lookup
+        scan_id = None
+    return (run_start_doc['time'], run_start_doc['uid']), scan_id
 
 
 class SafeLocalCatalogEntry(intake.catalog.local.LocalCatalogEntry):
@@ -17,10 +40,48 @@ class SafeLocalCatalogEntry(intake.catalog.local.LocalCatalogEntry):
         return copy.deepcopy(super().describe())
 
 
+class _Entries(collections.abc.Mapping):
+    """
+    The entries of a BlueskyInMemoryCatalog's runs, each made when it is
+    first looked up.
+
+    Making an entry costs far more than adding a run, so a Catalog (or a set
+    of search results) of many runs makes only those that are used.
+    """
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._made = {}
+
+    def __getitem__(self, uid):
+        try:
+            return self._made[uid]
+        except KeyError:
+            catalog = self.catalog
+            run_start_doc = catalog._uid_to_run_start_doc[uid]
+            entry = catalog._make_entry(run_start_doc,
+                                        *catalog._uid_to_gen[uid])
+            self._made[uid] = entry
+            return entry
+
+    def __iter__(self):
+        yield from self.catalog._uid_to_run_start_doc
+
+    def __contains__(self, uid):
+        return uid in self.catalog._uid_to_run_start_doc
+
+    def __len__(self):
+        return len(self.catalog._uid_to_run_start_doc)
+
+    def forget(self, uid):
+        "Drop the entry made for a run, which has been replaced."
+        self._made.pop(uid, None)
+
+
 class BlueskyInMemoryCatalog(intake.catalog.Catalog):
     name = 'bluesky-run-catalog'  # noqa
 
-    def __init__(self, handler_registry=None, query=None, **kwargs):
+    def __init__(self, handler_registry=None, query=None, lazy=False,
+                 consolidate=False, **kwargs):
         """
         This Catalog is backed by Python collections in memory.
 
@@ -36,18 +97,74 @@ class BlueskyInMemoryCatalog(intake.catalog.Catalog):
             ``{'SOME_SPEC': 'module.submodule.class_name'}``.
         query : dict, optional
             Mongo query that filters entries' RunStart documents
+        lazy : boolean, optional
+            If True, runs added with ``upsert`` keep only the Events of the
+            streams that have been read in memory, running their generators
+            again to read each stream (see
+            :class:`intake_bluesky.core.BlueskyRunFromGenerator`). False by
+            default.
+        consolidate : boolean, optional
+            If True, runs keep their Events in a few large EventPages, column
+            by column (see :class:`intake_bluesky.core.DocumentCache`), which
+            takes less memory and is quicker to read for runs recorded one
+            Event at a time. False by default.
         **kwargs :
             Additional keyword arguments are passed through to the base class,
             Catalog.
         """
         self._query = query or {}
+        self.lazy = lazy
+        self.consolidate = consolidate
+        self._compiled_query = CompiledQuery(self._query)
         if handler_registry is None:
             handler_registry = {}
         parsed_handler_registry = parse_handler_registry(handler_registry)
         self.filler = event_model.Filler(parsed_handler_registry, inplace=True)
+        # The RunStart document of every run in this Catalog, and the
+        # (gen_func, gen_args, gen_kwargs) that yields the run's documents
         self._uid_to_run_start_doc = {}
+        self._uid_to_gen = {}
+        # Indexes for __getitem__: (time, uid) pairs sorted by time, overall
+        # and for each scan_id, and all uids, sorted, for lookup by partial
+        # uid. Runs are appended as they are added, and the lists are sorted
+        # when next looked up (see _sort_indexes), so that adding n runs
+        # costs one sort rather than n insertions.
+        self._time_index = []
+        self._scan_id_to_time_index = collections.defaultdict(list)
+        self._sorted_uids = []
+        # Which indexes have runs appended since they were sorted
+        self._time_index_sorted = True
+        self._sorted_uids_sorted = True
+        self._unsorted_scan_ids = set()
+        # Whether a run has been replaced by one with another time or
+        # scan_id, so that the indexes must be rebuilt
+        self._indexes_stale = False
+        # The RunStart documents as columns, for search; built when needed
+        self._start_doc_table = None
+        # Incremented whenever a run is added or replaced
+        self._version = 0
+        # If this Catalog holds search results, the Catalog that was searched
+        # (which it reloads from) and that Catalog's _version when last seen
+        self._parent = None
+        self._parent_version = None
         super().__init__(**kwargs)
 
+    def _load(self):
+        if self._parent is not None:
+            self._load_from_parent()
+
+    def _load_from_parent(self):
+        """
+        Reload the Catalog that was searched, and add any runs it has gained.
+
+        Search results do not read anything themselves. They share the
+        RunStart documents (and, in subclasses, the files' state) of the
+        Catalog they came from, so reloading them costs only the filtering.
+        """
+        self._parent.reload()
+        if self._parent._version != self._parent_version:
+            self._parent._add_runs_to(self)
+
     def upsert(self, gen_func, gen_args, gen_kwargs):
         gen = gen_func(*gen_args, **gen_kwargs)
         name, run_start_doc = next(gen)
@@ -56,13 +173,44 @@ class BlueskyInMemoryCatalog(intake.catalog.Catalog):
             raise ValueError("Expected a generator of (name, doc) pairs where "
                              "the first entry was ('start', {...}).")
 
-        if not Query(self._query).match(run_start_doc):
+        self._add_run(run_start_doc, gen_func, gen_args, gen_kwargs)
+
+    def _add_run(self, run_start_doc, gen_func, gen_args, gen_kwargs):
+        """
+        Add a run whose RunStart document has already been read.
+
+        The run is skipped if it does not match this Catalog's query.
+        """
+        if not self._compiled_query.match(run_start_doc):
             return
+        self._insert_run(run_start_doc, gen_func, gen_args, gen_kwargs)
 
+    def _insert_run(self, run_start_doc, gen_func, gen_args, gen_kwargs):
+        "Add a run that is known to match this Catalog's query."
+        self._start_doc_table = None
+        self._version += 1
         uid = run_start_doc['uid']
+        old_run_start_doc = self._uid_to_run_start_doc.get(uid)
+        if old_run_start_doc is None:
+            self._sorted_uids.append(uid)
+            self._sorted_uids_sorted = False
+            self._index(run_start_doc)
+        elif _index_keys(old_run_start_doc) != _index_keys(run_start_doc):
+            # Removing the old keys from the middle of the lists would cost
+            # as much as rebuilding them, which is put off until a lookup.
+            self._indexes_stale = True
         self._uid_to_run_start_doc[uid] = run_start_doc
+        self._uid_to_gen[uid] = (gen_func, gen_args, gen_kwargs)
+        self._entries.forget(uid)
 
-        entry = SafeLocalCatalogEntry(
+    def _make_entries_container(self):
+        return _Entries(self)
+
+    def _make_entry(self, run_start_doc, gen_func, gen_args, gen_kwargs):
+        """
+        Make the catalog entry for a run. Subclasses may override this.
+        """
+        return SafeLocalCatalogEntry(
             name=run_start_doc['uid'],
             description={},  # TODO
             driver='intake_bluesky.core.BlueskyRunFromGenerator',
@@ -70,7 +218,9 @@ class BlueskyInMemoryCatalog(intake.catalog.Catalog):
             args={'gen_func': gen_func,
                   'gen_args': gen_args,
                   'gen_kwargs': gen_kwargs,
-                  'filler': self.filler},
+                  'filler': self.filler,
+                  'lazy': self.lazy,
+                  'consolidate': self.consolidate},
             cache=None,  # ???
             parameters=[],
             metadata={'start': run_start_doc, 'stop': None},
@@ -78,7 +228,70 @@ class BlueskyInMemoryCatalog(intake.catalog.Catalog):
             getenv=True,
             getshell=True,
             catalog=self)
-        self._entries[uid] = entry
+
+    def _make_reader_entry(self, run_start_doc, reader, run_stop_doc=None):
+        """
+        Make the catalog entry for a run whose documents reader fetches.
+
+        reader has methods with the names and signatures of the callables
+        that BlueskyRun expects (get_run_start, get_run_stop, ...), and its
+        get_event_pages must honor skip and limit exactly. run_stop_doc, if
+        already known, is put in the entry's metadata.
+        """
+        args = dict(
+            get_run_start=reader.get_run_start,
+            get_run_stop=reader.get_run_stop,
+            get_event_descriptors=reader.get_event_descriptors,
+            get_event_pages=reader.get_event_pages,
+            get_event_count=reader.get_event_count,
+            get_resource=reader.get_resource,
+            lookup_resource_for_datum=reader.lookup_resource_for_datum,
+            get_datum_pages=reader.get_datum_pages,
+            filler=self.filler,
+            exact_skip_limit=True)
+        return SafeLocalCatalogEntry(
+            name=run_start_doc['uid'],
+            description={},  # TODO
+            driver='intake_bluesky.core.BlueskyRun',
+            direct_access='forbid',
+            args=args,
+            cache=None,  # ???
+            parameters=[],
+            metadata={'start': run_start_doc, 'stop': run_stop_doc},
+            catalog_dir=None,
+            getenv=True,
+            getshell=True,
+            catalog=self)
+
+    def _index(self, run_start_doc):
+        key, scan_id = _index_keys(run_start_doc)
+        self._time_index.append(key)
+        self._time_index_sorted = False
+        if scan_id is not None:
+            self._scan_id_to_time_index[scan_id].append(key)
+            self._unsorted_scan_ids.add(scan_id)
+
+    def _sort_indexes(self):
+        "Bring the indexes up to date, before a lookup."
+        if self._indexes_stale:
+            self._time_index = []
+            self._scan_id_to_time_index = collections.defaultdict(list)
+            for run_start_doc in self._uid_to_run_start_doc.values():
+                self._index(run_start_doc)
+            self._sorted_uids = list(self._uid_to_run_start_doc)
+            self._sorted_uids_sorted = False
+            self._indexes_stale = False
+        # Most of each list is usually sorted already, which list.sort is
+        # quick at.
+        if not self._time_index_sorted:
+            self._time_index.sort()
+            self._time_index_sorted = True
+        if not self._sorted_uids_sorted:
+            self._sorted_uids.sort()
+            self._sorted_uids_sorted = True
+        for scan_id in self._unsorted_scan_ids:
+            self._scan_id_to_time_index[scan_id].sort()
+        self._unsorted_scan_ids.clear()
 
     def search(self, query):
         """
@@ -93,20 +306,69 @@ class BlueskyInMemoryCatalog(intake.catalog.Catalog):
         cat = type(self)(
             query=query,
             handler_registry=self.filler.handler_registry,
+            lazy=self.lazy,
+            consolidate=self.consolidate,
             name='search results',
             getenv=self.getenv,
             getshell=self.getshell,
             auth=self.auth,
             metadata=(self.metadata or {}).copy(),
             storage_options=self.storage_options)
-        for key, entry in self._entries.items():
-            args = entry._captured_init_kwargs['args']
-            cat.upsert(args['gen_func'],
-                       args['gen_args'],
-                       args['gen_kwargs'])
+        cat._parent = self
+        self._add_runs_to(cat)
         return cat
 
+    def _add_runs_to(self, cat):
+        """
+        Add this Catalog's runs to cat, which filters them with its query.
+
+        This uses the RunStart documents already in memory, so it does not
+        run any generators (and, in subclasses, read any files). The query is
+        evaluated over all of them at once, and only the matches are visited.
+        cat shares this Catalog's RunStart documents and generators, and
+        makes entries for them only as they are looked up. Runs that cat
+        already has from this Catalog are left alone.
+        """
+        mask = self._search_mask(cat._compiled_query)
+        matches = numpy.flatnonzero(mask).tolist()
+        uids = list(self._uid_to_run_start_doc)
+        if not cat._uid_to_run_start_doc:
+            # Fill cat in bulk. Its indexes are built on its first lookup.
+            run_start_docs = list(self._uid_to_run_start_doc.values())
+            cat._uid_to_run_start_doc = {uids[i]: run_start_docs[i]
+                                         for i in matches}
+            cat._uid_to_gen = {uid: self._uid_to_gen[uid]
+                               for uid in cat._uid_to_run_start_doc}
+            cat._indexes_stale = True
+            cat._version += 1
+            if self._start_doc_table is not None:
+                # cat holds exactly the matches, in the same order, so it can
+                # reuse the columns already extracted here for its searches.
+                cat._start_doc_table = self._start_doc_table.subset(mask)
+        else:
+            for i in matches:
+                uid = uids[i]
+                run_start_doc = self._uid_to_run_start_doc[uid]
+                gen = self._uid_to_gen[uid]
+                if not (cat._uid_to_run_start_doc.get(uid) is run_start_doc
+                        and cat._uid_to_gen[uid] == gen):
+                    cat._insert_run(run_start_doc, *gen)
+        cat._parent_version = self._version
+
+    def _search_mask(self, compiled_query):
+        """
+        Return a boolean array: which of this Catalog's runs match a query.
+
+        Subclasses that keep an index of their runs elsewhere may override
+        this to answer queries from it.
+        """
+        if self._start_doc_table is None:
+            self._start_doc_table = StartDocTable(
+                self._uid_to_run_start_doc.values())
+        return compiled_query.mask(self._start_doc_table)
+
     def __getitem__(self, name):
+        self._sort_indexes()
         # If this came from a client, we might be getting '-1'.
         try:
             N = int(name)
@@ -114,40 +376,40 @@ class BlueskyInMemoryCatalog(intake.catalog.Catalog):
             if name in self._uid_to_run_start_doc:
                 uid = name
             else:
-                # Try looking up by *partial* uid.
-                matches = []
-                for uid, run_start_doc in list(self._uid_to_run_start_doc.items()):
-                    if uid.startswith(name):
-                        matches.append(uid)
+                # Try looking up by *partial* uid. The uids that start with
+                # name are together in the sorted list, starting at lo.
+                lo = bisect.bisect_left(self._sorted_uids, name)
+                matches = list(itertools.takewhile(
+                    lambda uid: uid.startswith(name),
+                    self._sorted_uids[lo:lo + MAX_LISTED_MATCHES + 1]))
                 if not matches:
                     raise KeyError(name)
                 elif len(matches) > 1:
-                    match_list = '\n'.join(matches)
+                    match_list = '\n'.join(matches[:MAX_LISTED_MATCHES])
+                    if len(matches) > MAX_LISTED_MATCHES:
+                        match_list += '\n...'
                     raise ValueError(
                         f"Multiple matches to partial uid {name!r}:\n"
                         f"{match_list}")
                 else:
                     uid, = matches
         else:
-            # Sort in reverse chronological order (most recent first).
-            time_sorted = sorted(self._uid_to_run_start_doc.values(),
-                                 key=lambda doc: -doc['time'])
+            # The indexes are sorted in chronological order (most recent
+            # last).
             if N < 0:
                 # Interpret negative N as "the Nth from last entry".
-                if -N > len(time_sorted):
+                if -N > len(self._time_index):
                     raise IndexError(
-                        f"Catalog only contains {len(time_sorted)} "
+                        f"Catalog only contains {len(self._time_index)} "
                         f"runs.")
-                uid = time_sorted[-N - 1]['uid']
+                _, uid = self._time_index[N]
             else:
                 # Interpret positive N as
                 # "most recent entry with scan_id == N".
-                for run_start_doc in time_sorted:
-                    if run_start_doc.get('scan_id') == N:
-                        uid = run_start_doc['uid']
-                        break
-                else:
+                time_index = self._scan_id_to_time_index.get(N)
+                if not time_index:
                     raise KeyError(f"No run with scan_id={N}")
+                _, uid = time_index[-1]
         return self._entries[uid]
 
     def __len__(self):
@@ -1,87 +1,183 @@
-import glob
 import json
 import os
-import pathlib
 
-from .in_memory import BlueskyInMemoryCatalog
+import numpy
 
+from . import file_index
+from .file_catalog import BlueskyFileCatalog
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _loads(line):
+    """
+    Decode one line of JSON, with orjson if it is installed.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(line)
+        except orjson.JSONDecodeError:
+            # orjson is strict where the json module is not: it rejects NaN
+            # and Infinity (which json.dumps writes by default) and integers
+            # that do not fit in 64 bits.
+            pass
+    return json.loads(line)
 
-class BlueskyJSONLCatalog(BlueskyInMemoryCatalog):
-    name = 'bluesky-jsonl-catalog'  # noqa
 
-    def __init__(self, paths, *,
-                 handler_registry=None, query=None, **kwargs):
-        """
-        This Catalog is backed by a newline-delimited JSON (jsonl) file.
-
-        Each line of the file is expected to be a JSON list with two elements,
-        the document name (type) and the document itself. The documents are
-        expected to be in chronological order.
-
-        Parameters
-        ----------
-        paths : list
-            list of filepaths
-        handler_registry : dict, optional
-            Maps each asset spec to a handler class or a string specifying the
-            module name and class name, as in (for example)
-            ``{'SOME_SPEC': 'module.submodule.class_name'}``.
-        query : dict, optional
-            Mongo query that filters entries' RunStart documents
-        **kwargs :
-            Additional keyword arguments are passed through to the base class,
-            Catalog.
-        """
-        # Tolerate a single path (as opposed to a list).
-        if isinstance(paths, (str, pathlib.Path)):
-            paths = [paths]
-        self.paths = paths
-        self._filename_to_mtime = {}
-        super().__init__(handler_registry=handler_registry,
-                         query=query,
-                         **kwargs)
-
-    def _load(self):
-        for path in self.paths:
-            for filename in glob.glob(path):
-                mtime = os.path.getmtime(filename)
-                if mtime == self._filename_to_mtime.get(filename):
-                    # This file has not changed since last time we loaded it.
+def _decode(line):
+    """
+    Decode a (name, doc) pair, with numeric lists in Event data as arrays.
+
+    Each list of numbers (or nested lists of numbers, of a regular shape) in
+    the 'data' of an Event or EventPage becomes a numpy array, which takes
+    much less memory than a list of Python floats. Other values, including
+    lists of booleans, strings, or None, are left alone.
+    """
+    name, doc = _loads(line)
+    if name in ('event', 'event_page'):
+        data = doc['data']
+        for key, value in data.items():
+            if isinstance(value, list) and value:
+                try:
+                    array = numpy.asarray(value)
+                except ValueError:
+                    # ragged
                     continue
-                self._filename_to_mtime[filename] = mtime
-                with open(filename, 'r') as file:
-                    try:
-                        name, run_start_doc = json.loads(file.readline())
-                    except json.JSONDecodeError:
-                        if not file.readline():
-                            # Empty file, maybe being written to currently
-                            continue
-
-                def gen():
-                    with open(filename, 'r') as file:
-                        for line in file:
-                            name, doc = json.loads(line)
-                            yield (name, doc)
-                self.upsert(gen, (), {})
-
-    def search(self, query):
-        """
-        Return a new Catalog with a subset of the entries in this Catalog.
-
-        Parameters
-        ----------
-        query : dict
-        """
-        if self._query:
-            query = {'$and': [self._query, query]}
-        cat = type(self)(
-            paths=self.paths,
-            query=query,
-            handler_registry=self.filler.handler_registry,
-            name='search results',
-            getenv=self.getenv,
-            getshell=self.getshell,
-            auth=self.auth,
-            metadata=(self.metadata or {}).copy(),
-            storage_options=self.storage_options)
-        return cat
+                if array.dtype.kind in 'iuf':
+                    data[key] = array
+    return name, doc
+
+
+def _read_documents(file):
+    """
+    Yield (name, doc, position) for each complete line, from file's position.
+    """
+    position = file.tell()
+    for line in file:
+        if line.strip():
+            try:
+                name, doc = _decode(line)
+            except ValueError:
+                if line.endswith(b'\n'):
+                    raise
+                # This last line is still being written.
+                return
+            position += len(line)
+            yield name, doc, position
+        else:
+            position += len(line)
+
+
+def _read_run_start(filename):
+    """
+    Return the first (name, doc) pair in a file, or None if it is empty.
+    """
+    with open(filename, 'rb') as file:
+        line = file.readline()
+        try:
+            return _loads(line)
+        except ValueError:
+            if not line or not file.readline():
+                # maybe being written to currently
+                return None
+            raise
+
+
+def _read_run_stop(filename):
+    """
+    Return the RunStop document on the last line of a file, or None if the
+    last line is something else.
+
+    Only the end of the file is read.
+    """
+    with open(filename, 'rb') as file:
+        position = file.seek(0, os.SEEK_END)
+        tail = b''
+        while position > 0:
+            step = min(position, 4096)
+            position -= step
+            file.seek(position)
+            tail = file.read(step) + tail
+            stripped = tail.rstrip()
+            if b'\n' in stripped or position == 0:
+                line = stripped.rsplit(b'\n', 1)[-1]
+                break
+        else:
+            return None
+    try:
+        name, doc = _loads(line)
+    except (ValueError, TypeError):
+        # maybe being written to currently
+        return None
+    return doc if name == 'stop' else None
+
+
+def _gen_documents(filename):
+    """
+    Yield the (name, doc) pairs in one file.
+    """
+    with open(filename, 'rb') as file:
+        for line in file:
+            yield _decode(line)
+
+
+def build_index(filename):
+    """
+    Build the sidecar index of a JSONL file, and return it.
+
+    See :func:`intake_bluesky.file_index.build_index`.
+    """
+    return file_index.build_index(filename, _read_documents)
+
+
+def load_index(filename):
+    """
+    Return the sidecar index of a JSONL file, or None if it is missing or out
+    of date.
+    """
+    return file_index.load_index(filename)
+
+
+class IndexedRunReader(file_index.IndexedRunReader):
+    """
+    Read the documents in one JSONL file by seeking to them.
+
+    See :class:`intake_bluesky.file_index.IndexedRunReader`.
+
+    Parameters
+    ----------
+    filename : str
+    """
+    def __init__(self, filename):
+        super().__init__(filename, _read_documents)
+
+
+class BlueskyJSONLCatalog(BlueskyFileCatalog):
+    """
+    This Catalog is backed by newline-delimited JSON (jsonl) files.
+
+    Each line of a file is expected to be a JSON list with two elements, the
+    document name (type) and the document itself. The documents are expected
+    to be in chronological order. The parameters are those of
+    :class:`intake_bluesky.file_catalog.BlueskyFileCatalog`.
+    """
+    name = 'bluesky-jsonl-catalog'  # noqa
+
+    _read_run_start = staticmethod(_read_run_start)
+    _read_run_stop = staticmethod(_read_run_stop)
+    _read_documents = staticmethod(_read_documents)
+    _gen_documents = staticmethod(_gen_documents)
+
+
+def main(argv=None):
+    """
+    Build (or rebuild) the sidecar index of each JSONL file given.
+    """
+    file_index.main(_read_documents, 'JSONL', argv)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,11 @@
-import glob
+import mmap
 import msgpack
 import msgpack_numpy
 import os
-import pathlib
+import struct
 
-from .in_memory import BlueskyInMemoryCatalog
+from . import file_index
+from .file_catalog import BlueskyFileCatalog
 
 
 UNPACK_OPTIONS = dict(object_hook=msgpack_numpy.decode,
@@ -12,80 +13,312 @@ UNPACK_OPTIONS = dict(object_hook=msgpack_numpy.decode,
                       max_buffer_size=1_000_000_000)
 
 
-class BlueskyMsgpackCatalog(BlueskyInMemoryCatalog):
-    name = 'bluesky-msgpack-catalog'  # noqa
+def _read_documents(file):
+    """
+    Yield (name, doc, position) for each complete document, from file's
+    position.
+    """
+    start = file.tell()
+    # Iteration stops at a document that is still being written.
+    unpacker = msgpack.Unpacker(file, **UNPACK_OPTIONS)
+    for name, doc in unpacker:
+        yield name, doc, start + unpacker.tell()
+
+
+class _Incomplete(Exception):
+    "The buffer ends part way through an object."
+
+
+# Format byte -> struct of a number, or of the length of a str, bin, array or
+# map, that follows it
+_STRUCTS = {code: struct.Struct(fmt) for code, fmt in {
+    0xca: '>f', 0xcb: '>d',
+    0xcc: '>B', 0xcd: '>H', 0xce: '>I', 0xcf: '>Q',
+    0xd0: '>b', 0xd1: '>h', 0xd2: '>i', 0xd3: '>q',
+    0xc4: '>B', 0xc5: '>H', 0xc6: '>I',  # bin
+    0xd9: '>B', 0xda: '>H', 0xdb: '>I',  # str
+    0xdc: '>H', 0xdd: '>I',  # array
+    0xde: '>H', 0xdf: '>I',  # map
+    0xc7: '>B', 0xc8: '>H', 0xc9: '>I',  # ext
+}.items()}
+# Format byte -> size of the data in a fixext (which also has a type byte)
+_FIXEXT_SIZES = {0xd4: 1, 0xd5: 2, 0xd6: 4, 0xd7: 8, 0xd8: 16}
+
+
+class _MappedUnpacker:
+    """
+    Unpack msgpack from a buffer, leaving ndarray payloads in place.
+
+    This gives the same objects as ``msgpack.Unpacker(...,
+    **UNPACK_OPTIONS)`` except that the ndarrays encoded by msgpack_numpy
+    are read-only views into the buffer rather than copies of it. Everything
+    else is unpacked as usual; the payloads of the arrays are not read.
+    """
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.size = len(buffer)
+
+    def _read(self, position, length):
+        end = position + length
+        if end > self.size:
+            raise _Incomplete
+        return self.buffer[position:end], end
+
+    def _number(self, code, position):
+        struct_ = _STRUCTS[code]
+        if position + struct_.size > self.size:
+            raise _Incomplete
+        return struct_.unpack_from(self.buffer, position)[0], (
+            position + struct_.size)
+
+    def unpack(self, position):
+        """
+        Unpack the object at position. Return it and the position after it.
 
-    def __init__(self, paths, *,
-                 handler_registry=None, query=None, **kwargs):
+        Binary data is returned as a memoryview into the buffer.
         """
-        This Catalog is backed by msgpack files.
+        if position >= self.size:
+            raise _Incomplete
+        code = self.buffer[position]
+        position += 1
+        if code <= 0x7f:
+            return code, position
+        elif code >= 0xe0:
+            return code - 0x100, position
+        elif 0xa0 <= code <= 0xbf:
+            data, position = self._read(position, code & 0x1f)
+            return str(data, 'utf-8'), position
+        elif 0x90 <= code <= 0x9f:
+            return self._unpack_array(code & 0x0f, position)
+        elif 0x80 <= code <= 0x8f:
+            return self._unpack_map(code & 0x0f, position)
+        elif code == 0xc0:
+            return None, position
+        elif code == 0xc2:
+            return False, position
+        elif code == 0xc3:
+            return True, position
+        elif 0xca <= code <= 0xd3:
+            return self._number(code, position)
+        elif code in (0xc4, 0xc5, 0xc6):
+            length, position = self._number(code, position)
+            return self._read(position, length)
+        elif code in (0xd9, 0xda, 0xdb):
+            length, position = self._number(code, position)
+            data, position = self._read(position, length)
+            return str(data, 'utf-8'), position
+        elif code in (0xdc, 0xdd):
+            length, position = self._number(code, position)
+            return self._unpack_array(length, position)
+        elif code in (0xde, 0xdf):
+            length, position = self._number(code, position)
+            return self._unpack_map(length, position)
+        elif code in (0xc7, 0xc8, 0xc9) or code in _FIXEXT_SIZES:
+            # Extension types are rare: leave them to msgpack.
+            start = position - 1
+            if code in _FIXEXT_SIZES:
+                length = _FIXEXT_SIZES[code]
+            else:
+                length, position = self._number(code, position)
+            _, end = self._read(position, 1 + length)
+            return msgpack.unpackb(self.buffer[start:end],
+                                   object_hook=msgpack_numpy.decode,
+                                   raw=False), end
+        else:
+            raise ValueError(f"Invalid msgpack format byte {code:#x}")
+
+    def _unpack_array(self, length, position):
+        items = []
+        for _ in range(length):
+            item, position = self.unpack(position)
+            if isinstance(item, memoryview):
+                item = bytes(item)
+            items.append(item)
+        return items, position
+
+    def _unpack_map(self, length, position):
+        obj = {}
+        for _ in range(length):
+            key, position = self.unpack(position)
+            if isinstance(key, memoryview):
+                key = bytes(key)
+            obj[key], position = self.unpack(position)
+        # Keep the payload of an ndarray in place. Copy any other binary.
+        is_ndarray = obj.get(b'nd') is True
+        for key, value in obj.items():
+            if isinstance(value, memoryview) and not (
+                    is_ndarray and key == b'data'):
+                obj[key] = bytes(value)
+        return msgpack_numpy.decode(obj), position
+
+
+def _map(file):
+    "Return a read-only memory map of a (non-empty) file, as a memoryview."
+    # The map stays open for as long as any array views it.
+    return memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def _read_documents_mapped(file, buffer=None):
+    """
+    Yield (name, doc, position) for each complete document, from file's
+    position, with arrays as read-only views into a memory map of the file.
+
+    If buffer is given, it is a map of the file (from :func:`_map`) to read
+    instead of mapping the file again.
+    """
+    start = file.tell()
+    if buffer is None:
+        if os.fstat(file.fileno()).st_size == start:
+            return
+        buffer = _map(file)
+    unpacker = _MappedUnpacker(buffer)
+    position = start
+    while position < unpacker.size:
+        try:
+            (name, doc), position = unpacker.unpack(position)
+        except _Incomplete:
+            # This document is still being written.
+            return
+        yield name, doc, position
+
+
+def _read_run_start(filename):
+    """
+    Return the first (name, doc) pair in a file, or None if it is empty.
+    """
+    with open(filename, 'rb') as file:
+        try:
+            return next(msgpack.Unpacker(file, **UNPACK_OPTIONS))
+        except StopIteration:
+            # maybe being written to currently
+            return None
+
+
+def _read_run_stop(filename):
+    """
+    Return the RunStop document in a file if its sidecar index (see
+    :func:`build_index`) is up to date and records one, and None otherwise:
+    finding it without an index would mean unpacking the whole file.
+    """
+    index = load_index(filename)
+    if index is None or index['stop'] is None:
+        return None
+    with open(filename, 'rb') as file:
+        file.seek(index['stop'])
+        for _, doc, _ in _read_documents(file):
+            return doc
+
 
-        Each chunk the file is expected to be a list with two elements,
-        the document name (type) and the document itself. The documents are
-        expected to be in chronological order.
+def _gen_documents(filename):
+    """
+    Yield the (name, doc) pairs in one file.
+    """
+    with open(filename, 'rb') as file:
+        yield from msgpack.Unpacker(file, **UNPACK_OPTIONS)
 
+
+def build_index(filename):
+    """
+    Build the sidecar index of a msgpack file, and return it.
+
+    See :func:`intake_bluesky.file_index.build_index`.
+    """
+    return file_index.build_index(filename, _read_documents)
+
+
+def load_index(filename):
+    """
+    Return the sidecar index of a msgpack file, or None if it is missing or
+    out of date.
+    """
+    return file_index.load_index(filename)
+
+
+class IndexedRunReader(file_index.IndexedRunReader):
+    """
+    Read the documents in one msgpack file by seeking to them.
+
+    See :class:`intake_bluesky.file_index.IndexedRunReader`.
+
+    Parameters
+    ----------
+    filename : str
+    memory_map : boolean, optional
+        If True, read arrays as views into a memory map of the file.
+    """
+    def __init__(self, filename, memory_map=False):
+        self.memory_map = memory_map
+        if memory_map:
+            read_documents = _read_documents_mapped
+        else:
+            read_documents = _read_documents
+        super().__init__(filename, read_documents)
+
+    def _read(self, offsets):
+        if not self.memory_map:
+            yield from super()._read(offsets)
+            return
+        # Map the file once for all the offsets, rather than once for each.
+        with open(self.filename, 'rb') as file:
+            buffer = None
+            for offset in offsets:
+                if buffer is None:
+                    buffer = _map(file)
+                file.seek(offset)
+                for name, doc, _ in _read_documents_mapped(file, buffer):
+                    yield name, doc
+                    break
+
+
+class BlueskyMsgpackCatalog(BlueskyFileCatalog):
+    """
+    This Catalog is backed by msgpack files.
+
+    Each chunk the file is expected to be a list with two elements, the
+    document name (type) and the document itself. The documents are expected
+    to be in chronological order.
+    """
+    name = 'bluesky-msgpack-catalog'  # noqa
+    FORMAT_OPTIONS = ('memory_map',)
+
+    def __init__(self, paths, *, memory_map=False, **kwargs):
+        """
         Parameters
         ----------
         paths : list
             list of filepaths
-        handler_registry : dict, optional
-            Maps each asset spec to a handler class or a string specifying the
-            module name and class name, as in (for example)
-            ``{'SOME_SPEC': 'module.submodule.class_name'}``.
-        query : dict, optional
-            Mongo query that filters entries' RunStart documents
+        memory_map : boolean, optional
+            If True, memory-map the files and read arrays (e.g. images) as
+            read-only views into the map, so that only the parts of a file
+            that are used are read from disk. The rest of each document is
+            unpacked in Python, which is slower than the default unpacker for
+            files with only small arrays and scalars. False by default.
         **kwargs :
-            Additional keyword arguments are passed through to the base class,
-            Catalog.
+            The other parameters are those of
+            :class:`intake_bluesky.file_catalog.BlueskyFileCatalog`.
         """
-        # Tolerate a single path (as opposed to a list).
-        if isinstance(paths, (str, pathlib.Path)):
-            paths = [paths]
-        self.paths = paths
-        self._filename_to_mtime = {}
-        super().__init__(handler_registry=handler_registry,
-                         query=query,
-                         **kwargs)
-
-    def _load(self):
-        for path in self.paths:
-            for filename in glob.glob(path):
-                mtime = os.path.getmtime(filename)
-                if mtime == self._filename_to_mtime.get(filename):
-                    # This file has not changed since last time we loaded it.
-                    continue
-                self._filename_to_mtime[filename] = mtime
-                with open(filename, 'rb') as file:
-                    unpacker = msgpack.Unpacker(file, **UNPACK_OPTIONS)
-                    try:
-                        name, run_start_doc = next(unpacker)
-                    except StopIteration:
-                        # Empty file, maybe being written to currently
-                        continue
-
-                def gen():
-                    with open(filename, 'rb') as file:
-                        yield from msgpack.Unpacker(file, **UNPACK_OPTIONS)
-                self.upsert(gen, (), {})
-
-    def search(self, query):
-        """
-        Return a new Catalog with a subset of the entries in this Catalog.
+        self.memory_map = memory_map
+        if memory_map:
+            # A function, not a method, as the readers of the entries hold it
+            # and entries deep-copy their arguments.
+            self._read_documents = _read_documents_mapped
+        super().__init__(paths, **kwargs)
 
-        Parameters
-        ----------
-        query : dict
-        """
-        if self._query:
-            query = {'$and': [self._query, query]}
-        cat = type(self)(
-            paths=self.paths,
-            query=query,
-            handler_registry=self.filler.handler_registry,
-            name='search results',
-            getenv=self.getenv,
-            getshell=self.getshell,
-            auth=self.auth,
-            metadata=(self.metadata or {}).copy(),
-            storage_options=self.storage_options)
-        return cat
+    _read_run_start = staticmethod(_read_run_start)
+    _read_run_stop = staticmethod(_read_run_stop)
+    _read_documents = staticmethod(_read_documents)
+    _gen_documents = staticmethod(_gen_documents)
+
+    def _index_reader(self, filename):
+        return IndexedRunReader(filename, memory_map=self.memory_map)
+
+
+def main(argv=None):
+    """
+    Build (or rebuild) the sidecar index of each msgpack file given.
+    """
+    file_index.main(_read_documents, 'msgpack', argv)
+
+
+if __name__ == "__main__":
+    main()
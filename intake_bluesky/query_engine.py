@@ -0,0 +1,300 @@
+"""
+Evaluate Mongo-style queries over many RunStart documents at once.
+
+mongoquery matches one document at a time. Here a query is compiled once
+into a function that takes a :class:`StartDocTable` (the documents, stored
+column by column in NumPy arrays) and returns a boolean mask. Operators and
+columns that cannot be handled this way are matched by mongoquery, one
+document at a time, so the results are always the same as mongoquery's.
+"""
+import numbers
+
+from mongoquery import Query
+import numpy
+
+# The largest integer a float64 represents exactly
+_MAX_EXACT_INT = 2**53
+
+# Value of a field in a document that lacks that field
+_MISSING = object()
+# Value of a field whose path goes through a list or a scalar: mongoquery has
+# special rules for those, so they are left to it.
+_UNSUPPORTED = object()
+
+
+class Column:
+    """
+    The values of one field, in every document of a StartDocTable.
+
+    Attributes
+    ----------
+    kind : {'number', 'string', 'other', 'unsupported'}
+        'number' or 'string' if every present value is one; 'unsupported' if
+        the path to the field is not through dicts alone in some document;
+        otherwise (mixed types, None, bools, lists, dicts...) 'other'.
+    present : numpy.ndarray or None
+        Boolean mask: which documents have this field. None if kind is
+        'unsupported'.
+    values : numpy.ndarray or None
+        Values, with arbitrary fill where the field is missing. None unless
+        kind is 'number' or 'string'.
+    """
+    def __init__(self, raw_values):
+        self.kind = 'unsupported'
+        self.present = None
+        self.values = None
+        if any(value is _UNSUPPORTED for value in raw_values):
+            return
+        self.present = numpy.array([value is not _MISSING
+                                    for value in raw_values], dtype=bool)
+        present_values = [value for value in raw_values
+                          if value is not _MISSING]
+        self.kind = 'other'
+        if all(_is_number(value) for value in present_values):
+            ints = [value for value in present_values
+                    if isinstance(value, numbers.Integral)]
+            if len(ints) == len(present_values):
+                try:
+                    self.values = numpy.array(
+                        [0 if value is _MISSING else value
+                         for value in raw_values], dtype=numpy.int64)
+                except OverflowError:
+                    return
+            elif all(abs(value) <= _MAX_EXACT_INT for value in ints):
+                self.values = numpy.array(
+                    [0 if value is _MISSING else value
+                     for value in raw_values], dtype=numpy.float64)
+            else:
+                return
+            self.kind = 'number'
+        elif all(isinstance(value, str) for value in present_values):
+            self.values = numpy.array(
+                ['' if value is _MISSING else value for value in raw_values],
+                dtype=str)
+            self.kind = 'string'
+
+    def accepts(self, value):
+        "Whether value can be compared with this column's values, vectorized"
+        if self.kind == 'number':
+            return _is_number(value)
+        elif self.kind == 'string':
+            return isinstance(value, str)
+        return False
+
+    def subset(self, mask):
+        "Return a Column of the values where mask is True."
+        column = Column.__new__(Column)
+        column.kind = self.kind
+        column.present = None if self.present is None else self.present[mask]
+        column.values = None if self.values is None else self.values[mask]
+        return column
+
+
+class StartDocTable:
+    """
+    A collection of RunStart documents, to be searched with CompiledQuery.
+
+    Columns are extracted from the documents when a query first needs them,
+    and are then reused.
+
+    Parameters
+    ----------
+    docs : list
+        RunStart documents
+    """
+    def __init__(self, docs):
+        self.docs = list(docs)
+        self._columns = {}
+
+    def __len__(self):
+        return len(self.docs)
+
+    def column(self, field):
+        """
+        Return the Column for field, which may be a dotted path like 'a.b'.
+        """
+        try:
+            return self._columns[field]
+        except KeyError:
+            column = Column([_get_field(doc, field) for doc in self.docs])
+            self._columns[field] = column
+            return column
+
+    def subset(self, mask):
+        """
+        Return a StartDocTable of the documents where mask is True.
+
+        The columns extracted so far are sliced, not extracted again.
+        """
+        docs = self.docs
+        table = StartDocTable(
+            docs[i] for i in numpy.flatnonzero(mask).tolist())
+        table._columns = {field: column.subset(mask)
+                          for field, column in self._columns.items()}
+        return table
+
+
+class CompiledQuery:
+    """
+    A Mongo-style query, compiled for evaluation over a StartDocTable.
+
+    Parameters
+    ----------
+    query : dict
+        Mongo-style query, as accepted by mongoquery
+    """
+    def __init__(self, query):
+        self.query = query
+        self._mongo_query = Query(query)
+        self._evaluate = _compile_query(query)
+
+    def match(self, doc):
+        """
+        Whether one document matches.
+        """
+        return self._mongo_query.match(doc)
+
+    def mask(self, table):
+        """
+        Return a boolean array: which documents in the table match.
+        """
+        try:
+            return self._evaluate(table)
+        except Exception:
+            # Unlike mongoquery, which stops at the first clause that does not
+            # match, this evaluates every clause on every document, and
+            # mongoquery can fail on some of them. Start again its way.
+            return _fallback(self.query)(table)
+
+
+def _is_number(value):
+    return (isinstance(value, numbers.Real)
+            and not isinstance(value, bool))
+
+
+def _get_field(doc, field):
+    value = doc
+    for part in field.split('.'):
+        if not isinstance(value, dict):
+            return _UNSUPPORTED
+        try:
+            value = value[part]
+        except KeyError:
+            return _MISSING
+    return value
+
+
+def _fallback(query):
+    "Match with mongoquery, one document at a time."
+    mongo_query = Query(query)
+
+    def evaluate(table):
+        return numpy.fromiter((mongo_query.match(doc) for doc in table.docs),
+                              dtype=bool, count=len(table))
+    return evaluate
+
+
+def _compile_query(query):
+    clauses = []
+    for key, value in query.items():
+        if key in ('$and', '$or', '$nor'):
+            clauses.append(_compile_logical(key, value))
+        elif key.startswith('$'):
+            clauses.append(_fallback({key: value}))
+        else:
+            clauses.append(_compile_field(key, value))
+
+    def evaluate(table):
+        mask = numpy.ones(len(table), dtype=bool)
+        for clause in clauses:
+            mask &= clause(table)
+        return mask
+    return evaluate
+
+
+def _compile_logical(operator, subqueries):
+    if not isinstance(subqueries, list) or not subqueries:
+        return _fallback({operator: subqueries})
+    compiled = [_compile_query(subquery) for subquery in subqueries]
+
+    def evaluate(table):
+        masks = [evaluate_subquery(table) for evaluate_subquery in compiled]
+        if operator == '$and':
+            return numpy.logical_and.reduce(masks)
+        any_match = numpy.logical_or.reduce(masks)
+        return any_match if operator == '$or' else ~any_match
+    return evaluate
+
+
+def _compile_field(field, condition):
+    fallback = _fallback({field: condition})
+    if not isinstance(condition, dict):
+        operators = {'$eq': condition}
+    elif not condition or not all(key.startswith('$') for key in condition):
+        # Equality with a whole document
+        return fallback
+    else:
+        operators = condition
+    compiled = []
+    for operator, operand in operators.items():
+        function = _OPERATORS.get(operator)
+        if function is None:
+            return fallback
+        compiled.append((function, operand))
+
+    def evaluate(table):
+        column = table.column(field)
+        mask = numpy.ones(len(table), dtype=bool)
+        for function, operand in compiled:
+            result = function(column, operand)
+            if result is None:
+                # This column or operand cannot be handled here.
+                return fallback(table)
+            mask &= result
+        return mask
+    return evaluate
+
+
+def _comparison(ufunc):
+    def compare(column, value):
+        if not column.accepts(value):
+            return None
+        return column.present & ufunc(column.values, value)
+    return compare
+
+
+def _ne(column, value):
+    equal = _OPERATORS['$eq'](column, value)
+    return None if equal is None else ~equal
+
+
+def _in(column, values):
+    if not isinstance(values, (list, tuple)):
+        return None
+    if not all(column.accepts(value) for value in values):
+        return None
+    return column.present & numpy.isin(column.values, list(values))
+
+
+def _nin(column, values):
+    included = _in(column, values)
+    return None if included is None else ~included
+
+
+def _exists(column, value):
+    if column.kind == 'unsupported':
+        return None
+    return column.present if value else ~column.present
+
+
+_OPERATORS = {
+    '$eq': _comparison(numpy.equal),
+    '$ne': _ne,
+    '$gt': _comparison(numpy.greater),
+    '$gte': _comparison(numpy.greater_equal),
+    '$lt': _comparison(numpy.less),
+    '$lte': _comparison(numpy.less_equal),
+    '$in': _in,
+    '$nin': _nin,
+    '$exists': _exists,
+}
@@ -0,0 +1,175 @@
+"""
+An intake server that can also stream whole Runs to RemoteBlueskyRun.
+
+The standard intake server sends a BlueskyRun one partition at a time, in
+response to one request per partition. This server adds an endpoint,
+``/v1/bluesky/canonical``, that sends all of a Run's documents in response to
+one request, as a sequence of msgpack-encoded ``(name, doc)`` pairs in the
+chunked body of the response. Everything else is served as usual.
+
+Start it like the standard server::
+
+    python -m intake_bluesky.server path/to/catalog.yml
+
+Pass ``--compression-level zstd=9`` (for example) to trade CPU time for
+bandwidth when partitions are sent compressed.
+"""
+import argparse
+import itertools
+import logging
+import msgpack
+import msgpack_numpy
+import sys
+import threading
+import weakref
+
+from intake.cli.server.server import IntakeServer
+from intake.compat import unpack_kwargs
+import tornado.ioloop
+import tornado.web
+
+from .core import STREAMING_ENDPOINT, _register_compressors
+
+logger = logging.getLogger('intake')
+
+
+class BlueskyIntakeServer(IntakeServer):
+    """
+    An IntakeServer that also serves the endpoint used by RemoteBlueskyRun
+    to stream whole Runs.
+    """
+    def get_handlers(self):
+        return super().get_handlers() + [
+            (STREAMING_ENDPOINT, ServerCanonicalHandler,
+             dict(cache=self._cache, auth=self._auth)),
+        ]
+
+
+class ServerCanonicalHandler(tornado.web.RequestHandler):
+    """
+    Stream every document in a Run that a client has already opened.
+
+    The request body is a msgpack-encoded dict with the keys 'source_id' and,
+    optionally, 'raw' (if true, send the documents unfilled).
+    """
+    # Number of documents packed per write to the client
+    BATCH_SIZE = 100
+    # A lock for each Filler that runs being streamed use. Fillers are not
+    # thread-safe, and all the runs of a Catalog share the Catalog's Filler,
+    # so concurrent requests for the same run, or for runs of the same
+    # Catalog, take turns reading their next batch.
+    _filler_locks = {}  # id(filler) -> lock, while the filler exists
+    _filler_locks_lock = threading.Lock()
+
+    def initialize(self, cache, auth):
+        self.cache = cache
+        self.auth = auth
+
+    async def post(self):
+        if not self.auth.allow_connect(self.request.headers):
+            msg = 'Access forbidden'
+            raise tornado.web.HTTPError(status_code=403, log_message=msg,
+                                        reason=msg)
+        request = msgpack.unpackb(self.request.body, **unpack_kwargs)
+        source_id = request['source_id']
+        try:
+            run = self.cache.get(source_id)
+        except KeyError:
+            msg = 'No open source with source_id %r' % source_id
+            raise tornado.web.HTTPError(status_code=400, log_message=msg,
+                                        reason=msg)
+        if request.get('raw', False):
+            documents = run.canonical_unfilled()
+        else:
+            documents = run.canonical()
+        lock = self._filler_lock(run)
+        self.set_header('Content-Type', 'application/x-msgpack')
+        loop = tornado.ioloop.IOLoop.current()
+        while True:
+            # Read and pack the documents off the event loop, so that other
+            # clients are served meanwhile.
+            chunk = await loop.run_in_executor(None, self._pack_batch,
+                                               documents, lock)
+            if not chunk:
+                break
+            self.write(chunk)
+            # Wait for the client to take it: this applies back pressure.
+            await self.flush()
+            self.cache.touch(source_id)  # keep source alive
+        self.finish()
+
+    @classmethod
+    def _filler_lock(cls, run):
+        # Fillers are not hashable, so they are known by id.
+        filler = getattr(run, 'filler', run)
+        with cls._filler_locks_lock:
+            try:
+                return cls._filler_locks[id(filler)]
+            except KeyError:
+                lock = cls._filler_locks[id(filler)] = threading.Lock()
+                weakref.finalize(filler, cls._filler_locks.pop, id(filler),
+                                 None)
+                return lock
+
+    def _pack_batch(self, documents, lock):
+        packer = msgpack.Packer(default=msgpack_numpy.encode,
+                                use_bin_type=True)
+        with lock:
+            return b''.join(packer.pack(item) for item in
+                            itertools.islice(documents, self.BATCH_SIZE))
+
+
+def main(argv=None):
+    """
+    Start a BlueskyIntakeServer, given the port and catalog files as for
+    ``python -m intake.cli.server``.
+    """
+    from intake import open_catalog
+
+    parser = argparse.ArgumentParser(
+        description='Intake Catalog Server with streaming of Bluesky Runs')
+    parser.add_argument('-p', '--port', type=int, default=None,
+                        help='port number for server to listen on')
+    parser.add_argument('catalog_args', metavar='FILE', type=str, nargs='+',
+                        help='Name of catalog YAML file')
+    parser.add_argument('--flatten', dest='flatten', action='store_true')
+    parser.add_argument('--no-flatten', dest='flatten', action='store_false')
+    parser.set_defaults(flatten=True)
+    parser.add_argument('--compression-level', metavar='CODEC=LEVEL',
+                        action='append', default=[],
+                        help='compression level of a codec (zstd, lz4 or '
+                             'zlib) used to send partitions; may be repeated')
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    levels = {}
+    for item in args.compression_level:
+        codec, _, level = item.partition('=')
+        try:
+            levels[codec] = int(level)
+        except ValueError:
+            parser.error(f"Expected CODEC=LEVEL, not {item!r}")
+    try:
+        _register_compressors(levels)
+    except ValueError as err:
+        parser.error(str(err))
+
+    from intake.config import conf
+
+    port = conf['port'] if args.port is None else args.port
+    if len(args.catalog_args) == 1:
+        catalog = open_catalog(args.catalog_args[0])
+    else:
+        catalog = open_catalog(args.catalog_args, flatten=args.flatten)
+    logger.info('Listening on port %d' % port)
+
+    server = BlueskyIntakeServer(catalog)
+    app = server.make_app()
+    server.start_periodic_functions(close_idle_after=3600.0)
+    app.listen(port)
+    try:
+        tornado.ioloop.IOLoop.current().start()
+    except KeyboardInterrupt:
+        logger.critical("Exiting")
+
+
+if __name__ == "__main__":
+    main()
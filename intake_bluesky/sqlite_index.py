@@ -0,0 +1,293 @@
+"""
+A persistent index of the runs in a directory of files, kept in SQLite.
+
+A Catalog backed by files reads the RunStart document of every file when it
+is first loaded. With a SQLiteIndex, the documents read by one process are
+kept, with the size and mtime of their files, for the next: on startup the
+Catalog only stats the files, and reads only those that are new or have
+changed. Searches on a few summary fields of the RunStart documents are
+answered by SQL.
+"""
+import json
+import math
+import numbers
+import sqlite3
+import threading
+
+# Summary fields of RunStart documents, stored in columns of their own so that
+# searches on them can be answered by SQL, and the type a value must have to
+# be stored there
+SUMMARY_FIELDS = {'uid': 'string',
+                  'time': 'number',
+                  'scan_id': 'number',
+                  'plan_name': 'string'}
+
+# SQL for the operators that can be translated, given a column and a value
+_OPERATORS = {
+    '$eq': '{0} = ?',
+    '$gt': '{0} > ?',
+    '$gte': '{0} >= ?',
+    '$lt': '{0} < ?',
+    '$lte': '{0} <= ?',
+    # Like mongoquery, these match documents that lack the field.
+    '$ne': '({0} IS NULL OR {0} != ?)',
+}
+_MAX_INTEGER = 2**63 - 1
+
+
+def _kind(value):
+    if isinstance(value, str):
+        return 'string'
+    if isinstance(value, numbers.Real) and not isinstance(value, bool):
+        if isinstance(value, numbers.Integral):
+            # SQLite integers are 64-bit.
+            return 'number' if abs(value) <= _MAX_INTEGER else None
+        # SQLite stores NaN as NULL.
+        return None if math.isnan(value) else 'number'
+    return None
+
+
+def _to_sql(value):
+    "Convert a value of a known kind (such as a numpy scalar) for sqlite3."
+    if isinstance(value, str):
+        return str(value)
+    if isinstance(value, numbers.Integral):
+        return int(value)
+    return float(value)
+
+
+class SQLiteIndex:
+    """
+    A table of files and the runs in them, in a SQLite database.
+
+    Several Catalogs, and several processes, may share one database.
+
+    Parameters
+    ----------
+    path : str
+        Path of the database file. It is created if it does not exist.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+        # The summary columns have no declared type, so that SQLite stores
+        # integers as integers and floats as floats, and compares them as
+        # Python does.
+        summary_columns = ''.join(f', {field}' for field in SUMMARY_FIELDS)
+        with self._lock, self._connect() as connection:
+            connection.execute(
+                f"CREATE TABLE IF NOT EXISTS runs "
+                f"(path TEXT PRIMARY KEY, mtime REAL, size INTEGER, "
+                f"start TEXT, stop TEXT, irregular INTEGER"
+                f"{summary_columns})")
+            for field in SUMMARY_FIELDS:
+                connection.execute(
+                    f"CREATE INDEX IF NOT EXISTS runs_{field} "
+                    f"ON runs ({field})")
+            # The size and mtime of every file, to reconcile with the file
+            # system without a query per file
+            self._stats = {
+                path: (mtime, size) for path, mtime, size
+                in connection.execute(
+                    "SELECT path, mtime, size FROM runs "
+                    "WHERE start IS NOT NULL")}
+
+    def _connect(self):
+        "Return the connection, opening it if it is closed. Hold the lock."
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path,
+                                               check_same_thread=False)
+        return self._connection
+
+    def is_current(self, path, mtime, size):
+        """
+        Whether the database has the run in this file, as it is now.
+        """
+        return self._stats.get(path) == (mtime, size)
+
+    def get(self, paths):
+        """
+        Return the RunStart and RunStop documents in some files.
+
+        Parameters
+        ----------
+        paths : list
+
+        Returns
+        -------
+        docs : dict
+            Maps each path to (run_start_doc, run_stop_doc), with run_stop_doc
+            None if it was not known
+        """
+        docs = {}
+        paths = list(paths)
+        with self._lock:
+            # Stay under SQLite's limit on the number of parameters.
+            for i in range(0, len(paths), 500):
+                chunk = paths[i:i + 500]
+                placeholders = ', '.join('?' * len(chunk))
+                for path, start, stop in self._connect().execute(
+                        f"SELECT path, start, stop FROM runs "
+                        f"WHERE path IN ({placeholders})", chunk):
+                    docs[path] = (json.loads(start),
+                                  None if stop is None else json.loads(stop))
+        return docs
+
+    def put(self, rows):
+        """
+        Add or replace files.
+
+        Parameters
+        ----------
+        rows : list
+            (path, mtime, size, run_start_doc, run_stop_doc) for each file,
+            with run_stop_doc None if it is not known
+        """
+        records = []
+        current = {}
+        for path, mtime, size, start, stop in rows:
+            summary = [start.get(field) for field in SUMMARY_FIELDS]
+            irregular = any(
+                value is not None and _kind(value) != kind
+                for value, kind in zip(summary, SUMMARY_FIELDS.values()))
+            summary = [_to_sql(value) if _kind(value) == kind else None
+                       for value, kind in zip(summary, SUMMARY_FIELDS.values())]
+            try:
+                start_json = json.dumps(start)
+                stop_json = None if stop is None else json.dumps(stop)
+            except (TypeError, ValueError):
+                # This holds values that JSON cannot, such as arrays. Record
+                # the file as irregular, so that searches fall back on
+                # mongoquery, but do not cache it: it is read every time.
+                start_json = stop_json = None
+                irregular = True
+            else:
+                current[path] = (mtime, size)
+            records.append((path, mtime, size, start_json, stop_json,
+                            irregular, *summary))
+        placeholders = ', '.join('?' * (6 + len(SUMMARY_FIELDS)))
+        with self._lock, self._connect() as connection:
+            connection.executemany(
+                f"INSERT OR REPLACE INTO runs VALUES ({placeholders})",
+                records)
+        for path, _, _, _, _ in rows:
+            self._stats.pop(path, None)
+        self._stats.update(current)
+
+    def remove(self, paths):
+        "Remove files."
+        with self._lock, self._connect() as connection:
+            connection.executemany(
+                "DELETE FROM runs WHERE path = ?",
+                [(path,) for path in paths])
+        for path in paths:
+            self._stats.pop(path, None)
+
+    def paths(self):
+        "Return the paths of all the files."
+        with self._lock:
+            return [path for path, in self._connect().execute(
+                "SELECT path FROM runs")]
+
+    def search(self, query):
+        """
+        Return the uids of the runs that match a Mongo-style query.
+
+        Parameters
+        ----------
+        query : dict
+
+        Returns
+        -------
+        uids : set or None
+            None if the query cannot be answered by SQL (with exactly the
+            results that mongoquery would give), because it uses fields or
+            operators that are not supported, or some RunStart documents have
+            values of unexpected types in the summary fields.
+        """
+        translated = _translate_query(query)
+        if translated is None:
+            return None
+        where, parameters = translated
+        with self._lock:
+            connection = self._connect()
+            if connection.execute(
+                    "SELECT 1 FROM runs WHERE irregular LIMIT 1").fetchone():
+                return None
+            return {uid for uid, in connection.execute(
+                f"SELECT uid FROM runs WHERE {where}", parameters)}
+
+    def close(self):
+        """
+        Close the connection to the database. It is opened again if the index
+        is used again.
+        """
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def _translate_query(query):
+    "Return (where clause, parameters) or None."
+    if not isinstance(query, dict):
+        return None
+    clauses = []
+    parameters = []
+    for key, value in query.items():
+        if key in ('$and', '$or'):
+            if not isinstance(value, list) or not value:
+                return None
+            translated = [_translate_query(subquery) for subquery in value]
+            if any(item is None for item in translated):
+                return None
+            joiner = ' AND ' if key == '$and' else ' OR '
+            clauses.append(
+                '(' + joiner.join(where for where, _ in translated) + ')')
+            for _, subparameters in translated:
+                parameters.extend(subparameters)
+        elif key in SUMMARY_FIELDS:
+            translated = _translate_condition(key, value)
+            if translated is None:
+                return None
+            clauses.append(translated[0])
+            parameters.extend(translated[1])
+        else:
+            return None
+    if not clauses:
+        return '1', []
+    return ' AND '.join(clauses), parameters
+
+
+def _translate_condition(field, condition):
+    kind = SUMMARY_FIELDS[field]
+    if not isinstance(condition, dict):
+        condition = {'$eq': condition}
+    elif not condition:
+        return None
+    clauses = []
+    parameters = []
+    for operator, operand in condition.items():
+        if operator in _OPERATORS:
+            if _kind(operand) != kind:
+                return None
+            clauses.append(_OPERATORS[operator].format(field))
+            parameters.append(_to_sql(operand))
+        elif operator in ('$in', '$nin'):
+            if not isinstance(operand, list) or not all(
+                    _kind(item) == kind for item in operand):
+                return None
+            placeholders = ', '.join('?' * len(operand))
+            if operator == '$in':
+                clauses.append(f'{field} IN ({placeholders})')
+            else:
+                clauses.append(
+                    f'({field} IS NULL OR {field} NOT IN ({placeholders}))')
+            parameters.extend(_to_sql(item) for item in operand)
+        elif operator == '$exists' and isinstance(operand, bool):
+            clauses.append(
+                f'{field} IS {"NOT " if operand else ""}NULL')
+        else:
+            return None
+    return '(' + ' AND '.join(clauses) + ')', parameters
@@ -1,8 +1,10 @@
 import event_model
 import itertools
 from intake.catalog.utils import RemoteCatalogError
+import intake_bluesky.file_index
 import numpy
 import ophyd.sim
+import os
 import pytest
 
 
@@ -185,3 +187,108 @@ def test_include_and_exclude(bundle):
     assert set(entry(include=['motor']).read().variables) == expected
     expected = set(['time', 'uid', 'seq_num', 'motor:motor_velocity'])
     assert set(entry(include=['motor:motor_velocity']).read().variables) == expected
+
+
+@pytest.fixture
+def file_format():
+    """
+    The format of the files behind the Catalog, for the tests that apply only
+    to Catalogs backed by files.
+
+    Test modules for those Catalogs override this with a namespace of the
+    format's module, its Catalog class, and the suitcase Serializer that
+    writes it.
+    """
+    pytest.skip("This Catalog is not backed by files.")
+
+
+def test_search_reads_no_files(file_format, tmp_path, monkeypatch):
+    uids = []
+    for scan_id in range(3):
+        run_bundle = event_model.compose_run(metadata={'scan_id': scan_id})
+        serializer = file_format.Serializer(tmp_path)
+        serializer('start', run_bundle.start_doc)
+        serializer('stop', run_bundle.compose_stop())
+        serializer.close()
+        uids.append(run_bundle.start_doc['uid'])
+    cat = file_format.Catalog(str(tmp_path / '*'))
+    # Each entry reads its own file.
+    for uid in uids:
+        assert cat[uid]().metadata['start']['uid'] == uid
+
+    def fail(*args, **kwargs):
+        raise AssertionError("search opened a file")
+
+    monkeypatch.setattr('builtins.open', fail)
+    results = cat.search({'scan_id': {'$gt': 0}})
+    assert set(results) == set(uids[1:])
+    assert list(results.search({'scan_id': 2})) == [uids[2]]
+
+
+def test_consolidate(file_format, tmp_path):
+    run_bundle = event_model.compose_run()
+    desc_bundle = run_bundle.compose_descriptor(
+        data_keys={'x': {'source': '...', 'shape': [], 'dtype': 'number'}},
+        name='primary')
+    serializer = file_format.Serializer(tmp_path)
+    serializer('start', run_bundle.start_doc)
+    serializer('descriptor', desc_bundle.descriptor_doc)
+    for i in range(20):
+        serializer('event', desc_bundle.compose_event(
+            data={'x': i}, timestamps={'x': i}, seq_num=i + 1))
+    serializer('stop', run_bundle.compose_stop())
+    serializer.close()
+    uid = run_bundle.start_doc['uid']
+    descriptor_uid = desc_bundle.descriptor_doc['uid']
+    cat = file_format.Catalog(str(tmp_path / '*'), consolidate=True)
+    plain_cat = file_format.Catalog(str(tmp_path / '*'))
+    # Search results inherit the option.
+    run = cat.search({'uid': uid})[uid]()
+    plain_run = plain_cat[uid]()
+    pages = list(run._get_event_pages(descriptor_uid))
+    assert [len(page['seq_num']) for page in pages] == [20]
+    assert len(list(plain_run._get_event_pages(descriptor_uid))) == 20
+    assert run.primary.read().equals(plain_run.primary.read())
+
+
+def test_index(file_format, example_data, tmp_path):
+    uid, docs = example_data
+    serializer = file_format.Serializer(tmp_path)
+    for name, doc in docs:
+        serializer(name, doc)
+    serializer.close()
+    filename, = serializer.artifacts['all']
+    handler_registry = {'NPY_SEQ': 'ophyd.sim.NumpySeqHandler'}
+    cat = file_format.Catalog(str(filename),
+                              handler_registry=handler_registry)
+    indexed_cat = file_format.Catalog(str(filename),
+                                      handler_registry=handler_registry,
+                                      use_index=True)
+    index_path = intake_bluesky.file_index.index_path(str(filename))
+    assert not os.path.exists(index_path)
+    run = cat[uid]()
+    indexed_run = indexed_cat.search({'uid': uid})[uid]()
+    assert os.path.exists(index_path)
+    assert ([event_model.sanitize_doc(item)
+             for item in indexed_run.canonical_unfilled()]
+            == [event_model.sanitize_doc(item)
+                for item in run.canonical_unfilled()])
+    assert indexed_run.primary.read().equals(run.primary.read())
+    assert indexed_run.baseline.read().equals(run.baseline.read())
+
+    # Pages of Events can be read starting part way through the stream.
+    reader = file_format.module.IndexedRunReader(str(filename))
+    descriptor_uid = next(doc['uid'] for doc
+                          in reader.get_event_descriptors()
+                          if doc['name'] == 'primary')
+    seq_nums = [seq_num for page in reader.get_event_pages(descriptor_uid)
+                for seq_num in page['seq_num']]
+    assert len(seq_nums) == reader.get_event_count(descriptor_uid) == 20
+    assert [seq_num for page
+            in reader.get_event_pages(descriptor_uid, skip=5, limit=3)
+            for seq_num in page['seq_num']] == seq_nums[5:8]
+
+    # The command line builds the index too.
+    os.remove(index_path)
+    file_format.module.main([str(filename)])
+    assert file_format.module.load_index(str(filename)) is not None
@@ -1,8 +1,22 @@
 import event_model
+import importlib.util
+import json
+import numpy
+import os
+import pytest
+import subprocess
+import sys
+import threading
+import time
+import types
 import xarray
+import intake_bluesky
 import intake_bluesky.core as core
 from intake_bluesky.core import documents_to_xarray
 
+# Importing intake_bluesky and listing a Catalog must not import these.
+HEAVY_MODULES = ('xarray', 'dask.array', 'dask.bag')
+
 
 def no_event_pages(descriptor_uid):
     yield from ()
@@ -76,3 +90,345 @@ def test_interlace_event_page_chunks():
         if t0:
             assert t1 > t0
         t0 = t1
+
+
+def test_import_and_list_stay_light(tmp_path):
+    run_bundle = event_model.compose_run()
+    desc_bundle = run_bundle.compose_descriptor(
+        data_keys={'x': {'source': '...', 'shape': [], 'dtype': 'number'}},
+        name='primary')
+    path = str(tmp_path / 'run.jsonl')
+    with open(path, 'w') as file:
+        for name, doc in [('start', run_bundle.start_doc),
+                          ('descriptor', desc_bundle.descriptor_doc),
+                          ('stop', run_bundle.compose_stop())]:
+            file.write(json.dumps([name, doc]) + '\n')
+
+    script = f"""
+import sys
+import intake_bluesky.core
+print(','.join(name for name in {HEAVY_MODULES!r} if name in sys.modules))
+from intake_bluesky.jsonl import BlueskyJSONLCatalog
+cat = BlueskyJSONLCatalog({path!r})
+assert len(list(cat)) == 1
+print(','.join(name for name in {HEAVY_MODULES!r} if name in sys.modules))
+"""
+    env = os.environ.copy()
+    env['PYTHONPATH'] = os.path.dirname(os.path.dirname(intake_bluesky.__file__))
+    result = subprocess.run([sys.executable, '-c', script], env=env,
+                            stdout=subprocess.PIPE, check=True)
+    on_import, on_listing = result.stdout.decode().splitlines()[-2:]
+    assert not on_import, f"Importing core imported: {on_import}"
+    assert not on_listing, f"Listing a Catalog imported: {on_listing}"
+
+
+def test_http_session_shared_per_server():
+    session = core.get_http_session('http://example.com:5000/v1/source')
+    assert session is core.get_http_session('http://example.com:5000/')
+    assert session is not core.get_http_session('http://example.com:5001/')
+
+
+def test_remote_partitions_stay_in_order():
+    # Within each window of requests in flight, later partitions finish first.
+    window = core.RemoteBlueskyRun.PARTITION_CONCURRENCY
+    npartitions = 3 * window + 1
+    fetched = []
+    finished = []
+    in_flight = []
+    lock = threading.Lock()
+
+    def fetch_partition(index):
+        i, raw = index
+        with lock:
+            fetched.append(i)
+            in_flight.append(len(fetched) - len(finished))
+        time.sleep(0.02 * (window - i % window))
+        with lock:
+            finished.append(i)
+        return [('event', {'seq_num': i, 'raw': raw})]
+
+    run = types.SimpleNamespace(
+        PARTITION_CONCURRENCY=window, npartitions=npartitions,
+        _fetch_partition=fetch_partition)
+    payloads = list(core.RemoteBlueskyRun._partitions(run, raw=True))
+    assert [payload[0][1]['seq_num'] for payload in payloads] == list(
+        range(npartitions))
+    assert all(payload[0][1]['raw'] for payload in payloads)
+    assert finished != sorted(finished)
+    assert max(in_flight) <= window
+    # Each partition was fetched once, and nothing past the last: the server
+    # reported npartitions, so no request for an empty partition is needed
+    # to find the end.
+    assert sorted(fetched) == list(range(npartitions))
+
+
+def test_canonical_spans_partitions():
+    run_bundle = event_model.compose_run()
+    desc_bundle = run_bundle.compose_descriptor(
+        data_keys={'x': {'source': '...', 'shape': [], 'dtype': 'number'}},
+        name='primary')
+    docs = [('start', run_bundle.start_doc),
+            ('descriptor', desc_bundle.descriptor_doc)]
+    num_events = 2 * core.BlueskyRun.PARTITION_SIZE + 50
+    for i in range(num_events):
+        docs.append(('event', desc_bundle.compose_event(
+            data={'x': i}, timestamps={'x': i}, seq_num=i + 1, time=i)))
+    docs.append(('stop', run_bundle.compose_stop()))
+
+    def gen():
+        yield from docs
+
+    run = core.BlueskyRunFromGenerator(gen, (), {})
+    assert run.npartitions == 3
+    actual = list(run.canonical())
+    assert [name for name, doc in actual] == [name for name, doc in docs]
+    assert ([doc['seq_num'] for name, doc in actual if name == 'event'] ==
+            list(range(1, num_events + 1)))
+
+
+def test_lazy_run_from_generator():
+    run_bundle = event_model.compose_run()
+    docs = [('start', run_bundle.start_doc)]
+    for stream_name in ('primary', 'baseline'):
+        desc_bundle = run_bundle.compose_descriptor(
+            data_keys={'x': {'source': '...', 'shape': [], 'dtype': 'number'}},
+            name=stream_name)
+        docs.append(('descriptor', desc_bundle.descriptor_doc))
+        for i in range(3):
+            docs.append(('event', desc_bundle.compose_event(
+                data={'x': i}, timestamps={'x': i}, seq_num=i + 1, time=i)))
+    docs.append(('stop', run_bundle.compose_stop()))
+    passes = []
+
+    def gen():
+        passes.append(None)
+        yield from docs
+
+    run = core.BlueskyRunFromGenerator(gen, (), {}, lazy=True)
+    # Opening the run goes through the documents once, keeping no Events.
+    assert len(passes) == 1
+    assert list(run) == ['primary', 'baseline']
+    assert run.metadata['stop'] == docs[-1][1]
+    assert run._get_event_count(docs[1][1]['uid']) == 3
+    # Reading a stream goes through them again, for that stream's Events.
+    assert list(run.primary.read()['x'].values) == [0, 1, 2]
+    assert len(passes) == 2
+    assert list(run.primary.read()['x'].values) == [0, 1, 2]
+    assert len(passes) == 2
+    eager_run = core.BlueskyRunFromGenerator(gen, (), {})
+    assert list(run.canonical()) == list(eager_run.canonical())
+
+
+@pytest.mark.parametrize('lazy', [False, True], ids=['eager', 'lazy'])
+def test_run_without_run_start(lazy):
+    def gen(filename):
+        yield 'stop', {'uid': 'abc', 'time': 0, 'run_start': 'def'}
+
+    with pytest.raises(ValueError, match=r"gen\('runs/a\.jsonl'\)"):
+        run = core.BlueskyRunFromGenerator(gen, ('runs/a.jsonl',), {},
+                                           lazy=lazy)
+        run.metadata
+
+
+def test_document_cache_consolidates_event_pages():
+    run_bundle = event_model.compose_run()
+    data_keys = {key: {'source': '...', 'shape': [], 'dtype': 'number'}
+                 for key in ('x', 'image', 'label')}
+    desc_bundle = run_bundle.compose_descriptor(data_keys=data_keys,
+                                                name='primary')
+    docs = [('start', run_bundle.start_doc),
+            ('descriptor', desc_bundle.descriptor_doc)]
+    for i in range(100):
+        data = {'x': i, 'image': numpy.full((2, 3), i), 'label': str(i)}
+        docs.append(('event', desc_bundle.compose_event(
+            data=data, timestamps={key: i for key in data}, seq_num=i + 1)))
+    # This does not fit in the integer column, so it starts a new page.
+    data = {'x': 0.5, 'image': numpy.zeros((2, 3)), 'label': 'last'}
+    docs.append(('event', desc_bundle.compose_event(
+        data=data, timestamps={key: 100 for key in data}, seq_num=101)))
+    docs.append(('stop', run_bundle.compose_stop()))
+
+    cache = core.DocumentCache(consolidate=True)
+    for name, doc in docs:
+        cache(name, doc)
+    descriptor_uid = desc_bundle.descriptor_doc['uid']
+    pages = cache.get_event_pages(descriptor_uid)
+    assert [len(page['seq_num']) for page in pages] == [100, 1]
+    assert pages[0]['data']['image'].shape == (100, 2, 3)
+    assert pages[0]['data']['label'] == [str(i) for i in range(100)]
+    expected = [doc for name, doc in docs if name == 'event']
+    actual = list(core.flatten_event_page_gen(pages))
+    assert [event['uid'] for event in actual] == [
+        event['uid'] for event in expected]
+    for event, expected_event in zip(actual, expected):
+        for key, value in expected_event['data'].items():
+            numpy.testing.assert_array_equal(event['data'][key], value)
+
+    def gen():
+        yield from docs
+
+    run = core.BlueskyRunFromGenerator(gen, (), {}, consolidate=True)
+    eager_run = core.BlueskyRunFromGenerator(gen, (), {})
+    assert run.primary.read().equals(eager_run.primary.read())
+
+
+def test_document_cache_skip_and_limit():
+    run_bundle = event_model.compose_run()
+    desc_bundle = run_bundle.compose_descriptor(
+        data_keys={'x': {'source': '...', 'shape': [], 'dtype': 'number'}},
+        name='primary')
+    docs = [('start', run_bundle.start_doc),
+            ('descriptor', desc_bundle.descriptor_doc)]
+    seq_num = 1
+    for page_size in (3, 1, 0, 5, 1, 1, 4):
+        events = [desc_bundle.compose_event(
+            data={'x': seq_num + i}, timestamps={'x': 0},
+            seq_num=seq_num + i) for i in range(page_size)]
+        if page_size:
+            docs.append(('event_page', event_model.pack_event_page(*events)))
+        seq_num += page_size
+    descriptor_uid = desc_bundle.descriptor_doc['uid']
+    for consolidate in (False, True):
+        cache = core.DocumentCache(consolidate=consolidate)
+        for name, doc in docs:
+            cache(name, doc)
+        assert cache.get_event_count(descriptor_uid) == seq_num - 1
+        all_seq_nums = list(range(1, seq_num))
+        for skip in range(seq_num + 1):
+            for limit in (None, 0, 1, 2, 7, 100):
+                pages = cache.get_event_pages(descriptor_uid, skip, limit)
+                actual = [event['seq_num'] for event
+                          in core.flatten_event_page_gen(pages)]
+                stop = None if limit is None else skip + limit
+                assert actual == all_seq_nums[skip:stop]
+                for page in pages:
+                    assert list(page['data']['x']) == list(page['seq_num'])
+
+
+@pytest.mark.parametrize('times_go_back', [False, True])
+def test_partitions_skip_to_their_events(times_go_back):
+    run_bundle = event_model.compose_run()
+    docs = [('start', run_bundle.start_doc)]
+    desc_bundles = []
+    for stream_name in ('primary', 'baseline', 'monitor'):
+        desc_bundle = run_bundle.compose_descriptor(
+            data_keys={'x': {'source': '...', 'shape': [], 'dtype': 'number'}},
+            name=stream_name)
+        docs.append(('descriptor', desc_bundle.descriptor_doc))
+        desc_bundles.append(desc_bundle)
+    num_events = 3 * core.BlueskyRun.PARTITION_SIZE
+    for i in range(num_events):
+        desc_bundle = desc_bundles[i % 7 % 3]
+        # Some times are tied.
+        time = i // 2
+        if times_go_back and i % 50 == 0:
+            time -= 10
+        docs.append(('event', desc_bundle.compose_event(
+            data={'x': i}, timestamps={'x': i}, seq_num=i + 1, time=time)))
+    resource_bundle = run_bundle.compose_resource(
+        spec='TEST', root='/', resource_path='', resource_kwargs={})
+    docs.append(('resource', resource_bundle.resource_doc))
+    for i in range(10):
+        docs.append(('datum', resource_bundle.compose_datum(
+            datum_kwargs={'i': i})))
+    docs.append(('stop', run_bundle.compose_stop()))
+
+    def gen():
+        yield from docs
+
+    run = core.BlueskyRunFromGenerator(gen, (), {})
+    expected = core.BlueskyRunFromGenerator(gen, (), {})
+    expected._exact_skip_limit = False
+    assert list(run.canonical()) == list(expected.canonical())
+
+    resource_uid = resource_bundle.resource_doc['uid']
+    datum_pages = run._get_datum_pages(resource_uid, skip=3, limit=4)
+    datums = [datum for page in datum_pages
+              for datum in event_model.unpack_datum_page(page)]
+    assert [datum['datum_kwargs']['i'] for datum in datums] == [3, 4, 5, 6]
+
+
+def test_compressors_round_trip():
+    data = b'bluesky' * 1000
+    for compressor_class in core.COMPRESSORS:
+        if importlib.util.find_spec(compressor_class.module_name) is None:
+            continue
+        for compressor in (compressor_class(), compressor_class(level=9)):
+            assert compressor.decompress(compressor.compress(data)) == data
+
+
+def test_compression_levels_are_per_compressor(monkeypatch):
+    from intake.container import serializer
+
+    monkeypatch.setattr(serializer, 'compression_registry',
+                        serializer.compression_registry.copy())
+    fast = core.ZlibCompressor()
+    small = core.ZlibCompressor(level=9)
+    assert fast.level == core.ZlibCompressor.DEFAULT_LEVEL
+    assert small.level == 9
+    # Registering other levels replaces the registered codec, and leaves
+    # existing instances alone.
+    core._register_compressors({'zlib': 6})
+    assert serializer.compression_registry['zlib'].level == 6
+    assert fast.level == core.ZlibCompressor.DEFAULT_LEVEL
+    with pytest.raises(ValueError):
+        core._register_compressors({'brotli': 1})
+
+
+def test_encode_array_round_trip():
+    for array in (numpy.arange(10.),
+                  numpy.array(3, dtype='<i4'),
+                  numpy.arange(12, dtype='<i4').reshape(3, 4),
+                  numpy.array(['a', 'bc']),
+                  numpy.array([{'a': 1}, None], dtype=object)):
+        decoded = core.decode_array(core.encode_array(array))
+        assert decoded.dtype == array.dtype
+        assert decoded.shape == array.shape
+        assert decoded.tolist() == array.tolist()
+
+
+def test_partition_cache(tmp_path):
+    partition = [['event', {'data': {'x': numpy.ones(100),
+                                     'n': numpy.int32(3),
+                                     'label': 'a',
+                                     'raw': b'\x00\x01'},
+                            'seq_num': 1}]]
+    size = len(core._pack_partition(partition))
+    cache = core.PartitionCache(str(tmp_path), memory_limit=2 * size,
+                                disk_limit=2 * size)
+    for i in range(3):
+        cache.put(('url', 'uid', False, i), partition)
+    # The least recently used partition was evicted from both tiers.
+    assert cache.get(('url', 'uid', False, 0)) is None
+    assert len(list(tmp_path.glob('*.msgpack'))) == 2
+    hit = cache.get(('url', 'uid', False, 2))
+    data = hit[0][1]['data']
+    assert data['x'].dtype == numpy.float64
+    assert data['x'].tolist() == [1] * 100
+    assert data['n'] == 3 and data['n'].dtype == numpy.int32
+    assert data['n'].shape == ()
+    assert data['label'] == 'a'
+    assert data['raw'] == b'\x00\x01'
+    assert hit[0][1]['seq_num'] == 1
+    # A fresh cache on the same directory finds the partitions on disk.
+    cache = core.PartitionCache(str(tmp_path))
+    assert cache.get(('url', 'uid', False, 1)) is not None
+    cache.clear()
+    assert cache.get(('url', 'uid', False, 1)) is None
+
+
+@pytest.mark.parametrize('corrupt', [lambda blob: blob[:len(blob) // 2],
+                                     lambda blob: b'\x80\x04not msgpack',
+                                     lambda blob: b'\x01'])
+def test_partition_cache_drops_corrupt_entries(tmp_path, corrupt):
+    partition = [['event', {'data': {'x': numpy.ones(100)}, 'seq_num': 1}]]
+    key = ('url', 'uid', 100, '0.0.1', False, 0)
+    core.PartitionCache(str(tmp_path)).put(key, partition)
+    path, = tmp_path.glob('*.msgpack')
+    path.write_bytes(corrupt(path.read_bytes()))
+    cache = core.PartitionCache(str(tmp_path))
+    # A corrupt entry is a miss, and is removed so that it can be replaced.
+    assert cache.get(key) is None
+    assert not path.exists()
+    cache.put(key, partition)
+    assert cache.get(key)[0][1]['data']['x'].tolist() == [1] * 100
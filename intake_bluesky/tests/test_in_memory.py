@@ -0,0 +1,227 @@
+import event_model
+import gc
+import itertools
+from mongoquery import Query
+import numpy
+import pytest
+import tracemalloc
+
+from intake_bluesky.in_memory import BlueskyInMemoryCatalog
+from intake_bluesky.query_engine import CompiledQuery, StartDocTable
+
+
+def gen(start_doc):
+    yield 'start', start_doc
+
+
+def make_catalog(*scan_ids_and_times):
+    "Make a Catalog with a run for each (scan_id, time)."
+    cat = BlueskyInMemoryCatalog()
+    uids = []
+    for scan_id, time in scan_ids_and_times:
+        run_bundle = event_model.compose_run(metadata={'scan_id': scan_id},
+                                             time=time)
+        cat.upsert(gen, (run_bundle.start_doc,), {})
+        uids.append(run_bundle.start_doc['uid'])
+    return cat, uids
+
+
+def test_getitem_by_recency_and_scan_id():
+    # Runs are upserted out of chronological order.
+    cat, uids = make_catalog((1, 30), (2, 10), (1, 20), (3, 40))
+    most_recent_first = [uids[3], uids[0], uids[2], uids[1]]
+    assert [cat[-i].name for i in range(1, 5)] == most_recent_first
+    with pytest.raises(IndexError):
+        cat[-5]
+    # The most recent run with the given scan_id
+    assert cat[1].name == uids[0]
+    assert cat[2].name == uids[1]
+    with pytest.raises(KeyError):
+        cat[4]
+    # Upserting a run again replaces it in the indexes.
+    start_doc = dict(cat._uid_to_run_start_doc[uids[0]], time=5)
+    cat.upsert(gen, (start_doc,), {})
+    assert cat[1].name == uids[2]
+    assert cat[-4].name == uids[0]
+    assert len(cat._time_index) == 4
+
+
+def test_getitem_with_odd_scan_ids():
+    cat = BlueskyInMemoryCatalog()
+    for uid, time, scan_id in [('a', 1, [1]), ('b', 2, {'x': 1}), ('c', 3, 1),
+                               ('d', 4, None)]:
+        start_doc = {'uid': uid, 'time': time}
+        if scan_id is not None:
+            start_doc['scan_id'] = scan_id
+        cat.upsert(gen, (start_doc,), {})
+    cat.upsert(gen, ({'uid': 'e', 'time': 0},), {})
+    assert cat[1].name == 'c'
+    assert cat[-1].name == 'd'
+    assert cat[-5].name == 'e'
+    # Runs added after a lookup are sorted into the indexes.
+    cat.upsert(gen, ({'uid': 'f', 'time': 2.5, 'scan_id': 1},), {})
+    cat.upsert(gen, ({'uid': 'g', 'time': 0.5, 'scan_id': 1},), {})
+    assert cat[1].name == 'c'
+    assert [cat[-i].name for i in range(1, 8)] == list('dcfbage')
+
+
+def test_getitem_by_partial_uid():
+    cat = BlueskyInMemoryCatalog()
+    for uid in ['abc1', 'abd2', 'abd3', 'b']:
+        cat.upsert(gen, ({'uid': uid, 'time': 0},), {})
+    assert cat['abc'].name == 'abc1'
+    assert cat['b'].name == 'b'
+    with pytest.raises(KeyError):
+        cat['ac']
+    with pytest.raises(ValueError, match='abd2\nabd3'):
+        cat['abd']
+
+
+def test_search_results_share_parent_state():
+    cat, uids = make_catalog((1, 10), (2, 20), (3, 30))
+    results = cat.search({'scan_id': {'$gt': 1}})
+    assert list(results) == uids[1:]
+    # The columns extracted for the first search are reused by the next.
+    assert 'scan_id' in results._start_doc_table._columns
+    assert list(results.search({'scan_id': {'$lt': 3}})) == [uids[1]]
+    # Search results pick up runs that the searched Catalog gains.
+    run_bundle = event_model.compose_run(metadata={'scan_id': 4}, time=40)
+    cat.upsert(gen, (run_bundle.start_doc,), {})
+    results.force_reload()
+    assert list(results) == uids[1:] + [run_bundle.start_doc['uid']]
+
+
+def test_consolidate():
+    run_bundle = event_model.compose_run()
+    desc_bundle = run_bundle.compose_descriptor(
+        data_keys={'x': {'source': '...', 'shape': [], 'dtype': 'number'}},
+        name='primary')
+    docs = [('start', run_bundle.start_doc),
+            ('descriptor', desc_bundle.descriptor_doc)]
+    for i in range(20):
+        docs.append(('event', desc_bundle.compose_event(
+            data={'x': i}, timestamps={'x': i}, seq_num=i + 1)))
+    docs.append(('stop', run_bundle.compose_stop()))
+    uid = run_bundle.start_doc['uid']
+    descriptor_uid = desc_bundle.descriptor_doc['uid']
+    runs = {}
+    for lazy in (False, True):
+        cat = BlueskyInMemoryCatalog(consolidate=True, lazy=lazy)
+        cat.upsert(iter, (docs,), {})
+        # Search results inherit the option.
+        runs[lazy] = run = cat.search({'uid': uid})[uid]()
+        pages = list(run._get_event_pages(descriptor_uid))
+        assert [len(page['seq_num']) for page in pages] == [20]
+    plain_cat = BlueskyInMemoryCatalog()
+    plain_cat.upsert(iter, (docs,), {})
+    plain_run = plain_cat[uid]()
+    assert len(list(plain_run._get_event_pages(descriptor_uid))) == 20
+    for run in runs.values():
+        assert run.primary.read().equals(plain_run.primary.read())
+
+
+def test_entries_are_made_when_looked_up(monkeypatch):
+    made = []
+    make_entry = BlueskyInMemoryCatalog._make_entry
+
+    def recording_make_entry(self, run_start_doc, *args):
+        made.append(run_start_doc['uid'])
+        return make_entry(self, run_start_doc, *args)
+
+    monkeypatch.setattr(BlueskyInMemoryCatalog, '_make_entry',
+                        recording_make_entry)
+    cat, uids = make_catalog((1, 10), (2, 20), (3, 30))
+    results = cat.search({'scan_id': {'$gt': 1}})
+    assert list(results) == uids[1:]
+    assert uids[2] in results and uids[0] not in results
+    assert made == []
+    # The results share the searched Catalog's documents and generators.
+    for uid in uids[1:]:
+        assert (results._uid_to_run_start_doc[uid]
+                is cat._uid_to_run_start_doc[uid])
+        assert results._uid_to_gen[uid] is cat._uid_to_gen[uid]
+    assert results[-1] is results[uids[2]]
+    assert made == [uids[2]]
+    # Replacing a run replaces its entry.
+    start_doc = dict(cat._uid_to_run_start_doc[uids[2]], purpose='test')
+    cat.upsert(gen, (start_doc,), {})
+    assert cat[uids[2]].metadata['start']['purpose'] == 'test'
+    assert made == [uids[2], uids[2]]
+
+
+DOCS = [{'scan_id': 1, 'plan_name': 'scan', 'sample': {'name': 'a'}},
+        {'scan_id': 2, 'plan_name': 'count', 'sample': {'name': 'b'}},
+        {'scan_id': 3.5, 'plan_name': 'scan'},
+        {'scan_id': None, 'sample': 3},
+        {'scan_id': True, 'plan_name': ['scan', 'count']},
+        {}]
+FIELD_CONDITIONS = [
+    1, 'scan', None, {'$gt': 1}, {'$lte': 2}, {'$ne': 'scan'}, {'$gte': 'd'},
+    {'$in': [1, 2]}, {'$nin': ['scan']}, {'$exists': False},
+    {'$regex': 'c'}, {'$gt': 1, '$lt': 3}, {'name': 'a'}]
+QUERIES = (
+    [{}]
+    + [{field: condition}
+       for field, condition in itertools.product(
+           ['scan_id', 'plan_name', 'sample.name'], FIELD_CONDITIONS)]
+    + [{'$or': [{'scan_id': 1}, {'plan_name': 'count'}]},
+       {'$nor': [{'scan_id': {'$gt': 1}}]},
+       {'$and': [{'plan_name': 'scan'}, {'scan_id': {'$lt': 2}}]},
+       {'plan_name': 'scan', 'sample.name': {'$exists': True}}])
+
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_compiled_query_matches_mongoquery(query):
+    expected = [Query(query).match(doc) for doc in DOCS]
+    table = StartDocTable(DOCS)
+    assert list(CompiledQuery(query).mask(table)) == expected
+    # Homogeneous columns take the vectorized path.
+    expected = [Query(query).match(doc) for doc in DOCS[:3]]
+    table = StartDocTable(DOCS[:3])
+    assert list(CompiledQuery(query).mask(table)) == expected
+
+
+def big_run_gen(docs):
+    """
+    Yield the documents, with each Event's x made anew into a large array on
+    each pass.
+    """
+    for name, doc in docs:
+        if name == 'event':
+            doc = dict(doc, data={'x': numpy.full(4000, doc['data']['x'],
+                                                  dtype=float)})
+        yield name, doc
+
+
+def test_lazy_catalog_keeps_less_in_memory():
+    # A run with a small stream and a large one
+    run_bundle = event_model.compose_run()
+    docs = [('start', run_bundle.start_doc)]
+    data_keys = {'x': {'source': '...', 'shape': [4000], 'dtype': 'array'}}
+    for stream_name, count in (('primary', 1), ('baseline', 250)):
+        desc_bundle = run_bundle.compose_descriptor(
+            data_keys=data_keys, name=stream_name)
+        docs.append(('descriptor', desc_bundle.descriptor_doc))
+        for i in range(count):
+            docs.append(('event', desc_bundle.compose_event(
+                data={'x': i}, timestamps={'x': i}, seq_num=i + 1, time=i)))
+    docs.append(('stop', run_bundle.compose_stop()))
+    uid = run_bundle.start_doc['uid']
+    sizes = {}
+    for lazy in (False, True):
+        cat = BlueskyInMemoryCatalog(lazy=lazy)
+        cat.upsert(big_run_gen, (docs,), {})
+        # Import whatever reading imports on first use, untraced.
+        cat[uid]().primary.read()
+        tracemalloc.start()
+        try:
+            run = cat[uid]()
+            assert list(run.primary.read()['x'].shape) == [1, 4000]
+            gc.collect()
+            sizes[lazy] = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        del run
+    # The 250 Events of the baseline stream take 8 MB.
+    assert sizes[False] > 8_000_000
+    assert sizes[True] < 2_000_000
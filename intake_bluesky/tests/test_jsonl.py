@@ -1,5 +1,9 @@
+import intake_bluesky.file_index
 import intake_bluesky.jsonl # noqa
+import event_model
 import intake
+import json
+import numpy
 from suitcase.jsonl import Serializer
 import os
 import pytest
@@ -61,3 +65,241 @@ sources:
     return types.SimpleNamespace(cat=cat,
                                  uid=uid,
                                  docs=docs)
+
+
+@pytest.fixture
+def file_format():
+    return types.SimpleNamespace(module=intake_bluesky.jsonl,
+                                 Catalog=intake_bluesky.jsonl.BlueskyJSONLCatalog,
+                                 Serializer=Serializer)
+
+
+def test_decode():
+    line = json.dumps(['event_page', {
+        'data': {'x': [1.5, 2.5], 'image': [[[1, 2]], [[3, 4]]],
+                 'ragged': [[1], [2, 3]], 'flag': [True, False],
+                 'name': ['a', 'b'], 'missing': [1, None]},
+        'timestamps': {}, 'seq_num': [1, 2]}])
+    name, doc = intake_bluesky.jsonl._decode(line)
+    data = doc['data']
+    assert isinstance(data['x'], numpy.ndarray)
+    assert data['image'].shape == (2, 1, 2)
+    for key in ('ragged', 'flag', 'name', 'missing'):
+        assert isinstance(data[key], list)
+    assert doc['seq_num'] == [1, 2]
+    # The json module writes NaN, which orjson does not read.
+    name, doc = intake_bluesky.jsonl._decode(
+        json.dumps(['event', {'data': {'x': [float('nan'), 1.0]}}]))
+    assert numpy.isnan(doc['data']['x'][0])
+
+
+def test_live_run_is_decoded_incrementally(tmp_path, monkeypatch):
+    run_bundle = event_model.compose_run()
+    desc_bundle = run_bundle.compose_descriptor(
+        name='primary',
+        data_keys={'x': {'dtype': 'number', 'shape': [], 'source': ''}})
+
+    def line(name, doc):
+        return json.dumps([name, doc]) + '\n'
+
+    def event(x):
+        return line('event', desc_bundle.compose_event(
+            data={'x': x}, timestamps={'x': time.time()}))
+
+    decoded = []
+    decode = intake_bluesky.jsonl._decode
+
+    def counting_decode(line):
+        if not line.startswith(b'["start"'):
+            decoded.append(line)
+        return decode(line)
+
+    monkeypatch.setattr(intake_bluesky.jsonl, '_decode', counting_decode)
+    filename = str(tmp_path / 'live.jsonl')
+    second_event = event(2)
+    with open(filename, 'w') as file:
+        file.write(line('start', run_bundle.start_doc))
+        file.write(line('descriptor', desc_bundle.descriptor_doc))
+        file.write(event(1))
+        # A line that is still being written
+        file.write(second_event[:20])
+        file.flush()
+        cat = intake_bluesky.jsonl.BlueskyJSONLCatalog(filename)
+        run = cat[run_bundle.start_doc['uid']]()
+        assert list(run.primary.read()['x'].values) == [1]
+        assert run.metadata['stop'] is None
+        # descriptor, event, and one try at the unfinished line
+        assert len(decoded) == 3
+        run.force_reload()
+        assert len(decoded) == 3
+
+        file.write(second_event[20:])
+        file.write(line('stop', run_bundle.compose_stop()))
+    run.force_reload()
+    assert run.metadata['stop'] is not None
+    assert list(run.primary.read()['x'].values) == [1, 2]
+    # Only the lines appended since were decoded.
+    assert len(decoded) == 5
+    # A new entry for the same file shares what has been decoded.
+    cat.force_reload()
+    run = cat[run_bundle.start_doc['uid']]()
+    assert list(run.primary.read()['x'].values) == [1, 2]
+    assert len(decoded) == 5
+
+
+def test_only_recent_files_stay_decoded(tmp_path, monkeypatch):
+    monkeypatch.setattr(intake_bluesky.jsonl.BlueskyJSONLCatalog,
+                        'TAIL_CACHE_SIZE', 2)
+    uids = []
+    for i in range(3):
+        run_bundle = event_model.compose_run()
+        with open(tmp_path / f'{i}.jsonl', 'w') as file:
+            for name, doc in [('start', run_bundle.start_doc),
+                              ('stop', run_bundle.compose_stop())]:
+                file.write(json.dumps([name, doc]) + '\n')
+        uids.append(run_bundle.start_doc['uid'])
+    cat = intake_bluesky.jsonl.BlueskyJSONLCatalog(str(tmp_path / '*.jsonl'))
+    runs = [cat[uid]() for uid in uids]
+    assert len(cat._tails) == 2
+    # A run whose file was dropped decodes it again.
+    runs[0].force_reload()
+    assert runs[0].metadata['stop'] is not None
+    assert len(cat._tails) == 2
+
+
+@pytest.mark.parametrize('watch', [True, 'polling'])
+def test_watch(tmp_path, monkeypatch, watch):
+    pytest.importorskip('watchdog')
+
+    def write_run():
+        run_bundle = event_model.compose_run()
+        serializer = Serializer(tmp_path)
+        serializer('start', run_bundle.start_doc)
+        serializer('stop', run_bundle.compose_stop())
+        serializer.close()
+        return run_bundle.start_doc['uid']
+
+    first_uid = write_run()
+    with intake_bluesky.jsonl.BlueskyJSONLCatalog(
+            str(tmp_path / '*.jsonl'), watch=watch) as cat:
+        assert list(cat) == [first_uid]
+
+        def fail(*args, **kwargs):
+            raise AssertionError("reload listed the directory")
+
+        # Reloads look only at the files that the watcher saw change.
+        monkeypatch.setattr('glob.glob', fail)
+        second_uid = write_run()
+        deadline = time.monotonic() + 10
+        while second_uid not in cat and time.monotonic() < deadline:
+            time.sleep(0.1)
+            cat.force_reload()
+        assert set(cat) == {first_uid, second_uid}
+        observer = cat._watcher._observer
+    # Closing the Catalog stops the watcher.
+    observer.join(timeout=10)
+    assert not observer.is_alive()
+
+
+def test_load_order_does_not_depend_on_concurrency(tmp_path, monkeypatch):
+    for _ in range(20):
+        run_bundle = event_model.compose_run()
+        serializer = Serializer(tmp_path)
+        serializer('start', run_bundle.start_doc)
+        serializer('stop', run_bundle.compose_stop())
+        serializer.close()
+    # An empty file (maybe being written) is skipped.
+    (tmp_path / 'empty.jsonl').touch()
+    path = str(tmp_path / '*.jsonl')
+    cat = intake_bluesky.jsonl.BlueskyJSONLCatalog(path)
+    assert len(cat) == 20
+    monkeypatch.setattr(intake_bluesky.jsonl.BlueskyJSONLCatalog,
+                        'LOAD_CONCURRENCY', 1)
+    serial_cat = intake_bluesky.jsonl.BlueskyJSONLCatalog(path)
+    assert list(cat) == list(serial_cat)
+
+
+def test_sqlite_index(tmp_path, monkeypatch):
+    runs_dir = tmp_path / 'runs'
+    runs_dir.mkdir()
+    stop_docs = {}
+    for scan_id in range(5):
+        metadata = {'scan_id': scan_id,
+                    'plan_name': 'count' if scan_id % 2 else 'scan'}
+        run_bundle = event_model.compose_run(metadata=metadata)
+        serializer = Serializer(runs_dir)
+        serializer('start', run_bundle.start_doc)
+        stop_doc = run_bundle.compose_stop()
+        serializer('stop', stop_doc)
+        serializer.close()
+        stop_docs[run_bundle.start_doc['uid']] = stop_doc
+    path = str(runs_dir / '*.jsonl')
+    db = str(tmp_path / 'index.sqlite')
+    cat = intake_bluesky.jsonl.BlueskyJSONLCatalog(path, sqlite_index=db)
+    assert set(cat) == set(stop_docs)
+    filenames = cat._filename_to_mtime
+    for filename, (start, stop) in cat._sqlite_index.get(filenames).items():
+        assert stop == stop_docs[start['uid']]
+    # The RunStop documents are in the entries' metadata.
+    for uid, stop_doc in stop_docs.items():
+        assert cat[uid].metadata['stop'] == stop_doc
+
+    # A new Catalog (as in a new process) reads no files that are unchanged.
+    def fail(filename):
+        raise AssertionError("read a file that is in the index")
+
+    monkeypatch.setattr(intake_bluesky.jsonl, '_read_run_start', fail)
+    indexed_cat = intake_bluesky.jsonl.BlueskyJSONLCatalog(path,
+                                                           sqlite_index=db)
+    assert list(indexed_cat) == list(cat)
+    for uid, stop_doc in stop_docs.items():
+        assert indexed_cat[uid].metadata['stop'] == stop_doc
+    monkeypatch.undo()
+
+    # Searches on summary fields are answered by SQL, with the same results
+    # as mongoquery.
+    plain_cat = intake_bluesky.jsonl.BlueskyJSONLCatalog(path)
+    queries = [{'scan_id': {'$gte': 1, '$lt': 4}},
+               {'plan_name': 'count'},
+               {'$or': [{'scan_id': 0}, {'plan_name': {'$in': ['count']}}]},
+               {'scan_id': {'$nin': [1, 2]}, 'time': {'$gt': 0}},
+               {'scan_id': {'$exists': False}},
+               {'plan_name': {'$ne': 'scan'}}]
+    for query in queries:
+        assert indexed_cat._sqlite_index.search(query) is not None
+        assert (list(indexed_cat.search(query))
+                == list(plain_cat.search(query)))
+    # Others are answered by mongoquery.
+    query = {'scan_id': {'$mod': [2, 0]}}
+    assert indexed_cat._sqlite_index.search(query) is None
+    assert list(indexed_cat.search(query)) == list(plain_cat.search(query))
+
+    # A file that has changed is read again.
+    filename = sorted(filenames)[0]
+    run_bundle = event_model.compose_run(metadata={'scan_id': 10})
+    with open(filename, 'w') as file:
+        file.write(json.dumps(['start', run_bundle.start_doc]) + '\n')
+    os.utime(filename, (0, 0))
+    cat = intake_bluesky.jsonl.BlueskyJSONLCatalog(path, sqlite_index=db)
+    assert run_bundle.start_doc['uid'] in cat
+    assert cat[run_bundle.start_doc['uid']].metadata['stop'] is None
+    results = cat.search({'scan_id': 10})
+    assert list(results) == [run_bundle.start_doc['uid']]
+
+    # Closing the Catalog closes the database, unless it is only search
+    # results, which share it. A later reload opens it again.
+    results.close()
+    assert cat._sqlite_index._connection is not None
+    with cat:
+        pass
+    assert cat._sqlite_index._connection is None
+    cat.force_reload()
+    assert list(cat.search({'scan_id': 10})) == [run_bundle.start_doc['uid']]
+    for catalog in (cat, indexed_cat, plain_cat):
+        catalog.close()
+
+
+def test_lazy_is_not_supported(tmp_path):
+    with pytest.raises(ValueError, match='use_index'):
+        intake_bluesky.jsonl.BlueskyJSONLCatalog(str(tmp_path / '*.jsonl'),
+                                                 lazy=True)
@@ -1,5 +1,9 @@
+import intake_bluesky.file_index
 import intake_bluesky.msgpack  # noqa
+import event_model
 import intake
+import msgpack
+import numpy
 from suitcase.msgpack import Serializer
 import os
 import pytest
@@ -61,3 +65,75 @@ sources:
     return types.SimpleNamespace(cat=cat,
                                  uid=uid,
                                  docs=docs)
+
+
+@pytest.fixture
+def file_format():
+    return types.SimpleNamespace(module=intake_bluesky.msgpack,
+                                 Catalog=intake_bluesky.msgpack.BlueskyMsgpackCatalog,
+                                 Serializer=Serializer)
+
+
+def test_live_run_is_decoded_incrementally(tmp_path):
+    run_bundle = event_model.compose_run()
+    filename = str(tmp_path / 'live.msgpack')
+    start = msgpack.packb(['start', run_bundle.start_doc])
+    stop_doc = run_bundle.compose_stop()
+    stop = msgpack.packb(['stop', stop_doc])
+    with open(filename, 'wb') as file:
+        file.write(start)
+        # A document that is still being written
+        file.write(stop[:10])
+        file.flush()
+        cat = intake_bluesky.msgpack.BlueskyMsgpackCatalog(filename)
+        run = cat[run_bundle.start_doc['uid']]()
+        assert run.metadata['stop'] is None
+        file.write(stop[10:])
+    run.force_reload()
+    assert run.metadata['stop']['uid'] == stop_doc['uid']
+
+
+def test_memory_map(tmp_path, monkeypatch):
+    run_bundle = event_model.compose_run()
+    desc_bundle = run_bundle.compose_descriptor(
+        name='primary',
+        data_keys={'image': {'dtype': 'array', 'shape': [10, 10],
+                             'source': ''}})
+    serializer = Serializer(tmp_path)
+    serializer('start', run_bundle.start_doc)
+    serializer('descriptor', desc_bundle.descriptor_doc)
+    for i in range(3):
+        serializer('event', desc_bundle.compose_event(
+            data={'image': numpy.full((10, 10), i)},
+            timestamps={'image': time.time()}))
+    serializer('stop', run_bundle.compose_stop())
+    serializer.close()
+    uid = run_bundle.start_doc['uid']
+    cat = intake_bluesky.msgpack.BlueskyMsgpackCatalog(str(tmp_path / '*'))
+    mapped_cat = intake_bluesky.msgpack.BlueskyMsgpackCatalog(
+        str(tmp_path / '*'), memory_map=True)
+    indexed_mapped_cat = intake_bluesky.msgpack.BlueskyMsgpackCatalog(
+        str(tmp_path / '*'), memory_map=True, use_index=True)
+    expected = cat[uid]().primary.read()
+    actual = mapped_cat.search({'uid': uid})[uid]().primary.read()
+    assert actual.equals(expected)
+    assert indexed_mapped_cat[uid]().primary.read().equals(expected)
+    # The arrays in the documents are views into the file.
+    for name, doc in mapped_cat[uid]().canonical_unfilled():
+        if name == 'event':
+            assert not doc['data']['image'].flags.writeable
+    # The indexed reader maps the file once for all the Events it reads.
+    maps = []
+    map_ = intake_bluesky.msgpack._map
+
+    def counting_map(file):
+        maps.append(file)
+        return map_(file)
+
+    monkeypatch.setattr(intake_bluesky.msgpack, '_map', counting_map)
+    filename, = serializer.artifacts['all']
+    reader = intake_bluesky.msgpack.IndexedRunReader(filename,
+                                                     memory_map=True)
+    pages = list(reader.get_event_pages(desc_bundle.descriptor_doc['uid']))
+    assert len(pages) == 3
+    assert len(maps) == 1
@@ -0,0 +1,264 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import event_model
+import intake
+import numpy
+import pytest
+import requests
+import threading
+import time
+import xarray
+
+from intake.cli.server.server import IntakeServer
+import tornado.httpserver
+import tornado.ioloop
+import tornado.testing
+
+import intake_bluesky.core as core
+from intake_bluesky.in_memory import BlueskyInMemoryCatalog
+from intake_bluesky.server import BlueskyIntakeServer, ServerCanonicalHandler
+
+
+def make_run(num_events=5):
+    "Return the documents of a run with fields of several dtypes and shapes."
+    run_bundle = event_model.compose_run()
+    docs = [('start', run_bundle.start_doc)]
+    data_keys = {
+        'x': {'source': '...', 'shape': [], 'dtype': 'number'},
+        'count': {'source': '...', 'shape': [], 'dtype': 'integer'},
+        'image': {'source': '...', 'shape': [3, 4], 'dtype': 'array'},
+        'label': {'source': '...', 'shape': [], 'dtype': 'string'}}
+    desc_bundle = run_bundle.compose_descriptor(data_keys=data_keys,
+                                                name='primary')
+    docs.append(('descriptor', desc_bundle.descriptor_doc))
+    for i in range(num_events):
+        data = {'x': i / 2,
+                'count': numpy.int32(i),
+                'image': numpy.full((3, 4), i, dtype=numpy.uint16),
+                'label': f'point {i}'}
+        docs.append(('event', desc_bundle.compose_event(
+            data=data, timestamps={key: time.time() for key in data},
+            seq_num=i + 1)))
+    docs.append(('stop', run_bundle.compose_stop()))
+    return docs
+
+
+def gen(docs):
+    yield from docs
+
+
+def sanitized(documents):
+    "Return (name, doc) pairs with arrays as lists, for comparison."
+    return [(name, event_model.sanitize_doc(doc)) for name, doc in documents]
+
+
+@pytest.fixture
+def catalog():
+    "A Catalog holding one run, and that run's documents."
+    docs = make_run()
+    cat = BlueskyInMemoryCatalog()
+    cat.upsert(gen, (docs,), {})
+    return cat, docs
+
+
+@pytest.fixture
+def http_requests(monkeypatch):
+    "Record the (method, url) of every HTTP request made with requests."
+    made = []
+    request = requests.Session.request
+
+    def recording_request(self, method, url, *args, **kwargs):
+        made.append((method.upper(), url))
+        return request(self, method, url, *args, **kwargs)
+
+    monkeypatch.setattr(requests.Session, 'request', recording_request)
+    return made
+
+
+@contextlib.contextmanager
+def serve(server_class, catalog):
+    """
+    Serve catalog from a thread, and yield the server's address.
+    """
+    started = threading.Event()
+    state = {}
+
+    def run():
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        app = server_class(catalog).make_app()
+        sock, port = tornado.testing.bind_unused_port()
+        http_server = tornado.httpserver.HTTPServer(app)
+        http_server.add_sockets([sock])
+        state['loop'] = tornado.ioloop.IOLoop.current()
+        state['port'] = port
+        started.set()
+        state['loop'].start()
+        http_server.stop()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    started.wait()
+    try:
+        yield f'intake://localhost:{state["port"]}'
+    finally:
+        state['loop'].add_callback(state['loop'].stop)
+        thread.join()
+
+
+def test_event_stream_round_trip(catalog):
+    cat, docs = catalog
+    uid = docs[0][1]['uid']
+    expected = cat[uid]().primary.read()
+    with serve(BlueskyIntakeServer, cat) as url:
+        stream = intake.Catalog(url)[uid]()['primary']()
+        assert isinstance(stream, core.RemoteBlueskyEventStream)
+        actual = stream.read()
+        lazy = stream.to_dask()
+        for ds in (actual, lazy):
+            assert set(ds.variables) == set(expected.variables)
+            for key, variable in expected.variables.items():
+                assert ds[key].dims == variable.dims
+                assert ds[key].dtype == variable.dtype
+                assert ds[key].shape == variable.shape
+        for key in expected.data_vars:
+            assert lazy[key].chunks is not None
+        xarray.testing.assert_identical(actual, expected)
+        xarray.testing.assert_identical(lazy.compute(), expected)
+
+
+def test_local_event_stream_is_an_xarray_source(catalog):
+    # Locally, streams have a container that intake can persist and export.
+    cat, docs = catalog
+    stream = cat[docs[0][1]['uid']]().primary()
+    assert stream.container == 'xarray'
+    assert 'xarray' in intake.container.container_map
+
+
+def test_opening_and_displaying_a_run_make_one_request(catalog,
+                                                       http_requests):
+    cat, docs = catalog
+    uid = docs[0][1]['uid']
+    with serve(BlueskyIntakeServer, cat) as url:
+        entry = intake.Catalog(url)[uid]
+        del http_requests[:]
+        run = entry()
+        assert isinstance(run, core.RemoteBlueskyRun)
+        # The response to 'open' has all that repr needs.
+        assert [method for method, _ in http_requests] == ['POST']
+        text = repr(run)
+        assert len(http_requests) == 1
+    assert uid in text
+    assert '* primary' in text
+
+
+def test_partition_cache_keys(catalog, http_requests, monkeypatch, tmp_path):
+    cat, docs = catalog
+    uid = docs[0][1]['uid']
+    monkeypatch.setattr(core.RemoteBlueskyRun, 'PARTITION_CACHE',
+                        core.PartitionCache(str(tmp_path)))
+
+    def partition_reads():
+        return sum(method == 'POST' and url.endswith('/v1/source')
+                   for method, url in http_requests)
+
+    with serve(BlueskyIntakeServer, cat) as url:
+        expected = sanitized(intake.Catalog(url)[uid]().canonical())
+        reads = partition_reads()
+        # A completed run is replayed from the cache.
+        assert sanitized(intake.Catalog(url)[uid]().canonical()) == expected
+        assert partition_reads() == reads + 1  # only the 'open'
+        # Entries that cannot be decoded are fetched again.
+        for path in tmp_path.glob('*.msgpack'):
+            path.write_bytes(path.read_bytes()[:10])
+        monkeypatch.setattr(core.RemoteBlueskyRun, 'PARTITION_CACHE',
+                            core.PartitionCache(str(tmp_path)))
+        assert sanitized(intake.Catalog(url)[uid]().canonical()) == expected
+        assert partition_reads() == reads + 3  # 'open' and the partition
+        reads = partition_reads()
+        # Partitions of another size are not mistaken for these.
+        monkeypatch.setattr(core.BlueskyRun, 'PARTITION_SIZE', 3)
+        run = intake.Catalog(url)[uid]()
+        assert run.npartitions == 3
+        assert sanitized(run.canonical()) == expected
+        assert partition_reads() > reads + 2
+
+
+def streamed(http_requests):
+    "Return the number of requests made to the streaming endpoint."
+    return sum(url.endswith(core.STREAMING_ENDPOINT)
+               for _, url in http_requests)
+
+
+def test_streaming_matches_partitions(catalog, http_requests, monkeypatch):
+    cat, docs = catalog
+    uid = docs[0][1]['uid']
+    # Send the run in several writes.
+    monkeypatch.setattr(ServerCanonicalHandler, 'BATCH_SIZE', 2)
+    monkeypatch.setattr(core, '_servers_without_streaming', set())
+    with serve(BlueskyIntakeServer, cat) as url:
+        run = intake.Catalog(url)[uid]()
+        streamed_docs = sanitized(run.canonical())
+        streamed_unfilled = sanitized(run.canonical_unfilled())
+        assert streamed(http_requests) == 2
+        monkeypatch.setattr(core.RemoteBlueskyRun, 'STREAMING', False)
+        run = intake.Catalog(url)[uid]()
+        assert streamed_docs == sanitized(run.canonical())
+        assert streamed_unfilled == sanitized(run.canonical_unfilled())
+        assert streamed(http_requests) == 2
+    assert streamed_docs == sanitized(docs)
+
+
+def test_streaming_falls_back_on_a_standard_server(catalog, http_requests,
+                                                   monkeypatch):
+    cat, docs = catalog
+    uid = docs[0][1]['uid']
+    monkeypatch.setattr(core, '_servers_without_streaming', set())
+    with serve(IntakeServer, cat) as url:
+        first = sanitized(intake.Catalog(url)[uid]().canonical())
+        second = sanitized(intake.Catalog(url)[uid]().canonical())
+    # Only the first run asked for the endpoint, and got a 404.
+    assert streamed(http_requests) == 1
+    assert core._servers_without_streaming == {
+        url.replace('intake://', 'http://') + '/'}
+    assert first == second == sanitized(docs)
+
+
+class ExclusiveFiller(event_model.Filler):
+    "A Filler that records whether it was ever called from two threads."
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.active = 0
+        self.overlapped = False
+        self.calls = 0
+
+    def __call__(self, name, doc, *args, **kwargs):
+        self.active += 1
+        self.calls += 1
+        if self.active > 1:
+            self.overlapped = True
+        time.sleep(0.001)
+        try:
+            return super().__call__(name, doc, *args, **kwargs)
+        finally:
+            self.active -= 1
+
+
+def test_concurrent_streams_of_one_run(monkeypatch):
+    docs = make_run(num_events=50)
+    uid = docs[0][1]['uid']
+    cat = BlueskyInMemoryCatalog()
+    cat.filler = filler = ExclusiveFiller({}, inplace=True)
+    cat.upsert(gen, (docs,), {})
+    monkeypatch.setattr(ServerCanonicalHandler, 'BATCH_SIZE', 1)
+    with serve(BlueskyIntakeServer, cat) as url:
+        run = intake.Catalog(url)[uid]()
+        http_url = url.replace('intake://', 'http://')
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            results = list(executor.map(
+                lambda _: sanitized(core.open_document_stream(
+                    http_url, {}, run._source_id, raw=False)),
+                range(2)))
+    assert results == [sanitized(docs)] * 2
+    assert filler.calls > 2 * 50  # each stream filled every Event
+    assert not filler.overlapped